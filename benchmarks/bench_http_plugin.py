@@ -0,0 +1,102 @@
+"""
+HTTPDownloadPlugin のベンチマーク
+接続ごとに帯域を絞ったローカルHTTPサーバーから、1本の接続と分割ダウンロードを比較する
+
+使い方:
+    python benchmarks/bench_http_plugin.py --size-mb 64 --per-connection-mbps 40
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plugins.http_plugin import HTTPDownloadPlugin  # noqa: E402
+
+
+def make_handler(data: bytes, per_connection_bps: float, latency: float):
+    """接続ごとの帯域と遅延を模擬するハンドラー"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency)
+            start, end = 0, len(data) - 1
+            header = self.headers.get("Range")
+            if header and header.startswith("bytes="):
+                first, _, last = header[6:].partition("-")
+                start, end = int(first), int(last) if last else end
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            else:
+                self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+
+            block = 64 * 1024
+            position = start
+            began = time.monotonic()
+            try:
+                while position <= end:
+                    chunk = data[position : min(position + block, end + 1)]
+                    self.wfile.write(chunk)
+                    position += len(chunk)
+                    # 帯域制限: 送信量に見合う時間まで待つ
+                    expected = (position - start) / per_connection_bps
+                    delay = expected - (time.monotonic() - began)
+                    if delay > 0:
+                        time.sleep(delay)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return Handler
+
+
+def run(plugin: HTTPDownloadPlugin, url: str, output_dir: str) -> float:
+    started = time.perf_counter()
+    job_id = plugin.download(url, output_dir)
+    while job_id in plugin.active_downloads:
+        if plugin.active_downloads[job_id]["status"] == "error":
+            raise RuntimeError(plugin.active_downloads[job_id].get("error"))
+        time.sleep(0.01)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--per-connection-mbps", type=float, default=40.0)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--segments", type=int, default=8)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    handler = make_handler(
+        data, args.per_connection_mbps * 1024 * 1024 / 8, args.latency_ms / 1000
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/bench.bin"
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        for label, segments in (("single", 1), ("segmented", args.segments)):
+            plugin = HTTPDownloadPlugin(segments=segments, min_segment_size=1 << 20)
+            elapsed = run(plugin, url, output_dir)
+            mbps = len(data) * 8 / elapsed / 1024 / 1024
+            print(f"{label:>10}: {elapsed:6.2f}s  {mbps:8.1f} Mbit/s")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+HTTPプラグインの受信ループのベンチマーク
+帯域制限なしのローカルHTTPサーバー（別プロセス）から1本の接続で取得し、
+以前の受信ループ（8KiBごとに時刻取得・全体平均の速度計算・dict更新）と現在のループの
+スループットと1GBあたりのCPU時間を比較する
+
+使い方:
+    python benchmarks/bench_http_throughput.py --size-mb 512
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from plugins.http_plugin import HTTPDownloadPlugin  # noqa: E402
+
+
+def legacy_stream(response, full_path: str, info: dict, total_size: int):
+    """以前の受信ループ"""
+    downloaded_size = 0
+    with response, open(full_path, "wb") as f:
+        start_time = time.time()
+        for chunk in response.iter_content(chunk_size=8192):
+            if info["status"] == "cancelled":
+                break
+            if chunk:
+                f.write(chunk)
+                downloaded_size += len(chunk)
+                elapsed_time = time.time() - start_time
+                speed = downloaded_size / max(elapsed_time, 1)
+                progress = downloaded_size / max(total_size, 1) if total_size > 0 else 0
+                info.update(
+                    {
+                        "downloaded_bytes": downloaded_size,
+                        "progress": progress,
+                        "speed": speed,
+                    }
+                )
+
+
+def start_server(directory: str):
+    """http.server を別プロセスで起動（サーバー側のCPU時間を計測に含めない）"""
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-u",
+            "-m",
+            "http.server",
+            "0",
+            "--bind",
+            "127.0.0.1",
+            "--directory",
+            directory,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    match = re.search(r"port (\d+)", process.stdout.readline())
+    return process, int(match.group(1))
+
+
+def measure(name: str, receive, url: str, path: str, size: int):
+    response = requests.get(url, stream=True)
+    response.raise_for_status()
+    info = {"status": "downloading"}
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    receive(response, path, info, size)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    assert os.path.getsize(path) == size
+    gigabytes = size / 1e9
+    print(
+        f"{name:>8}: {size * 8 / wall / 1e6:8.0f} Mbit/s  "
+        f"{cpu / gigabytes:6.2f} CPU s/GB"
+    )
+    return cpu / gigabytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--chunk-kb", type=int, default=1024)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "bench.bin"), "wb") as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(args.size_mb):
+                f.write(block)
+        process, port = start_server(directory)
+        url = f"http://127.0.0.1:{port}/bench.bin"
+        path = os.path.join(directory, "out.bin")
+
+        plugin = HTTPDownloadPlugin(chunk_size=args.chunk_kb * 1024)
+
+        def current(response, full_path, info, total_size):
+            plugin.active_downloads["bench"] = info
+            plugin._stream_download(response, full_path, "bench", total_size)
+
+        try:
+            before = measure("legacy", legacy_stream, url, path, size)
+            after = measure("current", current, url, path, size)
+            print(f"CPU per GB: {before / after:.1f}x less")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
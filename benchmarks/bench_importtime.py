@@ -0,0 +1,97 @@
+"""
+インポート時間のベンチマーク
+python -X importtime の結果を集計し、時間のかかるモジュールと前回の結果からの差分を表示する
+
+使い方:
+    python benchmarks/bench_importtime.py --save before.json
+    （変更後）
+    python benchmarks/bench_importtime.py --baseline before.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module: str) -> dict:
+    """モジュールごとの累積インポート時間（マイクロ秒）"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def best_of(module: str, repeat: int) -> dict:
+    """repeat 回計測してモジュールごとの最小値を取る（ディスクキャッシュなどの揺らぎを除く）"""
+    best = {}
+    for _ in range(repeat):
+        for name, micros in measure(module).items():
+            best[name] = min(micros, best.get(name, micros))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--save", help="結果をJSONで保存")
+    parser.add_argument(
+        "--baseline", help="比較する以前の結果（--save で保存したJSON）"
+    )
+    args = parser.parse_args()
+
+    timings = best_of(args.module, args.repeat)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    total = timings.get(args.module, 0)
+    print(f"import {args.module}: {total / 1000:.1f} ms (best of {args.repeat})")
+    if baseline:
+        before = baseline.get(args.module, 0)
+        print(
+            f"  baseline: {before / 1000:.1f} ms, delta: {(total - before) / 1000:+.1f} ms"
+        )
+
+    print(f"\n{'cumulative':>12} {'delta':>10}  module")
+    names = sorted(timings, key=timings.get, reverse=True)[: args.top]
+    for name in names:
+        delta = ""
+        if baseline:
+            delta = f"{(timings[name] - baseline.get(name, 0)) / 1000:+.1f}"
+        print(f"{timings[name] / 1000:>10.1f}ms {delta:>10}  {name}")
+
+    if baseline:
+        removed = sorted(
+            (name for name in baseline if name not in timings),
+            key=baseline.get,
+            reverse=True,
+        )[: args.top]
+        if removed:
+            print("\nno longer imported:")
+            for name in removed:
+                print(f"{-baseline[name] / 1000:>+10.1f}ms  {name}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(timings, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
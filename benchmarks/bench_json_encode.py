@@ -0,0 +1,94 @@
+"""
+APIレスポンスのJSONエンコードのベンチマーク
+/api/downloads と同じ形のジョブ一覧を、以前の方式（make_json_serializable で変換してから
+標準ライブラリでエンコード）と現在のエンコーダー（json / orjson）、キャッシュ済みのジョブレコードで比較する
+
+使い方:
+    python benchmarks/bench_json_encode.py --sizes 1000 10000 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DOWNLOAD_DIR", tempfile.mkdtemp(prefix="arial-bench-"))
+os.environ["JOB_STORE"] = "memory"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import encoding  # noqa: E402
+from core.records import JobRecord, encode_response  # noqa: E402
+from main import make_json_serializable  # noqa: E402
+
+
+def make_jobs(count: int) -> list:
+    now = datetime.now()
+    return [
+        {
+            "gid": f"{index:016x}",
+            "name": f"ファイル-{index}.mp4",
+            "url": f"https://example.com/videos/{index}",
+            "status": "active",
+            "progress": index / count,
+            "download_speed": 1024 * index,
+            "eta": timedelta(seconds=index),
+            "completed_length": 1024 * 1024 * index,
+            "total_length": 1 << 30,
+            "plugin_type": "youtube",
+            "created_at": now,
+            "updated_at": now,
+        }
+        for index in range(count)
+    ]
+
+
+def legacy(jobs: list) -> str:
+    """以前の方式（再帰的な変換の後に標準ライブラリでエンコード）"""
+    payload = make_json_serializable({"active": jobs, "completed": []})
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")) + "\n"
+
+
+def measure(func, repeat: int) -> float:
+    func()  # 初回（キャッシュの作成など）は計測しない
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    backends = ["json"] + (["orjson"] if encoding.ORJSON_AVAILABLE else [])
+    print(f"{'jobs':>8} {'method':>14} {'ms':>10} {'speedup':>8}")
+    for size in args.sizes:
+        jobs = make_jobs(size)
+        baseline = measure(lambda: legacy(jobs), args.repeat)
+        print(f"{size:>8} {'legacy':>14} {baseline * 1000:10.1f} {1:8.1f}x")
+
+        for backend in backends:
+            encoding.set_backend(backend)
+            plain = measure(
+                lambda: encoding.dumps({"active": jobs, "completed": []}), args.repeat
+            )
+            records = [JobRecord(job) for job in jobs]
+            cached = measure(
+                lambda: encode_response({"active": records, "completed": []}),
+                args.repeat,
+            )
+            for name, elapsed in ((backend, plain), (f"{backend}+cache", cached)):
+                print(
+                    f"{size:>8} {name:>14} {elapsed * 1000:10.1f} "
+                    f"{baseline / elapsed:8.1f}x"
+                )
+    encoding.set_backend("auto")
+
+
+if __name__ == "__main__":
+    run_benchmark()
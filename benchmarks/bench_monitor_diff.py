@@ -0,0 +1,155 @@
+"""
+監視ループの差分反映のベンチマーク
+合成したaria2のダウンロードを使い、1回の反映に掛かる時間を以前の方式（毎回dictを作り直して
+リストで削除判定）と現在の方式（tupleの比較で変化したジョブだけを更新）で比較する
+
+使い方:
+    python benchmarks/bench_monitor_diff.py --downloads 10000 --changed 0.05
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("DOWNLOAD_DIR", tempfile.mkdtemp(prefix="arial-bench-"))
+os.environ["JOB_STORE"] = "memory"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aria2p  # noqa: E402
+
+import main  # noqa: E402
+from core import Aria2Backend, Aria2Changes, BackendPool  # noqa: E402
+
+
+def make_struct(index: int, completed: int, speed: int) -> dict:
+    gid = f"{index:016x}"
+    total = 1 << 30
+    return {
+        "gid": gid,
+        "status": "active",
+        "totalLength": str(total),
+        "completedLength": str(completed),
+        "downloadSpeed": str(speed),
+        "dir": "/downloads",
+        "files": [
+            {
+                "index": "1",
+                "path": f"/downloads/file-{gid}.bin",
+                "length": str(total),
+                "completedLength": str(completed),
+                "selected": "true",
+                "uris": [{"uri": f"https://example.com/{gid}", "status": "used"}],
+            }
+        ],
+    }
+
+
+def make_tick(count: int, changed: float, rng: random.Random, state: list) -> list:
+    """前回の状態から changed の割合のダウンロードだけ進めたtellActiveの結果"""
+    for index in rng.sample(range(count), int(count * changed)):
+        completed, speed = state[index]
+        state[index] = (completed + speed, rng.randint(1, 10) * 1024 * 1024)
+    return [
+        aria2p.Download(None, make_struct(index, completed, speed))
+        for index, (completed, speed) in enumerate(state)
+    ]
+
+
+def legacy_apply(downloads: list):
+    """以前の方式（毎回全ジョブのdictを作り直し、削除判定はリストの線形探索）"""
+    current_gids = []
+    for download in downloads:
+        gid = download.gid
+        current_gids.append(gid)
+        eta_seconds = None
+        if download.eta and hasattr(download.eta, "total_seconds"):
+            eta_seconds = int(download.eta.total_seconds())
+        if gid in main.download_jobs:
+            job = main.download_jobs[gid]
+            before = dict(job)
+            job.update(
+                {
+                    "progress": float(download.progress) if download.progress else 0.0,
+                    "download_speed": (
+                        int(download.download_speed) if download.download_speed else 0
+                    ),
+                    "eta": eta_seconds,
+                    "completed_length": (
+                        int(download.completed_length)
+                        if download.completed_length
+                        else 0
+                    ),
+                    "total_length": (
+                        int(download.total_length) if download.total_length else 0
+                    ),
+                    "status": str(download.status),
+                    "updated_at": datetime.now().isoformat(),
+                }
+            )
+            if main.notify_job_changed(gid, before, job):
+                main.download_jobs[gid] = job
+        else:
+            main.download_jobs[gid] = {
+                "gid": gid,
+                "name": str(download.name),
+                "progress": 0.0,
+                "completed_length": int(download.completed_length),
+                "total_length": int(download.total_length),
+                "status": str(download.status),
+                "created_at": datetime.now().isoformat(),
+                "updated_at": datetime.now().isoformat(),
+            }
+    for gid in [gid for gid in main.download_jobs.keys() if gid not in current_gids]:
+        del main.download_jobs[gid]
+
+
+def run(name: str, apply, ticks: list) -> float:
+    main.open_job_store()
+    main.aria2_snapshots = main.JobSnapshots(main.ARIA2_FIELDS)
+    apply(ticks[0])  # 初回（全ジョブの追加）は計測しない
+
+    started = time.perf_counter()
+    for downloads in ticks[1:]:
+        apply(downloads)
+    per_tick = (time.perf_counter() - started) / (len(ticks) - 1)
+    print(f"{name:>8}: {per_tick * 1000:8.1f} ms/tick")
+    return per_tick
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--downloads", type=int, default=10000)
+    parser.add_argument("--changed", type=float, default=0.05)
+    parser.add_argument("--ticks", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    state = [(0, 0)] * args.downloads
+    ticks = [
+        make_tick(args.downloads, args.changed if i else 1.0, rng, state)
+        for i in range(args.ticks + 1)
+    ]
+
+    backend = Aria2Backend("aria0")
+    main.aria2_backends = BackendPool([backend])
+    print(
+        f"{args.downloads} downloads, {args.changed:.0%} changed per tick, "
+        f"{args.ticks} ticks"
+    )
+    before = run("legacy", legacy_apply, ticks)
+    after = run(
+        "delta",
+        lambda downloads: main.apply_aria2_changes(
+            backend, Aria2Changes(downloads, set(), True)
+        ),
+        ticks,
+    )
+    print(f" speedup: {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    run_benchmark()
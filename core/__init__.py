@@ -0,0 +1,66 @@
+# コアシステム
+
+from .aio import Aria2RPC, Aria2RPCError, AsyncAria2Client, EventLoopThread
+from .backends import Aria2Backend, BackendPool
+from .batch import add_uris_multicall, download_url, parse_url_lines
+from .diff import JobSnapshots, aria2_values, is_finished
+from .events import EventBroker, Subscription
+from .files import FileServer
+from .jobstore import MemoryJobStore, SQLiteJobStore, create_job_store
+from .metrics import REGISTRY, MetricsRegistry
+from .monitor import Aria2Changes, Aria2Monitor
+from .profiler import StackSampler
+from .records import JobRecord, encode_response
+from .registry import JobEntry, JobRegistry
+from .revision import RevisionTracker
+from .server import (
+    OwnerLock,
+    OwnerProxy,
+    gunicorn_options,
+    max_event_clients,
+    run_gunicorn,
+    start_internal_server,
+)
+from .state import JobState, StateSnapshot
+from .timing import PhaseTimer, TickHistory
+
+__all__ = [
+    "Aria2Backend",
+    "Aria2Changes",
+    "Aria2Monitor",
+    "Aria2RPC",
+    "Aria2RPCError",
+    "AsyncAria2Client",
+    "BackendPool",
+    "EventBroker",
+    "EventLoopThread",
+    "FileServer",
+    "JobEntry",
+    "JobRecord",
+    "JobRegistry",
+    "JobSnapshots",
+    "JobState",
+    "MemoryJobStore",
+    "MetricsRegistry",
+    "OwnerLock",
+    "OwnerProxy",
+    "PhaseTimer",
+    "REGISTRY",
+    "RevisionTracker",
+    "SQLiteJobStore",
+    "StackSampler",
+    "StateSnapshot",
+    "Subscription",
+    "TickHistory",
+    "add_uris_multicall",
+    "aria2_values",
+    "create_job_store",
+    "download_url",
+    "encode_response",
+    "gunicorn_options",
+    "is_finished",
+    "max_event_clients",
+    "parse_url_lines",
+    "run_gunicorn",
+    "start_internal_server",
+]
@@ -0,0 +1,352 @@
+"""
+非同期aria2クライアント
+1本のWebSocket接続でJSON-RPCをパイプライン実行する（asyncio・標準ライブラリのみ）
+"""
+
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import struct
+import threading
+from typing import Callable, List, Optional, Tuple
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class Aria2NotSent(ConnectionError):
+    """リクエストを送信する前に失敗した（aria2は処理していないので再送できる）"""
+
+
+class Aria2RPCError(Exception):
+    """aria2が返したJSON-RPCのエラー"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def _mask(data: bytes, key: bytes) -> bytes:
+    """WebSocketのマスク処理（整数演算でまとめてXORする）"""
+    if not data:
+        return data
+    repeated = (key * (len(data) // 4 + 1))[: len(data)]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(repeated, "big")).to_bytes(
+        len(data), "big"
+    )
+
+
+def encode_frame(payload: bytes, opcode: int = OP_TEXT, mask: bool = True) -> bytes:
+    """WebSocketフレームを作成（クライアントからはマスク必須）"""
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 1 << 16:
+        header.append(mask_bit | 126)
+        header += struct.pack("!H", length)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack("!Q", length)
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = _mask(payload, key)
+    return bytes(header) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[bool, int, bytes]:
+    """WebSocketフレームを1つ読む（fin, opcode, payload）"""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", await reader.readexactly(8))
+    key = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if key:
+        payload = _mask(payload, key)
+    return bool(first & 0x80), first & 0x0F, payload
+
+
+class AsyncAria2Client:
+    """aria2のWebSocket JSON-RPCクライアント
+
+    複数の呼び出しを応答を待たずに同じ接続へ送り、IDで応答を対応付ける。
+    接続が切れた場合は待機中の呼び出しを失敗させ、次の呼び出しで再接続する。
+    aria2からの通知（aria2.onDownloadStart など）は add_listener で受け取れる。
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6800,
+        secret: str = "",
+        path: str = "/jsonrpc",
+        timeout: float = 10.0,
+    ):
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.path = path
+        self.timeout = timeout
+
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._connect_lock = None
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._listeners: List[Callable] = []
+
+    @property
+    def connected(self) -> bool:
+        return self._reader_task is not None and not self._reader_task.done()
+
+    def add_listener(self, callback: Callable):
+        """通知のコールバックを登録（callback(method, gid)、イベントループ上で呼ばれる）"""
+        self._listeners.append(callback)
+
+    async def connect(self):
+        """接続してハンドシェイクを行う（接続済みなら何もしない）"""
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.connected:
+                return
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+            try:
+                await asyncio.wait_for(self._handshake(reader, writer), self.timeout)
+            except BaseException:
+                writer.close()
+                raise
+            self._reader, self._writer = reader, writer
+            self._reader_task = asyncio.ensure_future(self._read_loop())
+
+    async def _handshake(self, reader, writer):
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write(
+            (
+                f"GET {self.path} HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n\r\n"
+            ).encode()
+        )
+        await writer.drain()
+
+        response = await reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = response.decode("latin-1").split("\r\n")
+        if " 101 " not in f"{status_line} ":
+            raise ConnectionError(f"WebSocket upgrade failed: {status_line}")
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        expected = base64.b64encode(
+            hashlib.sha1((key + WS_GUID).encode()).digest()
+        ).decode()
+        if headers.get("sec-websocket-accept") != expected:
+            raise ConnectionError("Invalid Sec-WebSocket-Accept")
+
+    async def _read_loop(self):
+        """応答と通知を読み続ける"""
+        error = ConnectionError("aria2 connection closed")
+        message = b""
+        try:
+            while True:
+                fin, opcode, payload = await read_frame(self._reader)
+                if opcode == OP_PING:
+                    self._writer.write(encode_frame(payload, OP_PONG))
+                    continue
+                if opcode == OP_CLOSE:
+                    break
+                if opcode not in (OP_TEXT, OP_CONTINUATION):
+                    continue
+                message += payload
+                if not fin:
+                    continue
+                data, message = message, b""
+                self._dispatch(json.loads(data.decode("utf-8")))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            error = ConnectionError(f"aria2 connection lost: {e}")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._writer.close()
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    def _dispatch(self, message):
+        if isinstance(message, list):
+            for item in message:
+                self._dispatch(item)
+            return
+
+        if "id" not in message or message["id"] is None:
+            # 通知 {"method": "aria2.onDownloadStart", "params": [{"gid": ...}]}
+            method = message.get("method", "")
+            for event in message.get("params", []):
+                for listener in self._listeners:
+                    try:
+                        listener(method, event.get("gid"))
+                    except Exception as e:
+                        logging.error(f"aria2 notification listener failed: {e}")
+            return
+
+        future = self._pending.pop(message["id"], None)
+        if future is None or future.done():
+            return
+        if "error" in message:
+            error = message["error"]
+            future.set_exception(
+                Aria2RPCError(error.get("code", -1), error.get("message", ""))
+            )
+        else:
+            future.set_result(message.get("result"))
+
+    def _params(self, method: str, params: Optional[list]) -> list:
+        params = list(params or [])
+        if self.secret and method.startswith("aria2."):
+            params.insert(0, f"token:{self.secret}")
+        return params
+
+    async def _send(
+        self, method: str, params: Optional[list]
+    ) -> Tuple[int, asyncio.Future]:
+        """リクエストを送信し、(ID, 応答を受け取るFuture) を返す
+
+        フレームを書き込む前の失敗（接続できない・切断済み）は Aria2NotSent にする。
+        """
+        try:
+            if not self.connected:
+                await self.connect()
+            if self._writer.is_closing():
+                raise ConnectionError("aria2 connection closed")
+        except (OSError, asyncio.TimeoutError) as e:
+            raise Aria2NotSent(f"aria2 request not sent: {e}") from e
+        msg_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[msg_id] = future
+        payload = json.dumps(
+            {
+                "jsonrpc": "2.0",
+                "id": msg_id,
+                "method": method,
+                "params": self._params(method, params),
+            }
+        ).encode("utf-8")
+        try:
+            self._writer.write(encode_frame(payload))
+            await self._writer.drain()
+        except BaseException:
+            self._pending.pop(msg_id, None)
+            raise
+        return msg_id, future
+
+    async def call(self, method: str, params: Optional[list] = None):
+        """メソッドを呼び出して結果を返す"""
+        msg_id, future = await self._send(method, params)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            # タイムアウトした呼び出しの応答待ちを残さない
+            self._pending.pop(msg_id, None)
+
+    async def gather(self, calls: List[Tuple[str, list]]) -> list:
+        """複数の呼び出しをまとめて送り、結果（失敗は例外オブジェクト）を順に返す"""
+        sent = []
+        try:
+            for method, params in calls:
+                sent.append(await self._send(method, params))
+            return await asyncio.wait_for(
+                asyncio.gather(*(future for _, future in sent), return_exceptions=True),
+                self.timeout,
+            )
+        finally:
+            for msg_id, _ in sent:
+                self._pending.pop(msg_id, None)
+
+    async def close(self):
+        if self._reader_task is not None:
+            if self._writer is not None and not self._writer.is_closing():
+                self._writer.write(encode_frame(b"", OP_CLOSE))
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+
+
+class EventLoopThread:
+    """バックグラウンドスレッドで動くイベントループ
+
+    Flaskのルートなど同期コードから run() でコルーチンを実行する。
+    """
+
+    def __init__(self, name: str = "aria2-rpc"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name=name, daemon=True
+        )
+        self._thread.start()
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """コルーチンを実行して結果を待つ"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def submit(self, coro):
+        """コルーチンを実行（結果は concurrent.futures.Future で受け取る）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+class Aria2RPC:
+    """同期コードから使う aria2 RPC（共有のイベントループと接続を使う）"""
+
+    def __init__(self, client: AsyncAria2Client, loop: EventLoopThread = None):
+        self.client = client
+        self.loop = loop or EventLoopThread()
+
+    @property
+    def connected(self) -> bool:
+        return self.client.connected
+
+    def call(self, method: str, *params):
+        return self.loop.run(
+            self.client.call(method, list(params)), self.client.timeout + 1
+        )
+
+    def gather(self, calls: List[Tuple[str, list]]) -> list:
+        return self.loop.run(self.client.gather(calls), self.client.timeout + 1)
+
+    def connect(self):
+        self.loop.run(self.client.connect(), self.client.timeout + 1)
+
+    def add_listener(self, callback: Callable):
+        self.client.add_listener(callback)
+
+    def close(self):
+        self.loop.run(self.client.close(), 5)
@@ -0,0 +1,384 @@
+"""
+aria2バックエンド
+複数のaria2（起動するローカルプロセス・リモートのRPC）をまとめ、負荷の低いものへジョブを割り当てる
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aria2p
+import requests
+
+from .aio import Aria2NotSent, Aria2RPC, AsyncAria2Client, EventLoopThread
+from .metrics import REGISTRY
+
+ARIA2_RPC_SECONDS = REGISTRY.histogram(
+    "arial_aria2_rpc_duration_seconds",
+    "aria2 RPC call latency",
+    ("backend", "method"),
+)
+
+# WebSocketで送信済みかもしれない時にHTTPで送り直してよいメソッド（読み取りと、同じ値の設定）
+# aria2.addUri などは aria2 が既に処理している可能性があるため送り直さない
+IDEMPOTENT_METHODS = frozenset(
+    (
+        "aria2.getVersion",
+        "aria2.getGlobalStat",
+        "aria2.getGlobalOption",
+        "aria2.getOption",
+        "aria2.getFiles",
+        "aria2.getUris",
+        "aria2.tellStatus",
+        "aria2.tellActive",
+        "aria2.tellWaiting",
+        "aria2.tellStopped",
+        "aria2.changeOption",
+        "aria2.changeGlobalOption",
+        "system.listMethods",
+    )
+)
+# WebSocketの呼び出しのタイムアウト（Python 3.8〜3.10 では asyncio と
+# concurrent.futures の TimeoutError は OSError の派生ではない別のクラス）
+RPC_TIMEOUT_ERRORS = (asyncio.TimeoutError, FutureTimeoutError, TimeoutError)
+
+
+class Aria2Backend:
+    """1つのaria2インスタンス
+
+    spawn=True の場合は aria2c をローカルで起動する（host は localhost）。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        host: str = "localhost",
+        port: int = 6800,
+        secret: str = "",
+        spawn: bool = False,
+        download_dir: Optional[str] = None,
+        scheme: str = "http",
+    ):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.spawn = spawn
+        self.download_dir = download_dir
+        self.scheme = scheme
+
+        self.process = None
+        self.api = None
+        self.rpc = None
+        self.monitor = None
+        # 最後に設定した帯域の上限（全体・GIDごと。0は無制限、Noneと未登録は不明）
+        self._overall_limit = None
+        self._download_limits = {}
+
+    @property
+    def available(self) -> bool:
+        return self.api is not None
+
+    def start(self, loop: EventLoopThread = None, timeout: float = 10.0) -> bool:
+        """aria2に接続する
+
+        spawn=True の場合、ポートで既にaria2が動いていればそれを使い、
+        無ければaria2cを起動して aria2.getVersion に応答するまで待つ（最大 timeout 秒）。
+        """
+        try:
+            probe = aria2p.Client(
+                host=f"{self.scheme}://{self.host}",
+                port=self.port,
+                secret=self.secret,
+                timeout=1.0,
+            )
+            version = self._probe(probe)
+            if version is not None:
+                logging.info(f"aria2 {version} already running on port {self.port}")
+            elif self.spawn:
+                self.process = subprocess.Popen(self._command())
+                version = self._wait_ready(probe, timeout)
+            else:
+                # リモートは後から起動されることもあるため接続だけ用意しておく
+                logging.warning(f"aria2 backend {self.name} is not responding")
+
+            self.api = aria2p.API(
+                aria2p.Client(
+                    host=f"{self.scheme}://{self.host}",
+                    port=self.port,
+                    secret=self.secret,
+                )
+            )
+            if self.scheme == "http":
+                # WebSocket（TLS無し）が使える場合は共有の非同期接続で呼び出す
+                self.rpc = Aria2RPC(
+                    AsyncAria2Client(
+                        host=self.host, port=self.port, secret=self.secret
+                    ),
+                    loop,
+                )
+            logging.info(f"aria2 backend {self.name} ready ({self.host}:{self.port})")
+            return True
+        except Exception as e:
+            logging.error(f"Failed to start aria2 backend {self.name}: {e}")
+            if self.process is not None and self.process.poll() is None:
+                self.process.terminate()
+            self.process = None
+            return False
+
+    def _command(self) -> List[str]:
+        command = [
+            "aria2c",
+            "--enable-rpc",
+            "--rpc-listen-all",
+            "--rpc-allow-origin-all",
+            f"--rpc-listen-port={self.port}",
+            "--continue=true",
+            "--max-connection-per-server=16",
+            "--min-split-size=1M",
+            "--split=16",
+        ]
+        if self.secret:
+            command.append(f"--rpc-secret={self.secret}")
+        if self.download_dir:
+            command.append(f"--dir={self.download_dir}")
+        return command
+
+    @staticmethod
+    def _probe(client: aria2p.Client) -> Optional[str]:
+        """aria2のバージョンを返す（接続できなければNone、認証エラーなどは例外）"""
+        try:
+            return client.call("aria2.getVersion")["version"]
+        except requests.RequestException:
+            return None
+
+    def _wait_ready(self, client: aria2p.Client, timeout: float) -> str:
+        """起動したaria2cが応答するまで指数バックオフで待つ"""
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while True:
+            version = self._probe(client)
+            if version is not None:
+                return version
+            if self.process.poll() is not None:
+                raise RuntimeError(f"aria2c exited with code {self.process.returncode}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"aria2c did not respond within {timeout}s")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 1.0)
+
+    def call(self, method: str, *params):
+        """RPCを呼び出す（共有のWebSocket接続を優先し、不可ならHTTP）
+
+        HTTPで送り直すのは、WebSocketで送信する前に失敗した場合と、
+        送り直しても結果が変わらないメソッド（IDEMPOTENT_METHODS）だけ。
+        """
+        with ARIA2_RPC_SECONDS.labels(self.name, method).time():
+            if self.rpc is not None:
+                try:
+                    return self.rpc.call(method, *params)
+                except Aria2NotSent as e:
+                    logging.debug(f"aria2 WebSocket RPC unavailable ({self.name}): {e}")
+                except (OSError,) + RPC_TIMEOUT_ERRORS as e:
+                    if method not in IDEMPOTENT_METHODS:
+                        raise
+                    logging.debug(f"aria2 WebSocket RPC failed ({self.name}): {e!r}")
+            return self.api.client.call(method, list(params))
+
+    def set_download_limits(self, overall: int, per_gid: dict):
+        """帯域の上限を設定（前回から変わった値だけRPCで送る）
+
+        overall は aria2.changeGlobalOption の max-overall-download-limit、
+        per_gid はaria2のGIDごとの max-download-limit（バイト/秒、0は無制限）。
+        設定した値が分からないジョブ（外部から追加されたものなど）には必ず送る。
+        """
+        applied = {}
+        for gid, limit in per_gid.items():
+            if self._download_limits.get(gid) != limit:
+                try:
+                    self.call(
+                        "aria2.changeOption", gid, {"max-download-limit": str(limit)}
+                    )
+                except Exception as e:
+                    # 完了・削除された直後のジョブは設定できない（次回に再試行する）
+                    logging.debug(f"Failed to limit {gid} on {self.name}: {e}")
+                    continue
+            applied[gid] = limit
+        self._download_limits = applied
+        if overall != self._overall_limit:
+            self.call(
+                "aria2.changeGlobalOption",
+                {"max-overall-download-limit": str(overall)},
+            )
+            self._overall_limit = overall
+
+    def note_download_limit(self, gid: str, limit: int):
+        """aria2.addUri のオプションで設定したジョブの上限を記録する"""
+        self._download_limits[gid] = limit
+
+    def load(self) -> Optional[tuple]:
+        """割り当て用の負荷（小さいほど空いている。応答が無ければNone）
+
+        (アクティブ+待機中のジョブ数, 合計ダウンロード速度, -空きディスク容量)
+        """
+        try:
+            stat = self.call("aria2.getGlobalStat")
+        except Exception as e:
+            logging.warning(f"aria2 backend {self.name} unavailable: {e}")
+            return None
+
+        free = 0
+        if self.spawn and self.download_dir:
+            try:
+                free = shutil.disk_usage(self.download_dir).free
+            except OSError:
+                pass
+        return (
+            int(stat.get("numActive", 0)) + int(stat.get("numWaiting", 0)),
+            int(stat.get("downloadSpeed", 0)),
+            -free,
+        )
+
+    def stop(self):
+        if self.monitor is not None:
+            self.monitor.stop()
+        if self.process is not None:
+            self.process.terminate()
+
+
+class BackendPool:
+    """aria2バックエンドの集合
+
+    バックエンドが複数ある場合、GIDは "<名前>:<aria2のGID>" の形で名前空間を分ける。
+    1つだけの場合はaria2のGIDをそのまま使う（従来と同じ）。
+    """
+
+    def __init__(self, backends: List[Aria2Backend]):
+        if not backends:
+            raise ValueError("At least one aria2 backend is required")
+        self.backends = backends
+        self._by_name = {backend.name: backend for backend in backends}
+        if len(self._by_name) != len(backends):
+            raise ValueError("aria2 backend names must be unique")
+        self._loop = None
+
+    @classmethod
+    def from_env(cls, download_dir: str) -> "BackendPool":
+        """ARIA2_BACKENDS から作成
+
+        カンマ区切りで "[名前=]local[:ポート]" （aria2cを起動）または
+        "[名前=]http://[シークレット@]ホスト:ポート" （起動済みのaria2）を指定する。
+        """
+        spec = os.getenv("ARIA2_BACKENDS", "local:6800")
+        return cls(parse_backends(spec, download_dir))
+
+    @property
+    def namespaced(self) -> bool:
+        return len(self.backends) > 1
+
+    @property
+    def available(self) -> List[Aria2Backend]:
+        return [backend for backend in self.backends if backend.available]
+
+    def start(self, timeout: float = 10.0) -> bool:
+        """全バックエンドを並行して起動（1つでも使えればTrue）"""
+        # 全バックエンドのRPCを1つのイベントループで扱う
+        self._loop = EventLoopThread()
+        with ThreadPoolExecutor(max_workers=len(self.backends)) as executor:
+            results = list(
+                executor.map(
+                    lambda backend: backend.start(self._loop, timeout), self.backends
+                )
+            )
+        return any(results)
+
+    def qualify(self, backend: Aria2Backend, gid: str) -> str:
+        """aria2のGIDを外部に公開するGIDに変換"""
+        return f"{backend.name}:{gid}" if self.namespaced else gid
+
+    def resolve(self, gid: str) -> Tuple[Aria2Backend, str]:
+        """公開GIDから (バックエンド, aria2のGID) を求める"""
+        name, sep, raw = gid.partition(":")
+        if sep and name in self._by_name:
+            return self._by_name[name], raw
+        return self.backends[0], gid
+
+    def owns(self, backend: Aria2Backend, gid: str) -> bool:
+        """公開GIDがこのバックエンドのジョブかどうか"""
+        if gid.startswith("plugin_"):
+            return False
+        if not self.namespaced:
+            return True
+        return gid.startswith(f"{backend.name}:")
+
+    def assign(self, count: int = 1) -> List[Aria2Backend]:
+        """新しいジョブ count 件の割り当て先（負荷の低い順、割り当て分も負荷に加える）"""
+        available = self.available
+        loads = []
+        for backend in available:
+            # 1つしか無ければ負荷を問い合わせる必要はない
+            load = backend.load() if len(available) > 1 else (0, 0, 0)
+            if load is not None:
+                loads.append([list(load), backend])
+        if not loads:
+            raise ConnectionError("No aria2 backend available")
+
+        placement = []
+        for _ in range(count):
+            entry = min(loads, key=lambda item: item[0])
+            placement.append(entry[1])
+            entry[0][0] += 1
+        return placement
+
+    def choose(self) -> Aria2Backend:
+        """新しいジョブ1件の割り当て先"""
+        return self.assign(1)[0]
+
+    def stop(self):
+        for backend in self.backends:
+            backend.stop()
+
+
+def parse_backends(spec: str, download_dir: str) -> List[Aria2Backend]:
+    """ARIA2_BACKENDS の書式を解析"""
+    backends = []
+    for index, entry in enumerate(item.strip() for item in spec.split(",")):
+        if not entry:
+            continue
+        name, sep, target = entry.partition("=")
+        if not sep or "://" in name:
+            name, target = f"aria{index}", entry
+
+        if target == "local" or target.startswith("local:"):
+            port = int(target.partition(":")[2] or 6800)
+            backends.append(
+                Aria2Backend(
+                    name,
+                    port=port,
+                    spawn=True,
+                    secret=os.getenv("ARIA2_SECRET", ""),
+                    download_dir=download_dir,
+                )
+            )
+        else:
+            parts = urlsplit(target)
+            if not parts.hostname:
+                raise ValueError(f"Invalid aria2 backend: {entry}")
+            backends.append(
+                Aria2Backend(
+                    name,
+                    host=parts.hostname,
+                    port=parts.port or 6800,
+                    secret=parts.username or "",
+                    scheme="https" if parts.scheme in ("https", "wss") else "http",
+                )
+            )
+    return backends
@@ -0,0 +1,68 @@
+"""
+一括登録
+URLリストの解析と、aria2への system.multicall による一括追加
+"""
+
+from typing import Iterable, List, Optional, Tuple
+
+# 1回のmulticallに含める追加数（大きすぎるとaria2の応答が遅くなる）
+MULTICALL_CHUNK_SIZE = 500
+
+
+def parse_url_lines(lines: Iterable) -> List[str]:
+    """改行区切りのURLリストを解析（空行と # で始まる行は無視）"""
+    urls = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.strip()
+        if line and not line.startswith("#"):
+            urls.append(line)
+    return urls
+
+
+def download_url(download) -> str:
+    """aria2のダウンロードの取得元URL（無ければ空文字）"""
+    try:
+        for file in download.files:
+            for uri in file.uris:
+                return uri["uri"]
+    except Exception:
+        pass
+    return ""
+
+
+def add_uris_multicall(
+    client,
+    urls: List[str],
+    options: dict = None,
+    chunk_size: int = MULTICALL_CHUNK_SIZE,
+) -> List[Tuple[Optional[str], Optional[str]]]:
+    """URLごとに aria2.addUri を system.multicall でまとめて呼び出す
+
+    戻り値は URL と同じ順の (gid, エラーメッセージ) のリスト。
+    """
+    results = []
+    for start in range(0, len(urls), chunk_size):
+        chunk = urls[start : start + chunk_size]
+        methods = [
+            {
+                "methodName": client.ADD_URI,
+                "params": [[url], dict(options)] if options else [[url]],
+            }
+            for url in chunk
+        ]
+        try:
+            responses = client.multicall(methods)
+        except Exception as e:
+            results.extend((None, str(e)) for _ in chunk)
+            continue
+
+        for response in responses:
+            if isinstance(response, list) and response:
+                results.append((response[0], None))
+            elif isinstance(response, dict):
+                results.append((None, response.get("message", "aria2 error")))
+            else:
+                results.append((None, "unexpected aria2 response"))
+    return results
@@ -0,0 +1,94 @@
+"""
+ジョブの差分検出
+監視対象のフィールドをジョブごとに tuple で保持し、前回から変化したフィールドだけを求める
+"""
+
+from typing import Dict, Iterable, Optional, Sequence, Set
+
+# aria2のジョブで監視するフィールド
+ARIA2_FIELDS = (
+    "status",
+    "completed_length",
+    "total_length",
+    "download_speed",
+    "progress",
+    "eta",
+)
+
+# プラグインのジョブで監視するフィールド
+PLUGIN_FIELDS = (
+    "name",
+    "status",
+    "completed_length",
+    "total_length",
+    "download_speed",
+    "progress",
+    "eta",
+)
+
+
+class JobSnapshots:
+    """ジョブごとの監視対象フィールドの値（tuple）
+
+    変化の無いジョブはtupleの比較1回で済むため、毎回dictを作り直す必要が無い。
+    """
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = tuple(fields)
+        self._rows: Dict[str, tuple] = {}
+
+    def diff(self, gid: str, values: tuple) -> Optional[dict]:
+        """前回から変化したフィールドを返して記録を更新（初回は全フィールド、変化なしはNone）"""
+        old = self._rows.get(gid)
+        if old == values:
+            return None
+        self._rows[gid] = values
+        if old is None:
+            return dict(zip(self.fields, values))
+        return {
+            field: value
+            for field, value, previous in zip(self.fields, values, old)
+            if value != previous
+        }
+
+    def get(self, gid: str) -> Optional[dict]:
+        values = self._rows.get(gid)
+        return None if values is None else dict(zip(self.fields, values))
+
+    def discard(self, gid: str):
+        self._rows.pop(gid, None)
+
+    def retain(self, gids: Iterable[str]) -> Set[str]:
+        """gids 以外の記録を削除し、削除したGIDを返す"""
+        stale = self._rows.keys() - set(gids)
+        for gid in stale:
+            del self._rows[gid]
+        return stale
+
+    def __contains__(self, gid) -> bool:
+        return gid in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+def aria2_values(download) -> tuple:
+    """aria2p.Download から ARIA2_FIELDS の値を作成
+
+    aria2p の progress はパーセント、eta は速度0のとき timedelta.max になるため、
+    ここでは 0〜1 の割合と秒数（不明ならNone）を長さと速度から計算する。
+    """
+    completed = download.completed_length or 0
+    total = download.total_length or 0
+    speed = download.download_speed or 0
+    progress = min(completed / total, 1.0) if total else 0.0
+    eta = int((total - completed) / speed) if speed and total > completed else None
+    return (str(download.status), completed, total, speed, progress, eta)
+
+
+def is_finished(fields: dict) -> bool:
+    """完了（または削除）したジョブかどうか"""
+    total = fields.get("total_length") or 0
+    return fields.get("status") in ("complete", "removed") or (
+        total > 0 and (fields.get("completed_length") or 0) >= total
+    )
@@ -0,0 +1,100 @@
+"""
+JSONエンコーダー
+orjson があれば使い、無ければ標準ライブラリの json にフォールバックする
+
+どちらも datetime・timedelta・Path・ジョブレコードをそのまま扱えるため、
+make_json_serializable のような事前の変換は不要。出力はキー順でコンパクトな形式。
+"""
+
+import json
+import os
+from collections.abc import Mapping
+from datetime import date, datetime, timedelta
+from typing import Any
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 使用中のエンコーダー（"orjson" / "json"）
+_backend = "orjson" if ORJSON_AVAILABLE else "json"
+
+
+def default(obj: Any):
+    """JSONで直接扱えない値の変換"""
+    if isinstance(obj, timedelta):
+        return int(obj.total_seconds())
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, os.PathLike):
+        return str(obj)
+    if isinstance(obj, Mapping):
+        # JobRecord など dict 以外のマッピング
+        return dict(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+if ORJSON_AVAILABLE:
+    # datetime は orjson がそのまま扱う（isoformat() と同じ表記になる）
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+
+def set_backend(name: str) -> str:
+    """エンコーダーを選択（"auto" / "orjson" / "json"）して、実際に使うものを返す"""
+    global _backend
+    name = (name or "auto").lower()
+    if name not in ("auto", "orjson", "json"):
+        raise ValueError(f"Unknown JSON encoder: {name}")
+    _backend = "orjson" if name != "json" and ORJSON_AVAILABLE else "json"
+    return _backend
+
+
+def get_backend() -> str:
+    return _backend
+
+
+def dumps(obj: Any) -> str:
+    """キー順・コンパクトな形式でJSONにする"""
+    if _backend == "orjson":
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS).decode()
+    return json.dumps(
+        obj, sort_keys=True, separators=(",", ":"), ensure_ascii=True, default=default
+    )
+
+
+def loads(text):
+    if _backend == "orjson":
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+class FastJSONProvider(JSONProvider):
+    """jsonify などFlaskのJSON処理を dumps/loads で行うプロバイダー
+
+    app.json = FastJSONProvider(app) で設定する。
+    """
+
+    mimetype = "application/json"
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            # indent などの指定がある場合は標準ライブラリで処理する
+            kwargs.setdefault("default", default)
+            return json.dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(f"{dumps(obj)}\n", mimetype=self.mimetype)
@@ -0,0 +1,117 @@
+"""
+イベント配信
+ジョブの差分をServer-Sent Eventsの購読者ごとにまとめて配信する
+"""
+
+import threading
+import time
+from typing import List, Tuple
+
+
+class Subscription:
+    """購読者ごとの未送信イベントキュー
+
+    同じジョブへの更新は1件にまとめ（coalesce）、未送信が上限を超えた場合は
+    個別イベントを破棄して再同期（resync）を要求する。
+    """
+
+    def __init__(self, max_pending: int = 1000):
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._resync = False
+
+    def push(self, job_id: str, event_type: str, data: dict):
+        """イベントを追加（同じジョブの未送信イベントとは統合する）"""
+        with self._cond:
+            if self._resync:
+                # 再同期待ちの間は個別イベントを溜めない
+                return
+
+            pending = self._pending.get(job_id)
+            if pending is not None:
+                if event_type == pending[0] == "job":
+                    pending[1].update(data)
+                else:
+                    self._pending[job_id] = (event_type, dict(data))
+            elif len(self._pending) >= self.max_pending:
+                # バックプレッシャー: 遅いクライアントには全件再取得させる
+                self._pending.clear()
+                self._resync = True
+            else:
+                self._pending[job_id] = (event_type, dict(data))
+
+            self._cond.notify()
+
+    def wait(self, timeout: float) -> Tuple[List[Tuple[str, dict]], bool]:
+        """イベントを待って取り出す（イベント一覧, 再同期が必要か）"""
+        with self._cond:
+            if not self._pending and not self._resync:
+                self._cond.wait(timeout)
+
+            events = list(self._pending.values())
+            resync = self._resync
+            self._pending = {}
+            self._resync = False
+            return events, resync
+
+
+class EventBroker:
+    """ジョブイベントの配信管理"""
+
+    def __init__(
+        self,
+        max_pending: int = 1000,
+        max_clients: int = 100,
+        min_interval: float = 0.25,
+    ):
+        self.max_pending = max_pending
+        self.max_clients = max_clients
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    @property
+    def client_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> Subscription:
+        """購読を開始（上限に達している場合はNone）"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            subscription = Subscription(self.max_pending)
+            # 購読者一覧は置き換えで更新し、publish側でロックを取らずに済むようにする
+            self._subscribers = self._subscribers + [subscription]
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """購読を終了"""
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscription]
+
+    def publish(self, job_id: str, event_type: str, data: dict):
+        """全購読者へイベントを配信"""
+        for subscription in self._subscribers:
+            subscription.push(job_id, event_type, data)
+
+    def stream(self, subscription: Subscription, keepalive: float = 15.0):
+        """購読者へ送る (イベント種別, データ) を順に返すジェネレーター
+
+        イベントが無い間は (None, None) を返してキープアライブの送信に使う。
+        """
+        while True:
+            started = time.monotonic()
+            events, resync = subscription.wait(keepalive)
+
+            if resync:
+                yield "resync", {}
+            for event_type, data in events:
+                yield event_type, data
+            if not events and not resync:
+                yield None, None
+
+            # 短時間の更新はまとめて送る
+            elapsed = time.monotonic() - started
+            if elapsed < self.min_interval:
+                time.sleep(self.min_interval - elapsed)
@@ -0,0 +1,115 @@
+"""
+ファイル配信
+完了したファイルを Range・条件付きリクエスト（ETag / If-Range）に対応して返す
+
+本体の送信はWSGIサーバーの wsgi.file_wrapper（gunicornでは sendfile）に任せるか、
+X-Sendfile / X-Accel-Redirect でフロントのプロキシ（Apache / nginx）に任せる。
+"""
+
+import os
+from typing import Optional
+from urllib.parse import quote, unquote
+
+from flask import Response, request
+from werkzeug.utils import send_file
+from werkzeug.wsgi import FileWrapper
+
+# 配信方法（direct: アプリから送信 / x-sendfile: Apache など / x-accel: nginx）
+FILE_SERVE_MODES = ("direct", "x-sendfile", "x-accel")
+# wsgi.file_wrapper が無いサーバー（開発サーバーなど）で1回に読む量
+FILE_BUFFER_SIZE = 1024 * 1024
+
+# オーナー以外のワーカーにファイルの送信を任せるためのヘッダー（外部には返さない）
+OWNER_TOKEN_HEADER = "X-Arial-Owner-Token"
+LOCAL_FILE_HEADER = "X-Arial-File"
+LOCAL_FILE_NAME_HEADER = "X-Arial-File-Name"
+
+
+def file_etag(stat: os.stat_result) -> str:
+    """更新日時とサイズから作るETag（内容を読まずに求められる）"""
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+class FileServer:
+    """完了したファイルのレスポンスを作る"""
+
+    def __init__(
+        self, mode: str = "direct", accel_prefix: str = "/protected/", root: str = ""
+    ):
+        if mode not in FILE_SERVE_MODES:
+            raise ValueError(f"Unknown file serve mode: {mode}")
+        self.mode = mode
+        self.accel_prefix = "/" + accel_prefix.strip("/") + "/"
+        self.root = os.path.abspath(root) if root else ""
+
+    def _accel_uri(self, path: str) -> Optional[str]:
+        """X-Accel-Redirect の内部URI（root の外のファイルはNone）"""
+        if not self.root:
+            return None
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            return None
+        return self.accel_prefix + quote(relative.replace(os.sep, "/"))
+
+    def send(self, path: str, download_name: str) -> Response:
+        """path を添付ファイルとして返す"""
+        stat = os.stat(path)
+        accel_uri = self._accel_uri(path) if self.mode == "x-accel" else None
+        if self.mode == "direct" or (self.mode == "x-accel" and accel_uri is None):
+            return send_file(
+                path,
+                request.environ,
+                as_attachment=True,
+                download_name=download_name,
+                conditional=True,
+                etag=file_etag(stat),
+                last_modified=stat.st_mtime,
+                response_class=Response,
+            )
+
+        # 本体はフロントのプロキシが送る（Range・条件付きリクエストもプロキシが処理する）
+        response = send_file(
+            path,
+            request.environ,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=False,
+            etag=file_etag(stat),
+            last_modified=stat.st_mtime,
+            use_x_sendfile=True,
+            response_class=Response,
+        )
+        if accel_uri is not None:
+            del response.headers["X-Sendfile"]
+            response.headers["X-Accel-Redirect"] = accel_uri
+        return response
+
+
+def local_file_response(path: str, download_name: str) -> Response:
+    """転送元のワーカーにファイルの送信を任せるレスポンス（本文なし）"""
+    response = Response(status=204)
+    response.headers[LOCAL_FILE_HEADER] = quote(path)
+    response.headers[LOCAL_FILE_NAME_HEADER] = quote(download_name)
+    return response
+
+
+def read_local_file(headers) -> Optional[tuple]:
+    """local_file_response() のヘッダーから (パス, ファイル名) を取り出す"""
+    path = headers.get(LOCAL_FILE_HEADER)
+    if not path:
+        return None
+    return unquote(path), unquote(headers.get(LOCAL_FILE_NAME_HEADER, ""))
+
+
+def install_file_wrapper(app, buffer_size: int = FILE_BUFFER_SIZE):
+    """wsgi.file_wrapper の無いサーバーでファイルを大きな単位で読んで送る"""
+    wsgi_app = app.wsgi_app
+
+    def with_file_wrapper(environ, start_response):
+        environ.setdefault(
+            "wsgi.file_wrapper",
+            lambda file, size=buffer_size: FileWrapper(file, max(size, buffer_size)),
+        )
+        return wsgi_app(environ, start_response)
+
+    app.wsgi_app = with_file_wrapper
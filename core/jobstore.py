@@ -0,0 +1,477 @@
+"""
+ジョブストア
+ダウンロードジョブをメモリまたはSQLite（WALモード）に保存する
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping, MutableMapping
+from typing import Iterable, List, Optional, Set, Tuple
+
+from .records import JobRecord, as_record
+
+_MISSING = object()
+
+# 保存形式のバージョン（1: data 列を JobRecord.to_json() の形式に、2: url 列を追加）
+SCHEMA_VERSION = 2
+
+
+def _match(job: dict, statuses, plugins, default_status) -> bool:
+    """ステータス・プラグイン種別の絞り込み条件に一致するか"""
+    if statuses and job.get("status", default_status) not in statuses:
+        return False
+    if plugins and job.get("plugin_type", "aria2") not in plugins:
+        return False
+    return True
+
+
+def _page(items: list, limit: Optional[int], offset: int) -> list:
+    end = None if limit is None else offset + limit
+    return items[offset:end]
+
+
+def find_urls(jobs: Mapping, urls: Iterable[str]) -> dict:
+    """GID → ジョブのマッピングから urls のジョブを探して URL → GID で返す"""
+    urls = set(urls)
+    return {job["url"]: gid for gid, job in jobs.items() if job.get("url") in urls}
+
+
+def query_jobs(
+    jobs: Mapping,
+    statuses: Optional[Set[str]] = None,
+    plugins: Optional[Set[str]] = None,
+    gids: Optional[Iterable[str]] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    default_status: Optional[str] = None,
+) -> Tuple[int, List[dict]]:
+    """GID → ジョブのマッピングを絞り込んで (総件数, ページ) で返す"""
+    if gids is not None:
+        items = [jobs[gid] for gid in gids if gid in jobs]
+    else:
+        items = list(jobs.values())
+    if statuses or plugins:
+        items = [job for job in items if _match(job, statuses, plugins, default_status)]
+    return len(items), _page(items, limit, offset)
+
+
+class MemoryJobTable(dict):
+    """メモリ上のジョブテーブル（従来のdictと同じ動作、ジョブは JobRecord で保持）"""
+
+    def __init__(self, default_status: Optional[str] = None):
+        super().__init__()
+        self.default_status = default_status
+
+    def __setitem__(self, gid: str, job: dict):
+        super().__setitem__(gid, as_record(job))
+
+    def query(
+        self,
+        statuses: Optional[Set[str]] = None,
+        plugins: Optional[Set[str]] = None,
+        gids: Optional[Iterable[str]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> Tuple[int, List[dict]]:
+        """条件に一致するジョブを (総件数, ページ) で返す"""
+        return query_jobs(
+            self, statuses, plugins, gids, limit, offset, self.default_status
+        )
+
+    def find_urls(self, urls: Iterable[str], version: Optional[int] = None) -> dict:
+        """urls のうち登録済みのものを URL → GID で返す"""
+        return find_urls(self, urls)
+
+
+class MemoryJobStore:
+    """メモリ上のジョブストア（再起動で履歴は失われる）"""
+
+    def table(self, name: str, default_status: Optional[str] = None, cached=True):
+        return MemoryJobTable(default_status)
+
+    def batch(self):
+        return contextlib.nullcontext()
+
+    def close(self):
+        pass
+
+
+class SQLiteJobTable(MutableMapping):
+    """SQLiteに保存されるジョブテーブル（dict互換）
+
+    cached=True の場合は全件をメモリにも保持し、書き込みのみSQLiteへ反映する。
+    cached=False の場合はGIDの一覧だけを保持し、内容は必要な時にSQLiteから読む。
+    """
+
+    def __init__(
+        self,
+        store: "SQLiteJobStore",
+        name: str,
+        default_status: Optional[str] = None,
+        cached: bool = False,
+    ):
+        self.store = store
+        self.name = name
+        self.default_status = default_status
+        self.cached = cached
+
+        rows = store._fetchall(
+            "SELECT gid, data FROM jobs WHERE tbl = ? ORDER BY seq", (name,)
+        )
+        if cached:
+            # 内容は値を読むまで解析しない（一覧はJSONのまま返せる）
+            self._jobs = {gid: JobRecord.from_json(data) for gid, data in rows}
+            self._gids = self._jobs
+        else:
+            self._jobs = None
+            # 挿入順を保つためdictをキー集合として使う
+            self._gids = dict.fromkeys(gid for gid, _ in rows)
+
+    def __getitem__(self, gid: str) -> dict:
+        if self.cached:
+            return self._jobs[gid]
+        if gid not in self._gids:
+            raise KeyError(gid)
+        job = self.store._pending_get(self.name, gid)
+        if job is _MISSING:
+            rows = self.store._fetchall(
+                "SELECT data FROM jobs WHERE tbl = ? AND gid = ?", (self.name, gid)
+            )
+            if not rows:
+                raise KeyError(gid)
+            job = JobRecord.from_json(rows[0][0])
+        return job
+
+    def __setitem__(self, gid: str, job: dict):
+        job = as_record(job)
+        if self.cached:
+            self._jobs[gid] = job
+        else:
+            self._gids[gid] = None
+        self.store._write(self, gid, job)
+
+    def __delitem__(self, gid: str):
+        if self.cached:
+            del self._jobs[gid]
+        else:
+            del self._gids[gid]
+        self.store._write(self, gid, None)
+
+    def __contains__(self, gid) -> bool:
+        return gid in self._gids
+
+    def __iter__(self):
+        return iter(list(self._gids))
+
+    def __len__(self) -> int:
+        return len(self._gids)
+
+    def values(self):
+        if self.cached:
+            return self._jobs.values()
+        return super().values()
+
+    def copy(self) -> dict:
+        return {gid: self[gid] for gid in self}
+
+    def query(
+        self,
+        statuses: Optional[Set[str]] = None,
+        plugins: Optional[Set[str]] = None,
+        gids: Optional[Iterable[str]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        version: Optional[int] = None,
+    ) -> Tuple[int, List[dict]]:
+        """条件に一致するジョブを (総件数, ページ) で返す
+
+        cached=False の場合はコミット済みの行だけを読む（保留中の書き込みはコミットしない）。
+        version（version() の値）を渡すと、その後に追加された行も除く。
+        """
+        if self.cached:
+            return query_jobs(
+                self._jobs, statuses, plugins, gids, limit, offset, self.default_status
+            )
+
+        # 履歴はSQL側で絞り込み・ページングしてメモリに全件を載せない
+        where = ["tbl = ?"]
+        params = [self.name]
+        if version is not None:
+            where.append("seq <= ?")
+            params.append(version)
+        if gids is not None:
+            gids = list(dict.fromkeys(gids))
+            rows = {}
+            # SQLiteの変数の上限を超えないように分けて読む
+            for start in range(0, len(gids), 500):
+                chunk = gids[start : start + 500]
+                rows.update(
+                    self.store._fetchall(
+                        f"SELECT gid, data FROM jobs WHERE {' AND '.join(where)} "
+                        f"AND gid IN ({','.join('?' * len(chunk))})",
+                        params + chunk,
+                    )
+                )
+            jobs = {gid: JobRecord.from_json(rows[gid]) for gid in gids if gid in rows}
+            return query_jobs(
+                jobs, statuses, plugins, None, limit, offset, self.default_status
+            )
+        if statuses:
+            where.append(f"status IN ({','.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if plugins:
+            where.append(f"plugin_type IN ({','.join('?' * len(plugins))})")
+            params.extend(plugins)
+        condition = " AND ".join(where)
+
+        total = self.store._fetchall(
+            f"SELECT COUNT(*) FROM jobs WHERE {condition}", params
+        )[0][0]
+        rows = self.store._fetchall(
+            f"SELECT data FROM jobs WHERE {condition} ORDER BY seq LIMIT ? OFFSET ?",
+            params + [-1 if limit is None else limit, offset],
+        )
+        return total, [JobRecord.from_json(data) for (data,) in rows]
+
+    def find_urls(self, urls: Iterable[str], version: Optional[int] = None) -> dict:
+        """urls のうち登録済みのものを URL → GID で返す（url 列の索引で探す）
+
+        cached=False の場合は query() と同じくコミット済みの行（version まで）だけを読む。
+        """
+        if self.cached:
+            return find_urls(self._jobs, urls)
+        urls = list(dict.fromkeys(urls))
+        condition = "tbl = ?"
+        params = [self.name]
+        if version is not None:
+            condition += " AND seq <= ?"
+            params.append(version)
+        known = {}
+        for start in range(0, len(urls), 500):
+            chunk = urls[start : start + 500]
+            # 同じURLのジョブが複数あれば最後に登録されたものを返す
+            known.update(
+                self.store._fetchall(
+                    f"SELECT url, gid FROM jobs WHERE {condition} "
+                    f"AND url IN ({','.join('?' * len(chunk))}) ORDER BY seq",
+                    params + chunk,
+                )
+            )
+        return known
+
+    def version(self) -> int:
+        """コミット済みの内容の版（query() の version に渡す）"""
+        return self.store.committed_seq
+
+
+class SQLiteJobStore:
+    """SQLite（WALモード）のジョブストア
+
+    batch() の中での書き込みはまとめて1つのトランザクションでコミットする。
+    まとめる単位はスレッドごとで、他のスレッドの batch() の外での書き込み（APIの操作など）は
+    監視ループのまとめた書き込みを待たずにすぐコミットされる。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        tbl TEXT NOT NULL,
+        gid TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        status TEXT,
+        plugin_type TEXT,
+        completed_at TEXT,
+        data TEXT NOT NULL,
+        url TEXT,
+        PRIMARY KEY (tbl, gid)
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_gid ON jobs (gid);
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (tbl, status);
+    CREATE INDEX IF NOT EXISTS idx_jobs_completed_at ON jobs (tbl, completed_at);
+    CREATE INDEX IF NOT EXISTS idx_jobs_seq ON jobs (tbl, seq);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._migrate()
+        # 以前の形式では url 列が無いため、索引は移行の後に作る
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_url ON jobs (tbl, url)")
+
+        self._seq = self._conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM jobs"
+        ).fetchone()[0]
+        # スレッドID → batch() の深さ / 保留中の書き込み
+        self._batch_depth = {}
+        self._pending = {}
+
+    def _migrate(self):
+        """以前の形式の行を JobRecord の形式で書き直し、url 列を埋める"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        rows = self._conn.execute("SELECT tbl, gid, data FROM jobs").fetchall()
+        self._conn.execute("BEGIN")
+        try:
+            if "url" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN url TEXT")
+            records = [
+                (JobRecord(json.loads(data)), tbl, gid) for tbl, gid, data in rows
+            ]
+            self._conn.executemany(
+                "UPDATE jobs SET data = ?, url = ? WHERE tbl = ? AND gid = ?",
+                [
+                    (record.to_json(), record.get("url"), tbl, gid)
+                    for record, tbl, gid in records
+                ],
+            )
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def table(self, name: str, default_status: Optional[str] = None, cached=False):
+        return SQLiteJobTable(self, name, default_status, cached)
+
+    @property
+    def committed_seq(self) -> int:
+        """最後にコミットした行の seq（行の seq は追加時に振られ、更新では変わらない）"""
+        return self._seq
+
+    @contextlib.contextmanager
+    def batch(self):
+        """書き込みをまとめて1トランザクションでコミットする"""
+        thread = threading.get_ident()
+        with self._lock:
+            self._batch_depth[thread] = self._batch_depth.get(thread, 0) + 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth[thread] -= 1
+                if self._batch_depth[thread] == 0:
+                    del self._batch_depth[thread]
+                    self.flush()
+
+    def flush(self):
+        """このスレッドの保留中の書き込み（と、batch() の外で失敗した書き込み）をコミット
+
+        他のスレッドが batch() の中で保留している書き込みはコミットしない。
+        """
+        with self._lock:
+            thread = threading.get_ident()
+            threads = [
+                other
+                for other, pending in self._pending.items()
+                if pending and (other == thread or other not in self._batch_depth)
+            ]
+            if not threads:
+                return
+            # 同じ行への書き込みは _write で1つのスレッドにだけ残している
+            pending = {}
+            for other in threads:
+                pending.update(self._pending[other])
+
+            # コミットに失敗した場合に書き直せるよう、保留中の書き込みはコミット後に消す
+            seq = self._seq
+            upserts = []
+            deletes = []
+            for (name, gid), (table, job) in pending.items():
+                if job is None:
+                    deletes.append((name, gid))
+                    continue
+                seq += 1
+                upserts.append(
+                    (
+                        name,
+                        gid,
+                        seq,
+                        job.get("status", table.default_status),
+                        job.get("plugin_type", "aria2"),
+                        job.get("completed_at"),
+                        job.to_json(),
+                        job.get("url"),
+                    )
+                )
+
+            self._conn.execute("BEGIN")
+            try:
+                if deletes:
+                    self._conn.executemany(
+                        "DELETE FROM jobs WHERE tbl = ? AND gid = ?", deletes
+                    )
+                if upserts:
+                    # 既存行は登録順（seq）を保ったまま内容だけ更新する
+                    self._conn.executemany(
+                        "INSERT INTO jobs "
+                        "(tbl, gid, seq, status, plugin_type, completed_at, data, url) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (tbl, gid) DO UPDATE SET "
+                        "status = excluded.status, "
+                        "plugin_type = excluded.plugin_type, "
+                        "completed_at = excluded.completed_at, "
+                        "data = excluded.data, "
+                        "url = excluded.url",
+                        upserts,
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._seq = seq
+            for other in threads:
+                del self._pending[other]
+
+    def close(self):
+        with self._lock:
+            self._batch_depth.clear()
+            self.flush()
+            self._conn.close()
+
+    def _write(self, table: SQLiteJobTable, gid: str, job: Optional[dict]):
+        thread = threading.get_ident()
+        key = (table.name, gid)
+        with self._lock:
+            # 他のスレッドが保留している同じ行への書き込みは、この新しい内容で置き換える
+            for other, pending in self._pending.items():
+                if other != thread:
+                    pending.pop(key, None)
+            # 行内容はその時点の内容で保存する（後からの変更は再設定で反映）
+            self._pending.setdefault(thread, {})[key] = (
+                table,
+                None if job is None else job.copy(),
+            )
+            if thread not in self._batch_depth:
+                self.flush()
+
+    def _pending_get(self, name: str, gid: str):
+        with self._lock:
+            for pending in self._pending.values():
+                entry = pending.get((name, gid))
+                if entry is not None:
+                    return entry[1]
+        return _MISSING
+
+    def _fetchall(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+
+def create_job_store(kind: str, path: str):
+    """設定からジョブストアを作成"""
+    if kind == "memory":
+        return MemoryJobStore()
+    if kind == "sqlite":
+        return SQLiteJobStore(path)
+    raise ValueError(f"Unknown job store: {kind}")
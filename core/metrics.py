@@ -0,0 +1,305 @@
+"""
+メトリクス
+OpenMetrics（Prometheusのテキスト形式の後継）で公開するカウンター・ゲージ・ヒストグラム（標準ライブラリのみ）
+
+値は監視ループなどが発生時に更新し、/metrics の取得時は集計済みの値を書き出すだけにする。
+"""
+
+import abc
+import bisect
+import math
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from flask import Response, g, request
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# 秒単位の処理時間向け（1ms〜60s）
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+# ジョブの所要時間・待ち時間向け（1s〜1日）
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 21600, 86400)
+# 転送速度向け（bytes/s、64KiB/s〜1GiB/s）
+THROUGHPUT_BUCKETS = tuple(float(64 * 1024 * 4**i) for i in range(8))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra=()) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(abc.ABC):
+    """ラベルごとの値を持つメトリクスの共通部分
+
+    HELP/TYPE にはファミリー名（name）を使い、_total・_created などの接尾辞はサンプルにだけ付ける。
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values):
+        """ラベルの値を指定した子メトリクス"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """ラベルの組ごとの値"""
+
+    @abc.abstractmethod
+    def _samples(self, values, child) -> List[str]:
+        """子メトリクスのサンプル行"""
+
+    def collect(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines.extend(self._samples(values, child))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self.created = time.time()
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        self.value = float(value)
+
+
+class Counter(_Metric):
+    """増加のみのカウンター"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        # サンプル名の _total はファミリー名に含めない
+        if name.endswith("_total"):
+            name = name[: -len("_total")]
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self, values, child) -> List[str]:
+        labels = _format_labels(self.labelnames, values)
+        return [
+            f"{self.name}_total{labels} {_format_value(child.value)}",
+            f"{self.name}_created{labels} {_format_value(child.created)}",
+        ]
+
+
+class Gauge(_Metric):
+    """現在値"""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _samples(self, values, child) -> List[str]:
+        labels = _format_labels(self.labelnames, values)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.created = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self.observe)
+
+
+class _Timer:
+    def __init__(self, observe):
+        self._observe = observe
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._observe(time.perf_counter() - self._started)
+
+
+class Histogram(_Metric):
+    """バケットごとの件数・合計・件数"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        """with ブロックの所要時間を記録する"""
+        return self.labels().time()
+
+    def _samples(self, values, child) -> List[str]:
+        with child._lock:
+            counts, total = list(child.counts), child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            labels = _format_labels(
+                self.labelnames, values, [("le", _format_value(bound))]
+            )
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        lines.append(f"{self.name}_created{labels} {_format_value(child.created)}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスの登録と書き出し"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # モジュールの再読み込みなどで同じ定義が来た場合は既存のものを使う
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Metric {metric.name} already registered")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """OpenMetricsのテキスト形式"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def init_app(self, app, path: str = "/metrics"):
+        """/metrics の公開とAPIの処理時間の計測を登録"""
+        latency = self.histogram(
+            "arial_http_request_duration_seconds",
+            "HTTP request handling time",
+            ("method", "route", "status"),
+        )
+
+        def start_timer():
+            g._metrics_started = time.perf_counter()
+
+        def record_latency(response):
+            started = g.pop("_metrics_started", None)
+            if started is not None and request.path != path:
+                # パスそのままでは値が増え続けるためルールのパターンで集計する
+                route = request.url_rule.rule if request.url_rule else "other"
+                latency.labels(request.method, route, response.status_code).observe(
+                    time.perf_counter() - started
+                )
+            return response
+
+        app.before_request(start_timer)
+        app.after_request(record_latency)
+        app.add_url_rule(
+            path,
+            "metrics",
+            lambda: Response(self.render(), content_type=CONTENT_TYPE),
+        )
+
+
+# プロセス共通のレジストリ
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,191 @@
+"""
+aria2モニター
+WebSocket通知を購読し、変化のあったジョブとアクティブなジョブだけを取得する
+"""
+
+import logging
+import threading
+import time
+from typing import List, NamedTuple, Set
+
+import aria2p
+
+from .aio import Aria2RPCError
+
+
+class Aria2Changes(NamedTuple):
+    """1回の取得で得られたaria2の変更内容"""
+
+    downloads: list  # 状態を反映すべき aria2p.Download
+    removed: Set[str]  # aria2から消えたGID
+    full: bool  # 全件取得かどうか（Trueなら downloads に無いGIDは削除扱い）
+
+
+class Aria2Monitor:
+    """aria2の通知を利用した差分モニター
+
+    WebSocket通知（onDownloadStart/Pause/Stop/Complete/Error）を受け取ったGIDと
+    tellActive で得られる転送中のジョブだけを取得する。
+    WebSocketが利用できない場合は従来通り全件ポーリングにフォールバックする。
+    rpc（core.aio.Aria2RPC）を渡すと、通知の購読と差分取得を共有の非同期接続で行い、
+    tellActive と各GIDの tellStatus を1回のパイプラインで取得する。
+    """
+
+    def __init__(
+        self,
+        api: aria2p.API,
+        resync_interval: float = 60.0,
+        retry_interval: float = 10.0,
+        listen_timeout: int = 1,
+        rpc=None,
+    ):
+        self.api = api
+        self.rpc = rpc
+        self.resync_interval = resync_interval
+        self.retry_interval = retry_interval
+        self.listen_timeout = listen_timeout
+
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._needs_full_sync = True
+        self._last_full_sync = 0.0
+        self._last_listen_attempt = 0.0
+        if rpc is not None:
+            rpc.add_listener(lambda method, gid: self.mark_dirty(gid))
+
+    @property
+    def mode(self) -> str:
+        """現在の動作モード（"events" または "polling"）"""
+        return "events" if self._is_listening() else "polling"
+
+    def start(self):
+        """通知の購読を開始（失敗してもポーリングで動作する）"""
+        self._last_listen_attempt = time.monotonic()
+        try:
+            if self.rpc is not None:
+                # 通知は共有の接続で受け取る（コールバックは登録済み）
+                self.rpc.connect()
+            else:
+                if self.api.listener is not None:
+                    self.api.stop_listening()
+                self.api.listen_to_notifications(
+                    threaded=True,
+                    on_download_start=self._on_notification,
+                    on_download_pause=self._on_notification,
+                    on_download_stop=self._on_notification,
+                    on_download_complete=self._on_notification,
+                    on_download_error=self._on_notification,
+                    on_bt_download_complete=self._on_notification,
+                    timeout=self.listen_timeout,
+                )
+        except Exception as e:
+            logging.warning(f"aria2 notifications unavailable, using polling: {e}")
+        # 購読開始までの取りこぼしを防ぐため、次回は必ず全件同期する
+        self._needs_full_sync = True
+
+    def stop(self):
+        """通知の購読を停止"""
+        try:
+            if self.rpc is not None:
+                self.rpc.close()
+            else:
+                self.api.stop_listening()
+        except Exception as e:
+            logging.debug(f"Failed to stop aria2 listener: {e}")
+
+    def mark_dirty(self, gid: str):
+        """次回の取得で状態を確認するGIDを登録"""
+        with self._lock:
+            self._dirty.add(gid)
+
+    def _on_notification(self, api, gid: str):
+        """aria2からの通知コールバック"""
+        self.mark_dirty(gid)
+
+    def _is_listening(self) -> bool:
+        if self.rpc is not None:
+            return self.rpc.connected
+        listener = getattr(self.api, "listener", None)
+        return listener is not None and listener.is_alive()
+
+    def fetch(self) -> Aria2Changes:
+        """前回から変化したダウンロードを取得"""
+        now = time.monotonic()
+
+        if not self._is_listening():
+            # WebSocketが切れている場合は定期的に再接続を試みる
+            if now - self._last_listen_attempt >= self.retry_interval:
+                self.start()
+            if not self._is_listening():
+                self._needs_full_sync = True
+
+        if (
+            self._needs_full_sync
+            or not self._is_listening()
+            or now - self._last_full_sync >= self.resync_interval
+        ):
+            return self._full_sync(now)
+
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+
+        try:
+            if self.rpc is not None:
+                downloads, removed = self._fetch_pipelined(dirty)
+            else:
+                downloads, removed = self._fetch_sequential(dirty)
+        except Exception:
+            # 取りこぼしを避けるため次回は全件同期する
+            self._needs_full_sync = True
+            raise
+
+        return Aria2Changes(downloads, removed, False)
+
+    def _fetch_sequential(self, dirty: Set[str]):
+        downloads = [
+            aria2p.Download(self.api, struct)
+            for struct in self.api.client.tell_active()
+        ]
+        seen = {download.gid for download in downloads}
+
+        removed = set()
+        for gid in dirty - seen:
+            try:
+                downloads.append(
+                    aria2p.Download(self.api, self.api.client.tell_status(gid))
+                )
+            except aria2p.ClientException:
+                # aria2側で既に削除されている
+                removed.add(gid)
+        return downloads, removed
+
+    def _fetch_pipelined(self, dirty: Set[str]):
+        gids = list(dirty)
+        results = self.rpc.gather(
+            [("aria2.tellActive", [])] + [("aria2.tellStatus", [gid]) for gid in gids]
+        )
+        if isinstance(results[0], Exception):
+            raise results[0]
+        downloads = [aria2p.Download(self.api, struct) for struct in results[0]]
+        seen = {download.gid for download in downloads}
+
+        removed = set()
+        for gid, result in zip(gids, results[1:]):
+            if gid in seen:
+                continue
+            if isinstance(result, Aria2RPCError):
+                removed.add(gid)
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                downloads.append(aria2p.Download(self.api, result))
+        return downloads, removed
+
+    def _full_sync(self, now: float) -> Aria2Changes:
+        """全ダウンロードを取得（ポーリングモード・再同期用）"""
+        with self._lock:
+            self._dirty.clear()
+        downloads: List = self.api.get_downloads()
+        self._needs_full_sync = False
+        self._last_full_sync = now
+        return Aria2Changes(downloads, set(), True)
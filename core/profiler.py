@@ -0,0 +1,90 @@
+"""
+サンプリングプロファイラー
+指定したスレッドのスタックを一定間隔で採取し、flamegraph.pl や speedscope で読める形式で保存する
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+
+class StackSampler:
+    """1つのスレッドのスタックを start() から stop() まで採取する
+
+    sys._current_frames() で他のスレッドのフレームを読むため、対象の処理には手を入れない。
+    採取は start() している間だけ行うので、それ以外の時間は待機しているだけになる。
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64, keep: int = 20):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread_id = None
+        self._samples = Counter()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def start(self, thread_id: int):
+        """thread_id のスレッドの採取を開始"""
+        with self._lock:
+            self._thread_id = thread_id
+            self._samples = Counter()
+        self._active.set()
+
+    def stop(self) -> Counter:
+        """採取を止めて結果（スタック → 採取回数）を返す"""
+        self._active.clear()
+        with self._lock:
+            samples, self._samples = self._samples, Counter()
+            self._thread_id = None
+        return samples
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            with self._lock:
+                frame = sys._current_frames().get(self._thread_id)
+                if frame is not None:
+                    self._samples[self._collapse(frame)] += 1
+            time.sleep(self.interval)
+
+    def _collapse(self, frame) -> str:
+        """スタックを "外側;...;内側" の1行にまとめる"""
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def dump(self, samples: Counter, directory: str) -> Optional[str]:
+        """採取結果を保存してパスを返す（古いファイルは keep 件まで残す）"""
+        if not samples:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory, f"tick-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.folded"
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        dumps = sorted(
+            name
+            for name in os.listdir(directory)
+            if name.startswith("tick-") and name.endswith(".folded")
+        )
+        for name in dumps[: -self.keep]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+        return path
@@ -0,0 +1,217 @@
+"""
+ジョブレコード
+__slots__ で属性を持つ軽量なジョブと、JSON表現のキャッシュ
+
+ジョブは dict と同じように扱える（job["status"]、job.get()、job.update() など）。
+日時は設定された値（ISO形式の文字列など）をそのまま保持し、読み出し・JSONでも変わらない。
+比較用の数値（UNIX時刻）は timestamp() で最初に必要になった時に求めてキャッシュする。
+JSON表現は最初に必要になった時に作ってキャッシュし、値を変更すると破棄する。
+"""
+
+from collections.abc import Mapping, MutableMapping
+from datetime import datetime
+from typing import Iterable, Optional
+
+from .encoding import dumps, loads
+
+JOB_FIELDS = (
+    "gid",
+    "name",
+    "url",
+    "status",
+    "progress",
+    "download_speed",
+    "eta",
+    "completed_length",
+    "total_length",
+    "plugin_type",
+    "created_at",
+    "updated_at",
+    "completed_at",
+    "file_path",
+)
+TIMESTAMP_FIELDS = frozenset(("created_at", "updated_at", "completed_at"))
+_FIELD_SET = frozenset(JOB_FIELDS)
+
+
+def _to_timestamp(value) -> Optional[float]:
+    """日時の値（ISO形式の文字列・datetime・数値）をUNIX時刻に変換（不明な形式ならNone）
+
+    タイムゾーンの無い日時はローカル時刻として扱う。
+    """
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+class JobRecord(MutableMapping):
+    """1件のジョブ（dict互換）
+
+    JOB_FIELDS は __slots__ の属性に、それ以外のキーは _extra に入れる。
+    from_json() で作ったレコードは、値を読むまでJSONを解析しない。
+    """
+
+    __slots__ = JOB_FIELDS + ("_extra", "_json", "_raw", "_stamps")
+
+    def __init__(self, data: Optional[Mapping] = None, **fields):
+        self._extra = None
+        self._stamps = None
+        self._json = None
+        self._raw = None
+        if data is not None:
+            for key, value in data.items():
+                self[key] = value
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_json(cls, text: str) -> "JobRecord":
+        """JobRecord.to_json() の出力から作成（キャッシュとして再利用し、解析は遅延する）"""
+        record = cls()
+        record._raw = text
+        return record
+
+    def _load(self):
+        raw, self._raw = self._raw, None
+        for key, value in loads(raw).items():
+            self[key] = value
+        # 読み込み元の文字列は to_json() と同じ形式なのでそのままキャッシュに使う
+        self._json = raw
+
+    def __getitem__(self, key):
+        if self._raw is not None:
+            self._load()
+        if key in _FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if self._raw is not None:
+            self._load()
+        self._json = None
+        if key in _FIELD_SET:
+            if key in TIMESTAMP_FIELDS and self._stamps:
+                self._stamps.pop(key, None)
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if self._raw is not None:
+            self._load()
+        if key in _FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            if key in TIMESTAMP_FIELDS and self._stamps:
+                self._stamps.pop(key, None)
+        elif self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+        self._json = None
+
+    def __iter__(self):
+        if self._raw is not None:
+            self._load()
+        for key in JOB_FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from list(self._extra)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __contains__(self, key) -> bool:
+        if self._raw is not None:
+            self._load()
+        if key in _FIELD_SET:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __repr__(self) -> str:
+        return f"JobRecord({self.to_dict()!r})"
+
+    def timestamp(self, key: str) -> Optional[float]:
+        """日時のフィールドを数値で返す（未設定・不明な形式ならNone）"""
+        if self._raw is not None:
+            self._load()
+        if self._stamps is None:
+            self._stamps = {}
+        elif key in self._stamps:
+            return self._stamps[key]
+        stamp = self._stamps[key] = _to_timestamp(getattr(self, key, None))
+        return stamp
+
+    def to_dict(self) -> dict:
+        return {key: self[key] for key in self}
+
+    def to_json(self) -> str:
+        """JSON表現（キャッシュ済みならそれを返す）"""
+        if self._raw is not None:
+            return self._raw
+        if self._json is None:
+            self._json = dumps(self.to_dict())
+        return self._json
+
+    def copy(self) -> "JobRecord":
+        if self._raw is not None:
+            return JobRecord.from_json(self._raw)
+        record = JobRecord(self)
+        record._json = self._json
+        return record
+
+
+def as_record(job) -> JobRecord:
+    """dictなどのジョブを JobRecord に変換"""
+    return job if isinstance(job, JobRecord) else JobRecord(job)
+
+
+def job_timestamp(job: Mapping, key: str) -> Optional[float]:
+    """ジョブの日時を数値で返す（dictのISO文字列にも対応）"""
+    if isinstance(job, JobRecord):
+        return job.timestamp(key)
+    return _to_timestamp(job.get(key))
+
+
+def encode_jobs(jobs: Iterable) -> str:
+    """ジョブの一覧をJSON配列にする（JobRecordはキャッシュ済みの表現をつなげるだけ）"""
+    return (
+        "["
+        + ",".join(
+            job.to_json() if isinstance(job, JobRecord) else dumps(job) for job in jobs
+        )
+        + "]"
+    )
+
+
+def encode_response(payload: dict) -> str:
+    """レスポンスのJSONを作成（ジョブの一覧を含む値は encode_jobs でつなげる）
+
+    list の値はジョブの一覧として扱う。出力は FastJSONProvider の jsonify と同じ形式。
+    """
+    parts = []
+    for key in sorted(payload):
+        value = payload[key]
+        if isinstance(value, list) and any(isinstance(item, Mapping) for item in value):
+            encoded = encode_jobs(value)
+        else:
+            encoded = dumps(value)
+        parts.append(f"{dumps(key)}:{encoded}")
+    return "{" + ",".join(parts) + "}\n"
@@ -0,0 +1,79 @@
+"""
+ジョブレジストリ
+公開ジョブID（GID）から、ジョブを持つプラグイン・aria2バックエンドと状態を引く索引
+
+登録時とジョブの状態が変わった時に更新するため、一時停止・再開・キャンセルなどの操作は
+プラグインを順に調べたり監視ループの反映を待ったりせずに対象へ直接届けられる。
+完了したジョブはジョブストアに保存した時点で取り除く（履歴の分だけメモリが増えない）。
+"""
+
+import threading
+from typing import Any, Dict, NamedTuple, Optional
+
+PLUGIN_PREFIX = "plugin_"
+
+# ジョブの状態
+ACTIVE = "active"
+PAUSED = "paused"
+
+
+class JobEntry(NamedTuple):
+    """登録されたジョブ"""
+
+    kind: str  # "plugin" または "aria2"
+    owner: Any  # プラグインのインスタンス、または Aria2Backend
+    job_id: str  # 所有者側のID（プラグインのジョブID、aria2のGID）
+    state: str = ACTIVE
+    priority: str = "normal"  # 帯域の配分に使う優先度
+
+
+class JobRegistry:
+    """GID → JobEntry（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, JobEntry] = {}
+
+    def add_plugin_job(
+        self, plugin, job_id: str, state: str = ACTIVE, priority: str = "normal"
+    ) -> str:
+        """プラグインのジョブを登録して公開GIDを返す"""
+        gid = f"{PLUGIN_PREFIX}{job_id}"
+        with self._lock:
+            self._entries[gid] = JobEntry("plugin", plugin, job_id, state, priority)
+        return gid
+
+    def add_aria2_job(
+        self,
+        gid: str,
+        backend,
+        raw_gid: str,
+        state: str = ACTIVE,
+        priority: str = "normal",
+    ):
+        """aria2のジョブを登録"""
+        with self._lock:
+            self._entries[gid] = JobEntry("aria2", backend, raw_gid, state, priority)
+
+    def get(self, gid: str) -> Optional[JobEntry]:
+        return self._entries.get(gid)
+
+    def set_state(self, gid: str, state: str) -> bool:
+        """状態を更新（未登録ならFalse）"""
+        with self._lock:
+            entry = self._entries.get(gid)
+            if entry is None:
+                return False
+            if entry.state != state:
+                self._entries[gid] = entry._replace(state=state)
+            return True
+
+    def discard(self, gid: str) -> Optional[JobEntry]:
+        with self._lock:
+            return self._entries.pop(gid, None)
+
+    def __contains__(self, gid) -> bool:
+        return gid in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,79 @@
+"""
+リビジョン管理
+ジョブの変更ごとに単調増加するリビジョンを割り当て、差分取得に使う
+"""
+
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+
+
+class RevisionTracker:
+    """ジョブごとの最終変更リビジョンを記録する
+
+    変更・削除の記録はそれぞれ max_changes / max_tombstones 件まで保持し、切り詰めた分より
+    古いリビジョンからの差分は返さない（全件の取得に切り替えてもらう）。
+    """
+
+    def __init__(self, max_tombstones: int = 10000, max_changes: int = 10000):
+        self.max_tombstones = max_tombstones
+        self.max_changes = max_changes
+        self._lock = threading.Lock()
+        self._revision = 0
+        # 変更順（古い順）に並んだ gid -> revision
+        self._changed = OrderedDict()
+        self._tombstones = OrderedDict()
+        # これより古いリビジョンからの差分は変更・削除の情報が欠けている
+        self._oldest_complete = 0
+
+    @property
+    def revision(self) -> int:
+        """現在のリビジョン"""
+        return self._revision
+
+    def touch(self, gid: str) -> int:
+        """ジョブの変更を記録して新しいリビジョンを返す"""
+        with self._lock:
+            self._revision += 1
+            self._changed[gid] = self._revision
+            self._changed.move_to_end(gid)
+            self._tombstones.pop(gid, None)
+            while len(self._changed) > self.max_changes:
+                _, revision = self._changed.popitem(last=False)
+                self._oldest_complete = max(self._oldest_complete, revision)
+            return self._revision
+
+    def remove(self, gid: str) -> int:
+        """ジョブの削除を記録"""
+        with self._lock:
+            self._revision += 1
+            self._changed.pop(gid, None)
+            self._tombstones[gid] = self._revision
+            self._tombstones.move_to_end(gid)
+            while len(self._tombstones) > self.max_tombstones:
+                _, revision = self._tombstones.popitem(last=False)
+                self._oldest_complete = max(self._oldest_complete, revision)
+            return self._revision
+
+    def changed_since(self, since: int) -> Optional[Tuple[Set[str], List[str]]]:
+        """since より後に変更・削除されたジョブを返す
+
+        変更・削除の記録が切り詰められていて差分を正しく返せない場合は None を返す。
+        """
+        with self._lock:
+            if since < self._oldest_complete or since > self._revision:
+                return None
+
+            changed = set()
+            for gid in reversed(self._changed):
+                if self._changed[gid] <= since:
+                    break
+                changed.add(gid)
+
+            removed = []
+            for gid in reversed(self._tombstones):
+                if self._tombstones[gid] <= since:
+                    break
+                removed.append(gid)
+
+            return changed, removed
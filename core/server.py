@@ -0,0 +1,336 @@
+"""
+本番サーバー
+gunicorn（複数ワーカー）での起動と、状態を持つ1つのオーナープロセスへのリクエスト転送
+"""
+
+import atexit
+import json
+import logging
+import os
+import secrets
+import shutil
+import socket
+import tempfile
+import threading
+from typing import Optional, Tuple
+
+import requests
+from flask import Response, request
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+from .files import OWNER_TOKEN_HEADER, FileServer, read_local_file
+
+try:
+    import fcntl
+
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# 転送しないホップバイホップヘッダー（本文は展開済みで受け取るため長さ・符号化も除く）
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "content-encoding",
+    "content-length",
+}
+# unix ソケットで待ち受けるオーナーへ転送する際のURL（ホスト名は使われない）
+UNIX_PREFIX = "unix:"
+OWNER_URL = "http://arial-owner"
+
+
+class OwnerLock:
+    """監視スレッドなどを実行するオーナープロセスを1つに決めるファイルロック
+
+    ロックを取ったプロセスは内部アドレスをロックファイルに書き込み、
+    他のワーカーはそれを読んでリクエストを転送する。プロセスが終了するとロックは解放される。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        # 転送元のワーカーであることの確認に使う値（オーナーが公開する）
+        self.token = ""
+
+    def acquire(self) -> bool:
+        """ロックを取得（他のプロセスが保持していればFalse）"""
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lock_file = open(self.path, "a+")
+        if FCNTL_AVAILABLE:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._file = lock_file
+        self.token = secrets.token_hex(16)
+        return True
+
+    @property
+    def owned(self) -> bool:
+        return self._file is not None
+
+    def publish(self, address: str):
+        """オーナーの内部アドレスを書き込む"""
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(
+            json.dumps({"pid": os.getpid(), "address": address, "token": self.token})
+        )
+        self._file.flush()
+
+    def read_address(self) -> str:
+        """オーナーの内部アドレスを読む（未公開なら空文字）"""
+        return self._read().get("address", "")
+
+    def read_token(self) -> str:
+        """オーナーが公開した確認用の値を読む（未公開なら空文字）"""
+        return self._read().get("token", "")
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def start_internal_server(app, options: Optional[dict] = None) -> str:
+    """他のワーカーからの転送を受ける内部サーバーを起動し、アドレスを返す
+
+    gunicorn の gthread ワーカーを unix ソケットで待ち受けるように動かす（スレッド数や
+    キープアライブは options（gunicorn_options()）と同じ設定を使う）。
+    """
+    from gunicorn.config import Config
+    from gunicorn.workers.gthread import ThreadWorker
+
+    class InternalWorker(ThreadWorker):
+        def init_signals(self):
+            # シグナルはこのプロセスの本来のgunicornワーカーが受ける
+            pass
+
+        def load_wsgi(self):
+            self.wsgi = app
+
+    cfg = Config()
+    for key, value in (options or {}).items():
+        if key not in ("bind", "workers", "worker_class"):
+            cfg.set(key, value)
+
+    # 転送には確認用の値が付くため、他のユーザーが接続できないディレクトリに置く
+    directory = tempfile.mkdtemp(prefix="arial-owner-")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    path = os.path.join(directory, "owner.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(cfg.backlog)
+
+    worker = InternalWorker(
+        0, os.getppid(), [listener], None, cfg.timeout, cfg, cfg.logger_class(cfg)
+    )
+    threading.Thread(
+        target=worker.init_process, name="owner-server", daemon=True
+    ).start()
+    return UNIX_PREFIX + path
+
+
+class UnixSocketConnection(HTTPConnection):
+    """unix ソケットへ接続する HTTPConnection"""
+
+    def __init__(self, *args, socket_path: str = "", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class UnixSocketPool(HTTPConnectionPool):
+    ConnectionCls = UnixSocketConnection
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """requests のリクエストを1つの unix ソケットへ送るアダプター"""
+
+    def __init__(self, socket_path: str, **kwargs):
+        super().__init__(**kwargs)
+        self._pool = UnixSocketPool(
+            "localhost", maxsize=self._pool_maxsize, socket_path=socket_path
+        )
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool
+
+    def get_connection(self, url, proxies=None):
+        return self._pool
+
+    def close(self):
+        super().close()
+        self._pool.close()
+
+
+class OwnerProxy:
+    """オーナー以外のワーカーで /api/ と /metrics へのリクエストをオーナーへ転送する
+
+    ジョブの状態・プラグインのダウンロード・イベント配信はオーナープロセスだけが持つため、
+    他のワーカーは接続の受け付けと静的ファイルの配信だけを担当する。
+    file_server を渡すと、完了したファイルはオーナーがパスだけを返し、このワーカーが
+    直接送信する（ファイルの本体がオーナーを経由しない）。
+    """
+
+    def __init__(
+        self,
+        lock: OwnerLock,
+        prefix: Tuple[str, ...] = ("/api/", "/metrics"),
+        timeout: float = 30,
+        file_server: Optional[FileServer] = None,
+    ):
+        self.lock = lock
+        self.prefix = prefix
+        self.timeout = timeout
+        self.file_server = file_server
+        self.session = requests.Session()
+        # オーナーへの転送は環境変数のプロキシ設定を使わない
+        self.session.trust_env = False
+        self._address = ""
+        self._base_url = ""
+        self._token = ""
+
+    def init_app(self, app):
+        app.before_request(self.forward)
+
+    def forward(self):
+        """before_request フック（転送対象でなければNoneを返して通常処理）"""
+        if not request.path.startswith(self.prefix):
+            return None
+
+        # オーナーが再起動していればアドレスが変わっているので1回だけ読み直す
+        for attempt in range(2):
+            if not self._address or attempt:
+                self._connect(self.lock.read_address())
+                self._token = self.lock.read_token()
+            if not self._address:
+                break
+            headers = {
+                key: value
+                for key, value in request.headers
+                if key.lower() not in HOP_BY_HOP_HEADERS
+                and key.lower() != OWNER_TOKEN_HEADER.lower()
+                and key.lower() != "host"
+            }
+            if self.file_server is not None and self._token:
+                headers[OWNER_TOKEN_HEADER] = self._token
+            try:
+                upstream = self.session.request(
+                    request.method,
+                    self._base_url + request.full_path.rstrip("?"),
+                    headers=headers,
+                    data=request.get_data(),
+                    stream=True,
+                    allow_redirects=False,
+                    # SSEは長時間つながるため読み取りのタイムアウトは設けない
+                    timeout=(self.timeout, None),
+                )
+            except requests.ConnectionError as e:
+                logging.warning(f"Owner process unreachable: {e}")
+                continue
+
+            local_file = read_local_file(upstream.headers)
+            if local_file is not None and self.file_server is not None:
+                upstream.close()
+                path, name = local_file
+                return self.file_server.send(path, name)
+
+            headers = [
+                (key, value)
+                for key, value in upstream.headers.items()
+                if key.lower() not in HOP_BY_HOP_HEADERS
+            ]
+            return Response(
+                upstream.iter_content(chunk_size=None),
+                status=upstream.status_code,
+                headers=headers,
+                direct_passthrough=True,
+            )
+
+        response = Response(
+            json.dumps({"error": "Owner process not available"}),
+            status=503,
+            mimetype="application/json",
+        )
+        response.headers["Retry-After"] = "1"
+        return response
+
+    def _connect(self, address: str):
+        """オーナーのアドレス（unix:<パス> または http://...）を転送先にする"""
+        if address == self._address:
+            return
+        self._address = address
+        if address.startswith(UNIX_PREFIX):
+            self.session.mount(
+                OWNER_URL + "/", UnixSocketAdapter(address[len(UNIX_PREFIX) :])
+            )
+            self._base_url = OWNER_URL
+        else:
+            self._base_url = address
+
+
+def gunicorn_options() -> dict:
+    """環境変数からgunicornの設定を作成"""
+    return {
+        "bind": os.getenv("WEB_BIND", "0.0.0.0:80"),
+        "workers": int(os.getenv("WEB_WORKERS", "2")),
+        "worker_class": "gthread",
+        "threads": int(os.getenv("WEB_THREADS", "16")),
+        "keepalive": int(os.getenv("WEB_KEEPALIVE", "5")),
+        "timeout": int(os.getenv("WEB_TIMEOUT", "60")),
+        "graceful_timeout": int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30")),
+    }
+
+
+def max_event_clients(threads: int, requested: Optional[int] = None) -> int:
+    """gthreadワーカーで同時に配信できる /api/events の数
+
+    配信中のストリームはワーカーのスレッドを1つずつ占有する（オーナー以外のワーカーでは
+    転送の間、同じスレッド数のオーナーの内部サーバーでもスレッドを1つ使う）。全員が同じ
+    ワーカーにつながっても通常のAPIを処理するスレッドが残るよう、スレッド数の半分までにする。
+    """
+    limit = max(1, threads // 2)
+    return limit if requested is None else min(requested, limit)
+
+
+def run_gunicorn(app_factory, options: dict):
+    """gunicornでアプリケーションを起動（ワーカーごとに app_factory を呼ぶ）"""
+    from gunicorn.app.base import BaseApplication
+
+    class ArialApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app_factory()
+
+    ArialApplication().run()
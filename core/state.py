@@ -0,0 +1,196 @@
+"""
+ジョブの状態とスナップショット
+書き込み（監視ループ・操作系のAPI）はテーブルへ行い、読み取り（一覧・統計のAPI）は
+公開済みの変更不可なスナップショットを使う
+
+スナップショットは publish() ごとに前回のものをコピーし、変更されたジョブだけを差し替えて
+作る（copy-on-write）。公開は参照の置き換え1回なので、読み取り側はロックもコピーも不要で、
+途中まで反映された状態や "dictionary changed size during iteration" を見ることがない。
+"""
+
+import threading
+import time
+from collections.abc import MutableMapping
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+from .jobstore import find_urls, query_jobs
+from .records import as_record
+
+_EMPTY = MappingProxyType({})
+
+
+class StateSnapshot(NamedTuple):
+    """ある時点のジョブ一覧（変更不可）"""
+
+    revision: int
+    active: Mapping
+    # 全件をメモリに持たないテーブル（SQLiteの履歴）はNone
+    completed: Optional[Mapping]
+    published_at: float
+    # completed がNoneの場合に読む履歴の版（公開時点でコミット済みの行だけを読む）
+    completed_version: Optional[int] = None
+
+
+class TrackedTable(MutableMapping):
+    """書き込みを記録するジョブテーブルのラッパー（書き込み側が使う）
+
+    値の取得はテーブルの最新の内容を返す。走査はキーの一覧をコピーしてから行うため、
+    他のスレッドが同時に追加・削除しても例外にならない。
+    """
+
+    def __init__(self, table, lock: threading.RLock, snapshot: bool = True):
+        self.table = table
+        self.snapshot = snapshot
+        self.default_status = getattr(table, "default_status", None)
+        self._lock = lock
+        # 変更されたGID（スナップショットでも追加順を保つため順序付きで記録する）
+        self._dirty: Dict[str, None] = {}
+
+    def __getitem__(self, gid: str):
+        return self.table[gid]
+
+    def __setitem__(self, gid: str, job):
+        with self._lock:
+            self.table[gid] = job
+            if self.snapshot:
+                self._dirty[gid] = None
+
+    def __delitem__(self, gid: str):
+        with self._lock:
+            del self.table[gid]
+            if self.snapshot:
+                self._dirty[gid] = None
+
+    def __contains__(self, gid) -> bool:
+        return gid in self.table
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self.table))
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def copy(self) -> dict:
+        with self._lock:
+            return {gid: self.table[gid] for gid in list(self.table)}
+
+    def query(
+        self,
+        statuses: Optional[Set[str]] = None,
+        plugins: Optional[Set[str]] = None,
+        gids: Optional[Iterable[str]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        version: Optional[int] = None,
+    ) -> Tuple[int, List[dict]]:
+        """テーブルに対する絞り込み（スナップショットを持たないテーブルの読み取り用）"""
+        return self.table.query(statuses, plugins, gids, limit, offset, version)
+
+    def find_urls(self, urls: Iterable[str], version: Optional[int] = None) -> dict:
+        """テーブルから urls のジョブを探す（スナップショットを持たないテーブルの読み取り用）"""
+        return self.table.find_urls(urls, version)
+
+    def _apply(self, previous: Mapping) -> Mapping:
+        """previous に記録済みの変更を反映した新しいマッピング（変更が無ければそのまま）"""
+        dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return previous
+        jobs = dict(previous)
+        for gid in dirty:
+            job = self.table.get(gid)
+            if job is None:
+                jobs.pop(gid, None)
+            else:
+                # 書き込み側がその場で更新してもスナップショットが変わらないようにコピーする
+                jobs[gid] = as_record(job).copy()
+        return MappingProxyType(jobs)
+
+
+class JobState:
+    """アクティブ・完了済みのジョブテーブルと、その公開済みスナップショット"""
+
+    def __init__(self, active, completed):
+        # 書き込みと公開の排他（監視ループは1回分の反映の間これを保持する）
+        self.lock = threading.RLock()
+        self.active = TrackedTable(active, self.lock)
+        # SQLiteの履歴はメモリに全件を載せないため、SQLで読む
+        self.completed = TrackedTable(
+            completed, self.lock, snapshot=getattr(completed, "cached", True)
+        )
+        self._snapshot = StateSnapshot(0, _EMPTY, None, 0.0)
+        self.active._dirty.update(dict.fromkeys(self.active.table))
+        if self.completed.snapshot:
+            self.completed._dirty.update(dict.fromkeys(self.completed.table))
+            self._snapshot = self._snapshot._replace(completed=_EMPTY)
+        self.publish()
+
+    def snapshot(self) -> StateSnapshot:
+        """公開済みの最新のスナップショット（ロック不要）"""
+        return self._snapshot
+
+    def publish(self, revision: Optional[int] = None) -> StateSnapshot:
+        """前回の公開以降の変更を反映したスナップショットを公開する
+
+        SQLで読む履歴は、この時点でコミット済みの行までを公開する（書き込みをまとめている
+        場合は、コミットしてから呼ぶ）。
+        """
+        with self.lock:
+            previous = self._snapshot
+            snapshot = StateSnapshot(
+                previous.revision if revision is None else revision,
+                self.active._apply(previous.active),
+                (
+                    self.completed._apply(previous.completed)
+                    if previous.completed is not None
+                    else None
+                ),
+                time.time(),
+                (
+                    self.completed.table.version()
+                    if previous.completed is None
+                    else None
+                ),
+            )
+            self._snapshot = snapshot
+            return snapshot
+
+    def query(
+        self,
+        state: str,
+        snapshot: Optional[StateSnapshot] = None,
+        statuses: Optional[Set[str]] = None,
+        plugins: Optional[Set[str]] = None,
+        gids: Optional[Iterable[str]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> Tuple[int, List[dict]]:
+        """state（"active" / "completed"）のジョブを絞り込んで (総件数, ページ) で返す"""
+        snapshot = snapshot or self._snapshot
+        jobs = getattr(snapshot, state)
+        table = getattr(self, state)
+        if jobs is None:
+            # 公開時点の版を読む（読み取り側は保留中の書き込みをコミットしない）
+            return table.query(
+                statuses, plugins, gids, limit, offset, snapshot.completed_version
+            )
+        return query_jobs(
+            jobs, statuses, plugins, gids, limit, offset, table.default_status
+        )
+
+    def find_urls(
+        self, urls: Iterable[str], snapshot: Optional[StateSnapshot] = None
+    ) -> Dict[str, str]:
+        """urls のうち登録済み（アクティブ・完了済み）のものを URL → GID で返す
+
+        アクティブと完了済みの両方にあればアクティブのジョブを返す。
+        """
+        snapshot = snapshot or self._snapshot
+        urls = list(urls)
+        if snapshot.completed is None:
+            known = self.completed.find_urls(urls, snapshot.completed_version)
+        else:
+            known = find_urls(snapshot.completed, urls)
+        known.update(find_urls(snapshot.active, urls))
+        return known
@@ -0,0 +1,107 @@
+"""
+処理時間の計測
+起動や監視ループなどの処理をフェーズごとに計測してログに出す
+"""
+
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+
+class PhaseTimer:
+    """フェーズごとの所要時間を記録する（複数スレッドから同時に使える）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.phases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = time.perf_counter() - started
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def snapshot(self) -> Dict[str, float]:
+        """フェーズごとの所要時間のコピー"""
+        with self._lock:
+            return dict(self.phases)
+
+    def report(self) -> str:
+        """各フェーズと全体の所要時間をログに出す"""
+        phases = " ".join(
+            f"{name}={seconds:.3f}s" for name, seconds in self.snapshot().items()
+        )
+        message = f"{self.name}: {phases} total={self.elapsed:.3f}s"
+        logging.info(message)
+        return message
+
+
+class TickHistory:
+    """ループ1回ごとの所要時間の記録と、次の回までの待ち時間の計算
+
+    待ち時間は interval から処理時間を引いたもの。処理が interval の 1/load_factor を
+    超える間は間隔を処理時間の load_factor 倍（最大 max_interval）まで広げ、
+    ループが処理時間の大半を占めないようにする。
+    """
+
+    def __init__(
+        self,
+        size: int = 120,
+        interval: float = 1.0,
+        max_interval: float = 5.0,
+        slow_threshold: float = 2.0,
+        load_factor: float = 2.0,
+    ):
+        self.interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.slow_threshold = slow_threshold
+        self.load_factor = load_factor
+        self._lock = threading.Lock()
+        self._ticks = deque(maxlen=size)
+
+    def next_interval(self, duration: float) -> float:
+        return min(self.max_interval, max(self.interval, duration * self.load_factor))
+
+    def record(self, timer: PhaseTimer, errors: Iterable[str] = ()) -> dict:
+        """1回分を記録（sleep に次の回までの待ち時間が入る）"""
+        duration = timer.elapsed
+        interval = self.next_interval(duration)
+        tick = {
+            "at": time.time(),
+            "duration": duration,
+            "phases": timer.snapshot(),
+            "interval": interval,
+            # 処理が間隔を超えても他のスレッドが動けるよう少しは待つ
+            "sleep": max(interval - duration, self.interval / 10),
+            "slow": duration >= self.slow_threshold,
+            "errors": list(errors),
+        }
+        with self._lock:
+            self._ticks.append(tick)
+        return tick
+
+    def snapshot(self, limit: Optional[int] = None) -> dict:
+        """直近の記録（新しい順）"""
+        with self._lock:
+            ticks = list(self._ticks)
+        ticks.reverse()
+        if limit is not None:
+            ticks = ticks[: max(limit, 0)]
+        return {
+            "interval": self.interval,
+            "max_interval": self.max_interval,
+            "slow_threshold": self.slow_threshold,
+            "ticks": ticks,
+        }
@@ -1,20 +1,78 @@
-from flask import Flask, request, jsonify, render_template, send_file
-import flask_cors
-import json
-import subprocess
-import aria2p
 import logging
-from dotenv import load_dotenv
 import os
+import secrets
+import sys
 import threading
 import time
-from datetime import datetime
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-import sys
+
+import flask_cors
+from dotenv import load_dotenv
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    render_template,
+    request,
+    stream_with_context,
+)
+
+from core import (
+    REGISTRY,
+    Aria2Monitor,
+    BackendPool,
+    EventBroker,
+    OwnerLock,
+    OwnerProxy,
+    PhaseTimer,
+    RevisionTracker,
+    StackSampler,
+    TickHistory,
+    add_uris_multicall,
+    create_job_store,
+    download_url,
+    gunicorn_options,
+    max_event_clients,
+    parse_url_lines,
+    run_gunicorn,
+    start_internal_server,
+)
+from core.backends import ARIA2_RPC_SECONDS
+from core.diff import (
+    ARIA2_FIELDS,
+    PLUGIN_FIELDS,
+    JobSnapshots,
+    aria2_values,
+    is_finished,
+)
+from core.encoding import FastJSONProvider
+from core.encoding import dumps as json_dumps
+from core.encoding import set_backend as set_json_backend
+from core.files import (
+    OWNER_TOKEN_HEADER,
+    FileServer,
+    install_file_wrapper,
+    local_file_response,
+)
+from core.metrics import DURATION_BUCKETS, THROUGHPUT_BUCKETS
+from core.records import encode_response, job_timestamp
+from core.registry import ACTIVE, PAUSED, PLUGIN_PREFIX, JobRegistry
+from core.state import JobState
 
 # プラグインシステムのインポート
 from plugins import PluginManager
+from plugins.ratelimit import (
+    DEFAULT_PRIORITY,
+    PRIORITIES,
+    get_default_limiter,
+    parse_rate,
+    parse_schedule,
+    parse_shares,
+)
+from plugins.router import TTLCache
 
 # 環境変数読み込み
 load_dotenv()
@@ -47,15 +105,202 @@ def make_json_serializable(obj):
 
 
 app = Flask(__name__, static_folder="src")
+# JSONのエンコード（orjson があれば使う。JSON_ENCODER=json で標準ライブラリに固定）
+set_json_backend(os.getenv("JSON_ENCODER", "auto"))
+app.json = FastJSONProvider(app)
+# 完了したファイルの配信（FILE_SERVE_MODE=x-sendfile / x-accel でフロントのプロキシに任せる）
+file_server = FileServer(
+    os.getenv("FILE_SERVE_MODE", "direct"),
+    accel_prefix=os.getenv("FILE_ACCEL_PREFIX", "/protected/"),
+    root=os.getenv("FILE_ACCEL_ROOT", DEFAULT_DOWNLOAD_DIR),
+)
+install_file_wrapper(app)
 flask_cors.CORS(app)
+# /metrics の公開とAPIの処理時間の計測
+REGISTRY.init_app(app)
+
+# ジョブストア（JOB_STORE=sqlite なら再起動後も履歴を保持）
+JOB_DB_PATH = os.getenv(
+    "JOB_DB_PATH", os.path.join(DEFAULT_DOWNLOAD_DIR, ".arial", "jobs.db")
+)
+# 本番サーバーで監視などを実行するプロセスを1つに決めるロック
+OWNER_LOCK_PATH = os.path.join(os.path.dirname(JOB_DB_PATH), "owner.lock")
+
+
+def open_job_store():
+    """ジョブストアとテーブルを開く
+
+    書き込みは download_jobs / completed_jobs へ行い、APIの読み取りは
+    job_state のスナップショット（監視ループが1回ごとに公開する）を使う。
+    """
+    global job_store, job_state, download_jobs, completed_jobs
+    job_store = create_job_store(os.getenv("JOB_STORE", "sqlite"), JOB_DB_PATH)
+    job_state = JobState(
+        job_store.table("active", cached=True),
+        job_store.table("completed", default_status="complete"),
+    )
+    download_jobs = job_state.active
+    completed_jobs = job_state.completed
+
 
 # グローバル変数
-download_jobs = {}
-completed_jobs = {}
+job_store = None
+job_state = None
+download_jobs = None
+completed_jobs = None
 plugin_jobs = {}  # プラグイン用のジョブ管理
-aria2_process = None
-aria2_api = None
+aria2_backends = None  # aria2バックエンドの集合（ARIA2_BACKENDS）
 plugin_manager = None
+# 再起動でリビジョンが巻き戻ってもETagが衝突しないようにする
+INSTANCE_ID = uuid.uuid4().hex[:8]
+job_revisions = RevisionTracker()
+event_broker = EventBroker(
+    max_pending=int(os.getenv("EVENTS_MAX_PENDING", "1000")),
+    max_clients=int(os.getenv("EVENTS_MAX_CLIENTS", "100")),
+    min_interval=float(os.getenv("EVENTS_MIN_INTERVAL", "0.25")),
+)
+# 監視ループが前回見たaria2のジョブの値（変化したジョブだけを更新するため）
+aria2_snapshots = JobSnapshots(ARIA2_FIELDS)
+plugin_snapshots = JobSnapshots(PLUGIN_FIELDS)
+# GID → ジョブを持つプラグイン・バックエンドと状態（操作系のAPIが直接引く）
+job_registry = JobRegistry()
+# 監視ループがまだ取り込んでいない登録済みURL（重複登録の検出用）
+submitted_urls = TTLCache(maxsize=100000, ttl=600)
+# 全体の帯域制限（プラグインと共有。aria2には監視ループがジョブごとの上限を設定する）
+bandwidth_limiter = get_default_limiter()
+
+# メトリクス（/metrics の取得時ではなく監視ループなどで発生時に更新する）
+downloaded_bytes = REGISTRY.counter(
+    "arial_downloaded_bytes", "Bytes downloaded", ("plugin", "backend")
+)
+jobs_completed = REGISTRY.counter(
+    "arial_jobs_completed", "Completed downloads", ("plugin",)
+)
+job_duration = REGISTRY.histogram(
+    "arial_job_duration_seconds",
+    "Time from job creation to completion",
+    ("plugin",),
+    DURATION_BUCKETS,
+)
+job_throughput = REGISTRY.histogram(
+    "arial_job_throughput_bytes_per_second",
+    "Average throughput of completed jobs",
+    ("plugin",),
+    THROUGHPUT_BUCKETS,
+)
+backend_throughput = REGISTRY.histogram(
+    "arial_backend_throughput_bytes_per_second",
+    "Total download speed of a backend per monitor tick",
+    ("backend",),
+    THROUGHPUT_BUCKETS,
+)
+queue_wait = REGISTRY.histogram(
+    "arial_queue_wait_seconds",
+    "Time plugin downloads wait in the scheduler queue",
+    ("plugin",),
+    (0.01, 0.1, 0.5) + DURATION_BUCKETS,
+)
+monitor_tick = REGISTRY.histogram(
+    "arial_monitor_tick_duration_seconds", "Duration of one monitor loop iteration"
+)
+active_jobs = REGISTRY.gauge("arial_active_jobs", "Active downloads")
+monitor_phase = REGISTRY.histogram(
+    "arial_monitor_phase_duration_seconds",
+    "Duration of each monitor loop phase",
+    ("phase",),
+)
+
+# 監視ループの間隔（処理に時間が掛かると MONITOR_MAX_INTERVAL まで広げる）と直近の記録
+monitor_ticks = TickHistory(
+    size=int(os.getenv("MONITOR_HISTORY", "120")),
+    interval=float(os.getenv("MONITOR_INTERVAL", "1.0")),
+    max_interval=float(os.getenv("MONITOR_MAX_INTERVAL", "5.0")),
+    slow_threshold=float(os.getenv("MONITOR_SLOW_TICK", "2.0")),
+)
+# MONITOR_PROFILE=true なら遅い回のスタックの採取結果を保存する
+MONITOR_PROFILE_DIR = os.path.join(os.path.dirname(JOB_DB_PATH), "profiles")
+stack_sampler = (
+    StackSampler(interval=float(os.getenv("MONITOR_PROFILE_INTERVAL", "0.005")))
+    if os.getenv("MONITOR_PROFILE", "false").lower() == "true"
+    else None
+)
+
+
+def record_job_progress(plugin, backend, before, completed_length):
+    """前回からの取得バイト数をカウンターへ加算"""
+    delta = completed_length - ((before or {}).get("completed_length") or 0)
+    if delta > 0:
+        downloaded_bytes.labels(plugin, backend).inc(delta)
+
+
+def record_job_completed(plugin, job, total_length):
+    """完了したジョブの所要時間と平均速度を記録"""
+    jobs_completed.labels(plugin).inc()
+    created = job_timestamp(job, "created_at")
+    if created is None:
+        return
+    seconds = time.time() - created
+    if seconds > 0:
+        job_duration.labels(plugin).observe(seconds)
+        if total_length:
+            job_throughput.labels(plugin).observe(total_length / seconds)
+
+
+def record_queue_wait(task):
+    """スケジューラーのキューで待った時間を記録（DownloadScheduler.on_start）"""
+    queue_wait.labels(task.plugin or "").observe(task.wait_time)
+
+
+def notify_job_changed(gid, before, after, state="active"):
+    """ジョブの変更点（差分）をイベント購読者へ通知
+
+    updated_at 以外に変更があった場合は True を返す。
+    """
+    if before is None:
+        delta = dict(after)
+    else:
+        delta = {
+            key: value
+            for key, value in after.items()
+            if key != "updated_at" and before.get(key) != value
+        }
+        if not delta:
+            return False
+        if "updated_at" in after:
+            delta["updated_at"] = after["updated_at"]
+
+    notify_job_delta(gid, delta, state)
+    return True
+
+
+def notify_job_delta(gid, delta, state="active"):
+    """変化したフィールドだけをイベント購読者へ通知（リビジョンを進める）"""
+    delta["gid"] = gid
+    delta["state"] = state
+    delta["revision"] = job_revisions.touch(gid)
+    event_broker.publish(gid, "job", delta)
+
+
+def notify_job_removed(gid):
+    """ジョブの削除をイベント購読者へ通知"""
+    revision = job_revisions.remove(gid)
+    event_broker.publish(gid, "removed", {"gid": gid, "revision": revision})
+
+
+def publish_jobs():
+    """ジョブテーブルへの変更を読み取り用のスナップショットとして公開"""
+    return job_state.publish(job_revisions.revision)
+
+
+def remove_job(jobs, gid):
+    """APIからジョブを削除して通知・公開する（無ければFalse）"""
+    with job_state.lock:
+        if gid not in jobs:
+            return False
+        del jobs[gid]
+        notify_job_removed(gid)
+    publish_jobs()
+    return True
 
 
 def initialize_plugins():
@@ -63,6 +308,7 @@ def initialize_plugins():
     global plugin_manager
     try:
         plugin_manager = PluginManager()
+        plugin_manager.get_scheduler().on_start = record_queue_wait
         logging.info("Plugin system initialized successfully")
         return True
     except ImportError as e:
@@ -85,6 +331,15 @@ def initialize_plugins():
                 def get_all_plugins(self):
                     return self.plugins
 
+                def get_plugin_specs(self):
+                    from plugins.manifest import PLUGIN_MANIFEST
+
+                    return [
+                        spec
+                        for spec in PLUGIN_MANIFEST
+                        if spec.name == "HTTPDownloadPlugin"
+                    ]
+
             plugin_manager = BasicPluginManager()
             logging.info("Plugin system initialized with HTTP plugin only")
             return True
@@ -96,252 +351,407 @@ def initialize_plugins():
         return False
 
 
+def restore_interrupted_jobs():
+    """前回の起動時に実行中だったプラグインジョブを中断状態にする"""
+    with job_store.batch():
+        for gid in list(download_jobs):
+            job = download_jobs[gid]
+            if gid.startswith("plugin_") and job.get("status") != "interrupted":
+                before = dict(job)
+                job["status"] = "interrupted"
+                job["download_speed"] = 0
+                download_jobs[gid] = job
+                notify_job_changed(gid, before, job)
+    publish_jobs()
+
+
+def resume_plugin_downloads():
+    """ジャーナルが残っているプラグインのダウンロードを再開"""
+    if not plugin_manager or os.getenv("AUTO_RESUME", "true").lower() == "false":
+        return
+    for plugin in plugin_manager.get_all_plugins():
+        if hasattr(plugin, "resume_interrupted"):
+            try:
+                job_ids = plugin.resume_interrupted(DEFAULT_DOWNLOAD_DIR)
+                for job_id in job_ids:
+                    job_registry.add_plugin_job(plugin, job_id)
+                if job_ids:
+                    logging.info(
+                        f"Resumed {len(job_ids)} interrupted downloads "
+                        f"({plugin.__class__.__name__})"
+                    )
+            except Exception as e:
+                logging.error(f"Failed to resume interrupted downloads: {e}")
+
+
 # Aria2サーバーの起動
 def start_aria2():
-    global aria2_process, aria2_api
+    """ARIA2_BACKENDS のaria2を起動・接続（1つでも使えればTrue）"""
+    global aria2_backends
     try:
-        # Aria2サーバーを起動
-        aria2_process = subprocess.Popen(
-            [
-                "aria2c",
-                "--enable-rpc",
-                "--rpc-listen-all",
-                "--rpc-allow-origin-all",
-                "--rpc-listen-port=6800",
-                "--continue=true",
-                "--max-connection-per-server=16",
-                "--min-split-size=1M",
-                "--split=16",
-                f"--dir={DEFAULT_DOWNLOAD_DIR}",
-            ]
-        )
-
-        # 少し待ってからAPIクライアントを初期化
-        time.sleep(2)
-        aria2_api = aria2p.API(
-            aria2p.Client(host="http://localhost", port=6800, secret="")
-        )
-        logging.info("Aria2 server started successfully")
-        return True
-    except Exception as e:
-        logging.error(f"Failed to start Aria2: {e}")
+        aria2_backends = BackendPool.from_env(DEFAULT_DOWNLOAD_DIR)
+    except ValueError as e:
+        logging.error(f"Invalid ARIA2_BACKENDS: {e}")
         return False
+    if not aria2_backends.start(float(os.getenv("ARIA2_START_TIMEOUT", "10"))):
+        aria2_backends = None
+        return False
+    return True
+
+
+def create_aria2_monitor(backend):
+    """バックエンドの差分モニターを作成"""
+    notifications = os.getenv("ARIA2_NOTIFICATIONS", "true").lower() != "false"
+    monitor = Aria2Monitor(
+        backend.api,
+        resync_interval=float(os.getenv("ARIA2_RESYNC_INTERVAL", "60")),
+        rpc=backend.rpc if notifications else None,
+    )
+    if notifications:
+        monitor.start()
+    return monitor
+
+
+def sync_aria2_backend(backend, timer=None):
+    """aria2バックエンド1つの変更をジョブテーブルへ反映（取得と反映を別フェーズで計測）"""
+    timer = timer or PhaseTimer("aria2 sync")
+    # 変化のあったダウンロードを取得（WebSocket不可時は全件）
+    with timer.phase(f"fetch:{backend.name}"), ARIA2_RPC_SECONDS.labels(
+        backend.name, "monitor.fetch"
+    ).time():
+        changes = backend.monitor.fetch()
+    with timer.phase(f"diff:{backend.name}"), job_state.lock:
+        apply_aria2_changes(backend, changes)
+
+
+def apply_aria2_changes(backend, changes):
+    """取得したaria2の変更をジョブテーブルへ反映
+
+    前回から変化したフィールドだけをジョブへ書き込み、変化の無いジョブは読み飛ばす。
+    """
+    now = datetime.now().isoformat()
+    speed = 0
+    seen = set()
+    for download in changes.downloads:
+        gid = aria2_backends.qualify(backend, download.gid)
+        seen.add(gid)
+        values = aria2_values(download)
+        speed += values[3]
+
+        changed = aria2_snapshots.diff(gid, values)
+        if changed is None:
+            if gid in download_jobs:
+                continue  # 変化なし
+            changed = aria2_snapshots.get(gid)
+        fields = dict(zip(ARIA2_FIELDS, values))
+
+        if gid in download_jobs:
+            job = download_jobs[gid]
+            if is_finished(fields):
+                # 完了したジョブを移動
+                completed_jobs[gid] = {
+                    "gid": gid,
+                    "name": job["name"],
+                    "url": job.get("url", ""),
+                    "total_length": fields["total_length"]
+                    or job.get("total_length", 0),
+                    "completed_at": now,
+                    "file_path": (
+                        str(download.files[0].path) if download.files else ""
+                    ),
+                }
+                total_length = completed_jobs[gid]["total_length"]
+                record_job_progress("aria2", backend.name, job, total_length)
+                record_job_completed("aria2", job, total_length)
+                del download_jobs[gid]
+                aria2_snapshots.discard(gid)
+                # 完了したジョブはストアから引くため、レジストリには残さない
+                job_registry.discard(gid)
+                notify_job_changed(gid, None, completed_jobs[gid], "completed")
+                continue
+
+            # 変化したフィールドだけを更新
+            record_job_progress("aria2", backend.name, job, fields["completed_length"])
+            delta = {
+                field: value
+                for field, value in changed.items()
+                if job.get(field) != value
+            }
+            if delta:
+                job.update(delta)
+                job["updated_at"] = now
+                notify_job_delta(gid, dict(delta, updated_at=now))
+                download_jobs[gid] = job
+        elif gid in completed_jobs:
+            # 完了済みとして記録済み（再同期で再度取得された場合）
+            aria2_snapshots.discard(gid)
+        elif is_finished(fields):
+            # 新しいジョブがすでに完了している場合は完了リストに追加
+            completed_jobs[gid] = {
+                "gid": gid,
+                "name": (str(download.name) if download.name else "Unknown"),
+                "url": download_url(download),
+                "total_length": fields["total_length"],
+                "completed_at": now,
+                "file_path": (str(download.files[0].path) if download.files else ""),
+            }
+            record_job_progress("aria2", backend.name, None, fields["total_length"])
+            jobs_completed.labels("aria2").inc()
+            aria2_snapshots.discard(gid)
+            job_registry.discard(gid)
+            notify_job_changed(gid, None, completed_jobs[gid], "completed")
+        else:
+            # アクティブなジョブとして追加
+            download_jobs[gid] = dict(
+                fields,
+                gid=gid,
+                name=(str(download.name) if download.name else "Unknown"),
+                url=download_url(download),
+                created_at=now,
+                updated_at=now,
+            )
+            record_job_progress("aria2", backend.name, None, fields["completed_length"])
+            register_aria2_job(gid, backend, download.gid, ACTIVE)
+            notify_job_changed(gid, None, download_jobs[gid])
+
+    if speed:
+        backend_throughput.labels(backend.name).observe(speed)
+
+    # 削除されたジョブをクリーンアップ
+    # （全件取得時のみ未取得のGIDを削除扱いにする。プラグインジョブは対象外）
+    if changes.full:
+        jobs_to_remove = {
+            gid
+            for gid in download_jobs.keys() - seen
+            if aria2_backends.owns(backend, gid)
+        }
+    else:
+        jobs_to_remove = {
+            aria2_backends.qualify(backend, gid) for gid in changes.removed
+        }
+    for gid in jobs_to_remove:
+        aria2_snapshots.discard(gid)
+        job_registry.discard(gid)
+        if gid in download_jobs:
+            del download_jobs[gid]
+            notify_job_removed(gid)
+
+
+def apply_bandwidth_limits():
+    """転送中のaria2のジョブを帯域の配分に登録し、割り当てた上限をaria2へ設定"""
+    bandwidth_limiter.refresh()
+    if not aria2_backends:
+        return
+    jobs = {}
+    for gid, job in job_state.snapshot().active.items():
+        if gid.startswith(PLUGIN_PREFIX) or job.get("status") != "active":
+            continue
+        entry = job_registry.get(gid)
+        jobs[gid] = entry.priority if entry is not None else DEFAULT_PRIORITY
+    bandwidth_limiter.set_aria2_jobs(jobs)
+
+    limits = bandwidth_limiter.aria2_limits()
+    for backend in aria2_backends.available:
+        per_gid = {
+            aria2_backends.resolve(gid)[1]: limit
+            for gid, limit in limits.items()
+            if aria2_backends.owns(backend, gid)
+        }
+        # ジョブが無ければ、次に始まるジョブに割り当てられる分を全体の上限にする
+        overall = sum(per_gid.values()) if per_gid else bandwidth_limiter.new_job_rate()
+        backend.set_download_limits(overall, per_gid)
+
+
+def aria2_options(priority):
+    """aria2.addUri のオプション（帯域制限中は最初から割り当て分の上限を付ける）"""
+    options = {"dir": DEFAULT_DOWNLOAD_DIR}
+    limit = bandwidth_limiter.new_job_rate(priority)
+    if limit:
+        options["max-download-limit"] = str(limit)
+    return options
+
+
+def note_aria2_limit(backend, raw_gid, options):
+    """addUri で付けた上限をバックエンドに記録（付けていなければaria2の設定次第で不明）"""
+    if "max-download-limit" in options:
+        backend.note_download_limit(raw_gid, int(options["max-download-limit"]))
+
+
+def register_aria2_job(gid, backend, raw_gid, state):
+    """aria2のジョブの状態を登録（外部から追加されたジョブは監視ループで初めて登録される）"""
+    if not job_registry.set_state(gid, state):
+        job_registry.add_aria2_job(gid, backend, raw_gid, state)
 
 
 # ダウンロード情報を更新する関数
-def update_download_info():
-    global download_jobs, completed_jobs, aria2_api
+def sync_plugin_jobs():
+    """プラグインの進捗をジョブテーブルへ反映"""
+    if not plugin_manager:
+        return
+    for plugin in plugin_manager.get_all_plugins():
+        # アクティブなダウンロードをチェック
+        if hasattr(plugin, "active_downloads"):
+            for job_id, job_info in list(plugin.active_downloads.items()):
+                plugin_key = f"plugin_{job_id}"
+                values = (
+                    job_info.get("filename", "Unknown"),
+                    job_info.get("status", "active"),
+                    job_info.get("downloaded_bytes", 0),
+                    job_info.get("total_bytes", 0),
+                    job_info.get("speed", 0),
+                    job_info.get("progress", 0.0),
+                    job_info.get("eta", 0),
+                )
+                changed = plugin_snapshots.diff(plugin_key, values)
+                before = download_jobs.get(plugin_key)
+                if changed is None and before is not None:
+                    continue  # 変化なし
+
+                now = datetime.now().isoformat()
+                previous_length = (before or {}).get("completed_length") or 0
+                if before is None:
+                    if plugin_key not in job_registry:
+                        job_registry.add_plugin_job(plugin, job_id)
+                    job = dict(
+                        plugin_snapshots.get(plugin_key),
+                        gid=plugin_key,
+                        url=job_info.get("url", ""),
+                        plugin_type=plugin.__class__.__name__,
+                        created_at=job_info.get("created_at", now),
+                        updated_at=now,
+                    )
+                    notify_job_changed(plugin_key, None, job)
+                else:
+                    job = before
+                    delta = {
+                        field: value
+                        for field, value in changed.items()
+                        if job.get(field) != value
+                    }
+                    if not delta:
+                        continue
+                    job.update(delta)
+                    job["updated_at"] = now
+                    notify_job_delta(plugin_key, dict(delta, updated_at=now))
+                record_job_progress(
+                    plugin.__class__.__name__,
+                    "",
+                    {"completed_length": previous_length},
+                    job["completed_length"],
+                )
+                download_jobs[plugin_key] = job
+
+        # 完了したダウンロードをジョブストアへ移す（プラグイン側の記録は取り込んだら消し、
+        # 履歴をメモリに溜めない。コミットに失敗しても書き込みは次の回に再試行される）
+        if hasattr(plugin, "completed_downloads"):
+            for job_id, job_info in list(plugin.completed_downloads.items()):
+                plugin_key = f"plugin_{job_id}"
+                plugin.completed_downloads.pop(job_id, None)
+                if plugin_key not in completed_jobs:
+                    completed_jobs[plugin_key] = {
+                        "gid": plugin_key,
+                        "name": job_info.get("filename", "Unknown"),
+                        "url": job_info.get("url", ""),
+                        "total_length": job_info.get("total_bytes", 0),
+                        "completed_at": job_info.get(
+                            "completed_at", datetime.now().isoformat()
+                        ),
+                        "file_path": job_info.get("file_path", ""),
+                        "plugin_type": plugin.__class__.__name__,
+                    }
+                    job = download_jobs.get(plugin_key) or job_info
+                    total_length = completed_jobs[plugin_key]["total_length"]
+                    record_job_progress(
+                        plugin.__class__.__name__,
+                        "",
+                        download_jobs.get(plugin_key),
+                        total_length,
+                    )
+                    record_job_completed(plugin.__class__.__name__, job, total_length)
+                    # アクティブリストから削除（完了したジョブはストアから引く）
+                    job_registry.discard(plugin_key)
+                    plugin_snapshots.discard(plugin_key)
+                    if plugin_key in download_jobs:
+                        del download_jobs[plugin_key]
+                    notify_job_changed(
+                        plugin_key,
+                        None,
+                        completed_jobs[plugin_key],
+                        "completed",
+                    )
 
-    while True:
-        try:
-            if aria2_api:
-                # アクティブなダウンロードを取得
-                active_downloads = aria2_api.get_downloads()
-
-                # 現在のジョブを更新
-                current_gids = []
-                for download in active_downloads:
-                    gid = download.gid
-                    current_gids.append(gid)
-
-                    # ETA を秒数に変換（timedelta から int へ）
-                    eta_seconds = None
-                    if download.eta and hasattr(download.eta, "total_seconds"):
-                        eta_seconds = int(download.eta.total_seconds())
-                    elif download.eta and isinstance(download.eta, (int, float)):
-                        eta_seconds = int(download.eta)
-
-                    if gid in download_jobs:
-                        # 既存のジョブを更新
-                        job = download_jobs[gid]
-
-                        # 完了をチェック（進捗率100%または状態がcomplete）
-                        if (
-                            download.status in ["complete", "removed"]
-                            or (download.progress and float(download.progress) >= 1.0)
-                            or (
-                                download.total_length
-                                and download.completed_length
-                                and download.completed_length >= download.total_length
-                            )
-                        ):
-
-                            # 完了したジョブを移動
-                            completed_jobs[gid] = {
-                                "gid": gid,
-                                "name": job["name"],
-                                "total_length": (
-                                    int(download.total_length)
-                                    if download.total_length
-                                    else job.get("total_length", 0)
-                                ),
-                                "completed_at": datetime.now().isoformat(),
-                                "file_path": (
-                                    str(download.files[0].path)
-                                    if download.files
-                                    else ""
-                                ),
-                            }
-                            # アクティブなダウンロードから削除
-                            del download_jobs[gid]
-                            continue  # 完了済みなので更新処理をスキップ
-
-                        # アクティブなジョブの更新
-                        job.update(
-                            {
-                                "progress": (
-                                    float(download.progress)
-                                    if download.progress
-                                    else 0.0
-                                ),
-                                "download_speed": (
-                                    int(download.download_speed)
-                                    if download.download_speed
-                                    else 0
-                                ),
-                                "eta": eta_seconds,
-                                "completed_length": (
-                                    int(download.completed_length)
-                                    if download.completed_length
-                                    else 0
-                                ),
-                                "total_length": (
-                                    int(download.total_length)
-                                    if download.total_length
-                                    else 0
-                                ),
-                                "status": str(download.status),
-                                "updated_at": datetime.now().isoformat(),
-                            }
-                        )
-                    else:
-                        # 新しいジョブを追加
-                        # 進捗率を計算（0-1の範囲に制限）
-                        progress = 0.0
-                        if download.total_length and download.completed_length:
-                            progress = min(
-                                float(download.completed_length)
-                                / float(download.total_length),
-                                1.0,
-                            )
-                        elif download.progress:
-                            # aria2pのprogressが既にパーセンテージ（0-100）の場合
-                            progress = min(float(download.progress) / 100.0, 1.0)
-
-                        # 新しいジョブがすでに完了している場合は完了リストに追加
-                        if (
-                            download.status in ["complete", "removed"]
-                            or progress >= 1.0
-                            or (
-                                download.total_length
-                                and download.completed_length
-                                and download.completed_length >= download.total_length
-                            )
-                        ):
-
-                            completed_jobs[gid] = {
-                                "gid": gid,
-                                "name": (
-                                    str(download.name) if download.name else "Unknown"
-                                ),
-                                "total_length": (
-                                    int(download.total_length)
-                                    if download.total_length
-                                    else 0
-                                ),
-                                "completed_at": datetime.now().isoformat(),
-                                "file_path": (
-                                    str(download.files[0].path)
-                                    if download.files
-                                    else ""
-                                ),
-                            }
-                        else:
-                            # アクティブなジョブとして追加
-                            download_jobs[gid] = {
-                                "gid": gid,
-                                "name": (
-                                    str(download.name) if download.name else "Unknown"
-                                ),
-                                "progress": progress,
-                                "download_speed": (
-                                    int(download.download_speed)
-                                    if download.download_speed
-                                    else 0
-                                ),
-                                "eta": eta_seconds,
-                                "completed_length": (
-                                    int(download.completed_length)
-                                    if download.completed_length
-                                    else 0
-                                ),
-                                "total_length": (
-                                    int(download.total_length)
-                                    if download.total_length
-                                    else 0
-                                ),
-                                "status": str(download.status),
-                                "created_at": datetime.now().isoformat(),
-                                "updated_at": datetime.now().isoformat(),
-                            }
-
-                # 削除されたジョブをクリーンアップ
-                jobs_to_remove = [
-                    gid for gid in download_jobs.keys() if gid not in current_gids
-                ]
-                for gid in jobs_to_remove:
-                    if gid in download_jobs:
-                        del download_jobs[gid]
 
-        except Exception as e:
-            logging.error(f"Error updating download info: {e}")
+def run_monitor_tick(timer, errors):
+    """監視ループの1回分（aria2・プラグインの反映、コミット、公開、帯域の配分）"""
+    # 1回の更新での書き込みは1トランザクションにまとめる
+    with job_store.batch():
+        # バックエンドごとに反映（1つが落ちていても他は更新する）
+        for backend in aria2_backends.available if aria2_backends else []:
+            try:
+                if backend.monitor is None:
+                    backend.monitor = create_aria2_monitor(backend)
+                sync_aria2_backend(backend, timer)
+            except Exception as e:
+                logging.error(f"Error updating download info ({backend.name}): {e}")
+                errors.append(f"{backend.name}: {e}")
 
         # プラグインからの進捗も更新
+        with timer.phase("plugins"), job_state.lock:
+            try:
+                sync_plugin_jobs()
+            except Exception as e:
+                logging.error(f"Error updating plugin download info: {e}")
+                errors.append(f"plugins: {e}")
+
+        active_jobs.set(len(download_jobs))
+
+    # 1回分の変更をコミットしてからまとめて読み取り側へ公開する
+    with timer.phase("publish"):
+        publish_jobs()
+
+    with timer.phase("bandwidth"):
+        try:
+            apply_bandwidth_limits()
+        except Exception as e:
+            logging.error(f"Error applying bandwidth limits: {e}")
+            errors.append(f"bandwidth: {e}")
+
+
+def update_download_info():
+    """ダウンロード監視ループ
+
+    1回ごとにフェーズ（aria2の取得・差分反映・プラグイン）の所要時間を記録し、
+    処理に時間が掛かっている間は間隔を広げる。遅い回はスタックの採取結果を保存できる。
+    コミットや公開に失敗しても監視は止めない（保留中の書き込みは次の回でコミットする）。
+    """
+    while True:
+        timer = PhaseTimer("Monitor tick")
+        errors = []
+        sleep = monitor_ticks.interval
         try:
-            if plugin_manager:
-                for plugin in plugin_manager.get_all_plugins():
-                    # アクティブなダウンロードをチェック
-                    if hasattr(plugin, "active_downloads"):
-                        for job_id, job_info in plugin.active_downloads.items():
-                            plugin_key = f"plugin_{job_id}"
-                            download_jobs[plugin_key] = {
-                                "gid": plugin_key,
-                                "name": job_info.get("filename", "Unknown"),
-                                "progress": job_info.get("progress", 0.0),
-                                "download_speed": job_info.get("speed", 0),
-                                "eta": job_info.get("eta", 0),
-                                "completed_length": job_info.get("downloaded_bytes", 0),
-                                "total_length": job_info.get("total_bytes", 0),
-                                "status": job_info.get("status", "active"),
-                                "plugin_type": plugin.__class__.__name__,
-                                "created_at": job_info.get(
-                                    "created_at", datetime.now().isoformat()
-                                ),
-                                "updated_at": datetime.now().isoformat(),
-                            }
-
-                    # 完了したダウンロードをチェック
-                    if hasattr(plugin, "completed_downloads"):
-                        for job_id, job_info in plugin.completed_downloads.items():
-                            plugin_key = f"plugin_{job_id}"
-                            if plugin_key not in completed_jobs:
-                                completed_jobs[plugin_key] = {
-                                    "gid": plugin_key,
-                                    "name": job_info.get("filename", "Unknown"),
-                                    "total_length": job_info.get("total_bytes", 0),
-                                    "completed_at": job_info.get(
-                                        "completed_at", datetime.now().isoformat()
-                                    ),
-                                    "file_path": job_info.get("file_path", ""),
-                                    "plugin_type": plugin.__class__.__name__,
-                                }
-                                # アクティブリストから削除
-                                if plugin_key in download_jobs:
-                                    del download_jobs[plugin_key]
+            if stack_sampler is not None:
+                stack_sampler.start(threading.get_ident())
+
+            try:
+                with monitor_tick.time():
+                    run_monitor_tick(timer, errors)
+            except Exception as e:
+                logging.exception(f"Error in monitor tick: {e}")
+                errors.append(f"tick: {e}")
+
+            samples = stack_sampler.stop() if stack_sampler is not None else None
+            tick = monitor_ticks.record(timer, errors)
+            sleep = tick["sleep"]
+            for name, seconds in tick["phases"].items():
+                monitor_phase.labels(name.partition(":")[0]).observe(seconds)
+            if tick["slow"]:
+                logging.warning(f"Slow monitor tick: {timer.report()}")
+                if samples:
+                    tick["profile"] = stack_sampler.dump(samples, MONITOR_PROFILE_DIR)
         except Exception as e:
-            logging.error(f"Error updating plugin download info: {e}")
+            logging.exception(f"Error recording monitor tick: {e}")
 
-        time.sleep(1)  # 1秒ごとに更新
+        time.sleep(sleep)
 
 
 @app.route("/")
@@ -355,12 +765,12 @@ def get_config():
     return jsonify(
         {
             "download_dir": DEFAULT_DOWNLOAD_DIR,
-            "aria2_enabled": aria2_api is not None,
+            "aria2_enabled": aria2_backends is not None,
             "plugins_enabled": plugin_manager is not None,
             "available_plugins": [
-                plugin.__class__.__name__
-                for plugin in (
-                    plugin_manager.get_all_plugins() if plugin_manager else []
+                spec.name
+                for spec in (
+                    plugin_manager.get_plugin_specs() if plugin_manager else []
                 )
             ],
         }
@@ -370,23 +780,164 @@ def get_config():
 # API エンドポイント
 @app.route("/api/downloads", methods=["GET"])
 def get_downloads():
-    """現在のダウンロード一覧を取得"""
+    """現在のダウンロード一覧を取得
+
+    クエリパラメータ（すべて任意）:
+        state: active / completed のどちらかに絞り込む
+        status: ステータスで絞り込み（カンマ区切り）
+        plugin: プラグイン種別で絞り込み（カンマ区切り、aria2ジョブは "aria2"）
+        limit, offset: 一覧ごとのページング
+        since: 前回のレスポンスの cursor より後に変更されたジョブだけを返す
+            （cursor 以外の値は差分の基準にならず、全件を返す）
+    """
     try:
-        # データをJSON serializable に変換
-        active_data = make_json_serializable(list(download_jobs.values()))
-        completed_data = make_json_serializable(list(completed_jobs.values()))
+        # 公開済みのスナップショットから読む（監視ループの更新中でもロック不要）
+        snapshot = job_state.snapshot()
+        # リビジョンが変わっていなければ本文を作らずに304を返す
+        etag = revision_cursor(snapshot.revision)
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+
+        if not request.args:
+            # ジョブごとにキャッシュされたJSONをつなげる（全件を再エンコードしない）
+            response = json_response(
+                {
+                    "active": job_state.query("active", snapshot)[1],
+                    "completed": job_state.query("completed", snapshot)[1],
+                }
+            )
+            response.set_etag(etag, weak=True)
+            return response
 
-        return jsonify(
-            {
-                "active": active_data,
-                "completed": completed_data,
-            }
-        )
+        try:
+            query = _parse_downloads_query(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        removed = None
+        changed = None
+        if query["since"] is not None:
+            # 別のプロセス（再起動前など）のカーソルはリビジョンの意味が違うため全件を返す
+            since = parse_revision_cursor(query["since"])
+            diff = job_revisions.changed_since(since) if since is not None else None
+            if diff is not None:
+                changed, removed = diff
+
+        result = {
+            "cursor": revision_cursor(snapshot.revision),
+            "total": {},
+        }
+        for state in ("active", "completed"):
+            if query["state"] and query["state"] != state:
+                continue
+            total, items = job_state.query(
+                state,
+                snapshot,
+                statuses=query["status"],
+                plugins=query["plugin"],
+                gids=changed,
+                limit=query["limit"],
+                offset=query["offset"],
+            )
+            result["total"][state] = total
+            result[state] = items
+
+        if query["since"] is not None:
+            # 差分を返せない（古すぎる・別のプロセスのカーソル）場合は全件を返して通知する
+            result["full"] = changed is None
+            result["removed"] = removed or []
+
+        response = json_response(result)
+        response.set_etag(etag, weak=True)
+        return response
     except Exception as e:
         logging.error(f"Error getting downloads: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+def revision_cursor(revision):
+    """差分取得のカーソル（ETagと同じ値。プロセスごとのIDでリビジョンを区別する）"""
+    return f"{INSTANCE_ID}-r{revision}"
+
+
+def parse_revision_cursor(cursor):
+    """このプロセスが返したカーソルのリビジョン（他のプロセスのものや不正な値はNone）"""
+    instance, _, revision = cursor.rpartition("-r")
+    if instance != INSTANCE_ID or not revision.isdigit():
+        return None
+    return int(revision)
+
+
+def json_response(payload):
+    """ジョブの一覧を含むレスポンス（jsonify と同じ形式で、ジョブのJSONはキャッシュを使う）"""
+    return app.response_class(encode_response(payload), mimetype="application/json")
+
+
+def _parse_downloads_query(args):
+    """ダウンロード一覧のクエリパラメータを解析"""
+
+    def to_int(name, minimum):
+        value = args.get(name)
+        if value is None or value == "":
+            return None
+        try:
+            number = int(value)
+        except ValueError:
+            raise ValueError(f"{name} must be an integer")
+        if number < minimum:
+            raise ValueError(f"{name} must be >= {minimum}")
+        return number
+
+    def to_set(name):
+        value = args.get(name)
+        return (
+            {item.strip() for item in value.split(",") if item.strip()}
+            if value
+            else None
+        )
+
+    state = args.get("state")
+    if state not in (None, "", "active", "completed"):
+        raise ValueError("state must be 'active' or 'completed'")
+
+    return {
+        "state": state or None,
+        "status": to_set("status"),
+        "plugin": to_set("plugin"),
+        "limit": to_int("limit", 0),
+        "offset": to_int("offset", 0) or 0,
+        "since": args.get("since") or None,
+    }
+
+
+@app.route("/api/events", methods=["GET"])
+def stream_events():
+    """ジョブの差分をServer-Sent Eventsで配信"""
+    subscription = event_broker.subscribe()
+    if subscription is None:
+        return jsonify({"error": "Too many event subscribers"}), 503
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            for event_type, data in event_broker.stream(subscription):
+                if event_type is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                payload = json_dumps(data)
+                yield f"event: {event_type}\ndata: {payload}\n\n"
+        finally:
+            event_broker.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/api/download", methods=["POST"])
 def add_download():
     """新しいダウンロードを追加"""
@@ -396,17 +947,24 @@ def add_download():
 
         if not url:
             return jsonify({"error": "URL is required"}), 400
+        priority = data.get("priority", DEFAULT_PRIORITY)
+        if priority not in PRIORITIES:
+            return jsonify({"error": f"Unknown priority: {priority}"}), 400
 
         # プラグインシステムを最初にチェック
         if plugin_manager:
             plugin = plugin_manager.get_plugin_for_url(url)
             if plugin:
                 try:
-                    job_id = plugin.download(url, DEFAULT_DOWNLOAD_DIR)
+                    job_id = plugin.download(
+                        url, DEFAULT_DOWNLOAD_DIR, priority=priority
+                    )
+                    gid = job_registry.add_plugin_job(plugin, job_id, priority=priority)
+                    submitted_urls.set(url, gid)
                     return jsonify(
                         {
                             "success": True,
-                            "gid": f"plugin_{job_id}",
+                            "gid": gid,
                             "plugin": plugin.__class__.__name__,
                         }
                     )
@@ -415,50 +973,209 @@ def add_download():
                     # プラグインが失敗した場合はaria2にフォールバック
 
         # aria2を使用
-        if not aria2_api:
+        if not aria2_backends:
             return jsonify({"error": "No download method available"}), 500
 
-        # ダウンロードを開始（ダウンロードディレクトリを指定）
-        download = aria2_api.add_uris([url], options={"dir": DEFAULT_DOWNLOAD_DIR})
-
-        return jsonify({"success": True, "gid": download.gid})
+        # 負荷の低いaria2でダウンロードを開始（ダウンロードディレクトリを指定）
+        backend = aria2_backends.choose()
+        options = aria2_options(priority)
+        raw_gid = backend.call("aria2.addUri", [url], options)
+        note_aria2_limit(backend, raw_gid, options)
+        if backend.monitor:
+            # 待機中のジョブは通知が来ないため次回の取得で確認する
+            backend.monitor.mark_dirty(raw_gid)
+        gid = aria2_backends.qualify(backend, raw_gid)
+        job_registry.add_aria2_job(gid, backend, raw_gid, priority=priority)
+        submitted_urls.set(url, gid)
+
+        return jsonify({"success": True, "gid": gid})
     except Exception as e:
         logging.error(f"Error adding download: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/downloads/batch", methods=["POST"])
+def add_downloads_batch():
+    """複数のダウンロードを一括追加
+
+    JSON（URLの配列、または {"urls": [...], "priority": ...}）か改行区切りのテキスト
+    （優先度は ?priority=）を受け付ける。登録済みのURLは追加せず、既存のGIDを返す。
+    """
+    try:
+        priority = request.args.get("priority", DEFAULT_PRIORITY)
+        if request.is_json:
+            data = request.get_json()
+            if isinstance(data, dict):
+                priority = data.get("priority", priority)
+            urls = data.get("urls", []) if isinstance(data, dict) else data
+            if not isinstance(urls, list) or not all(
+                isinstance(url, str) for url in urls
+            ):
+                return jsonify({"error": "urls must be a list of strings"}), 400
+            urls = [url.strip() for url in urls if url.strip()]
+        else:
+            # 大きなリストも一度に読み込まず行ごとに処理する
+            urls = parse_url_lines(request.stream)
+
+        if not urls:
+            return jsonify({"error": "URL is required"}), 400
+        if priority not in PRIORITIES:
+            return jsonify({"error": f"Unknown priority: {priority}"}), 400
+
+        results = [{"url": url} for url in urls]
+        known = find_known_urls([result["url"] for result in results])
+        pending = {}
+        for result in results:
+            gid = known.get(result["url"])
+            if gid:
+                result.update({"gid": gid, "duplicate": True})
+            elif result["url"] in pending:
+                # 同じリスト内の重複は最初の1件の結果を使う
+                result["duplicate"] = True
+            else:
+                pending[result["url"]] = result
+        pending = list(pending.values())
+
+        # プラグインの振り分けは並列に行う
+        to_aria2 = []
+        if plugin_manager and pending:
+            with ThreadPoolExecutor(max_workers=min(16, len(pending))) as executor:
+                plugins = list(
+                    executor.map(
+                        plugin_manager.get_plugin_for_url,
+                        [result["url"] for result in pending],
+                    )
+                )
+        else:
+            plugins = [None] * len(pending)
+
+        for result, plugin in zip(pending, plugins):
+            if plugin:
+                try:
+                    job_id = plugin.download(
+                        result["url"], DEFAULT_DOWNLOAD_DIR, priority=priority
+                    )
+                    result.update(
+                        {
+                            "gid": job_registry.add_plugin_job(
+                                plugin, job_id, priority=priority
+                            ),
+                            "plugin": plugin.__class__.__name__,
+                        }
+                    )
+                    submitted_urls.set(result["url"], result["gid"])
+                    continue
+                except Exception as e:
+                    logging.error(f"Plugin download failed: {e}")
+            to_aria2.append(result)
+
+        # aria2行きはmulticallでまとめて登録
+        if to_aria2:
+            if not aria2_backends:
+                for result in to_aria2:
+                    result["error"] = "No download method available"
+            else:
+                # 負荷に応じてバックエンドへ振り分け、バックエンドごとに登録する
+                groups = {}
+                for result, backend in zip(
+                    to_aria2, aria2_backends.assign(len(to_aria2))
+                ):
+                    groups.setdefault(backend.name, (backend, []))[1].append(result)
+                for backend, group in groups.values():
+                    options = aria2_options(priority)
+                    added = add_uris_multicall(
+                        backend.api.client,
+                        [result["url"] for result in group],
+                        options=options,
+                    )
+                    for result, (raw_gid, error) in zip(group, added):
+                        if raw_gid:
+                            note_aria2_limit(backend, raw_gid, options)
+                            result["gid"] = aria2_backends.qualify(backend, raw_gid)
+                            job_registry.add_aria2_job(
+                                result["gid"], backend, raw_gid, priority=priority
+                            )
+                            submitted_urls.set(result["url"], result["gid"])
+                            if backend.monitor:
+                                backend.monitor.mark_dirty(raw_gid)
+                        else:
+                            result["error"] = error
+
+        first = {result["url"]: result for result in pending}
+        for result in results:
+            if result.get("duplicate") and "gid" not in result:
+                original = first[result["url"]]
+                for key in ("gid", "plugin", "error"):
+                    if key in original:
+                        result[key] = original[key]
+
+        return jsonify(
+            {
+                "success": True,
+                "results": results,
+                "added": sum(
+                    1 for r in results if "gid" in r and not r.get("duplicate")
+                ),
+                "duplicates": sum(1 for r in results if r.get("duplicate")),
+                "failed": sum(1 for r in results if "error" in r),
+            }
+        )
+    except Exception as e:
+        logging.error(f"Error adding downloads: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+def find_known_urls(urls):
+    """urls のうち登録済みのものとGIDの対応（アクティブ・完了済み・登録直後のジョブ）"""
+    known = job_state.find_urls(urls)
+    for url in urls:
+        if url not in known:
+            gid = submitted_urls.get(url)
+            if gid:
+                known[url] = gid
+    return known
+
+
+def find_plugin_job(gid):
+    """実行中のプラグインジョブの (プラグイン, ジョブID)（無ければNone）"""
+    entry = job_registry.get(gid)
+    if entry is None or entry.kind != "plugin":
+        return None
+    if entry.job_id not in getattr(entry.owner, "active_downloads", {}):
+        return None
+    return entry.owner, entry.job_id
+
+
+def find_aria2_job(gid):
+    """aria2のジョブの (バックエンド, aria2のGID)"""
+    entry = job_registry.get(gid)
+    if entry is not None and entry.kind == "aria2":
+        return entry.owner, entry.job_id
+    return aria2_backends.resolve(gid)
+
+
 @app.route("/api/download/<gid>/pause", methods=["POST"])
 def pause_download(gid):
     """ダウンロードを一時停止"""
     try:
         # プラグインジョブかチェック
-        if gid.startswith("plugin_"):
-            job_id = gid[7:]  # "plugin_" を除去
-            if plugin_manager:
-                for plugin in plugin_manager.get_all_plugins():
-                    if (
-                        hasattr(plugin, "active_downloads")
-                        and job_id in plugin.active_downloads
-                    ):
-                        success = plugin.pause(job_id)
-                        if success:
-                            return jsonify(
-                                {"success": True, "message": "Download paused"}
-                            )
-                        else:
-                            return (
-                                jsonify(
-                                    {"error": "Pause not supported by this plugin"}
-                                ),
-                                400,
-                            )
-            return jsonify({"error": "Plugin job not found"}), 404
+        if gid.startswith(PLUGIN_PREFIX):
+            found = find_plugin_job(gid)
+            if found is None:
+                return jsonify({"error": "Plugin job not found"}), 404
+            plugin, job_id = found
+            if not plugin.pause(job_id):
+                return jsonify({"error": "Pause not supported by this plugin"}), 400
+            job_registry.set_state(gid, PAUSED)
+            return jsonify({"success": True, "message": "Download paused"})
 
         # aria2ジョブ
-        if not aria2_api:
+        if not aria2_backends:
             return jsonify({"error": "Aria2 not available"}), 500
 
-        aria2_api.pause([gid])
+        backend, raw_gid = find_aria2_job(gid)
+        backend.call("aria2.pause", raw_gid)
+        job_registry.set_state(gid, PAUSED)
         return jsonify({"success": True, "message": "Download paused"})
 
     except Exception as e:
@@ -471,33 +1188,23 @@ def resume_download(gid):
     """ダウンロードを再開"""
     try:
         # プラグインジョブかチェック
-        if gid.startswith("plugin_"):
-            job_id = gid[7:]
-            if plugin_manager:
-                for plugin in plugin_manager.get_all_plugins():
-                    if (
-                        hasattr(plugin, "active_downloads")
-                        and job_id in plugin.active_downloads
-                    ):
-                        success = plugin.resume(job_id)
-                        if success:
-                            return jsonify(
-                                {"success": True, "message": "Download resumed"}
-                            )
-                        else:
-                            return (
-                                jsonify(
-                                    {"error": "Resume not supported by this plugin"}
-                                ),
-                                400,
-                            )
-            return jsonify({"error": "Plugin job not found"}), 404
+        if gid.startswith(PLUGIN_PREFIX):
+            found = find_plugin_job(gid)
+            if found is None:
+                return jsonify({"error": "Plugin job not found"}), 404
+            plugin, job_id = found
+            if not plugin.resume(job_id):
+                return jsonify({"error": "Resume not supported by this plugin"}), 400
+            job_registry.set_state(gid, ACTIVE)
+            return jsonify({"success": True, "message": "Download resumed"})
 
         # aria2ジョブ
-        if not aria2_api:
+        if not aria2_backends:
             return jsonify({"error": "Aria2 not available"}), 500
 
-        aria2_api.resume([gid])
+        backend, raw_gid = find_aria2_job(gid)
+        backend.call("aria2.unpause", raw_gid)
+        job_registry.set_state(gid, ACTIVE)
         return jsonify({"success": True, "message": "Download resumed"})
 
     except Exception as e:
@@ -510,32 +1217,34 @@ def cancel_download(gid):
     """ダウンロードをキャンセル"""
     try:
         # プラグインジョブかチェック
-        if gid.startswith("plugin_"):
-            job_id = gid[7:]
-            if plugin_manager:
-                for plugin in plugin_manager.get_all_plugins():
-                    if (
-                        hasattr(plugin, "active_downloads")
-                        and job_id in plugin.active_downloads
-                    ):
-                        success = plugin.cancel(job_id)
-                        if success:
-                            return jsonify(
-                                {"success": True, "message": "Download cancelled"}
-                            )
-                        else:
-                            return jsonify({"error": "Cancel failed"}), 400
+        if gid.startswith(PLUGIN_PREFIX):
+            found = find_plugin_job(gid)
+            if found is not None:
+                plugin, job_id = found
+                if not plugin.cancel(job_id):
+                    return jsonify({"error": "Cancel failed"}), 400
+                job_registry.discard(gid)
+                return jsonify({"success": True, "message": "Download cancelled"})
+            # 再起動で中断されたジョブは一覧から取り除くだけ
+            if remove_job(download_jobs, gid):
+                return jsonify({"success": True, "message": "Download cancelled"})
             return jsonify({"error": "Plugin job not found"}), 404
 
         # aria2ジョブ
-        if not aria2_api:
+        if not aria2_backends:
             return jsonify({"error": "Aria2 not available"}), 500
 
-        aria2_api.remove([gid])
+        backend, raw_gid = find_aria2_job(gid)
+        try:
+            backend.call("aria2.remove", raw_gid)
+        except Exception as e:
+            # 停止済み（完了・エラー）のジョブは結果の削除のみ行う
+            logging.debug(f"aria2.remove failed, removing result only: {e}")
+            backend.call("aria2.removeDownloadResult", raw_gid)
 
         # ローカルからも削除
-        if gid in download_jobs:
-            del download_jobs[gid]
+        job_registry.discard(gid)
+        remove_job(download_jobs, gid)
 
         return jsonify({"success": True, "message": "Download cancelled"})
 
@@ -552,12 +1261,12 @@ def get_plugins():
             return jsonify({"plugins": [], "message": "Plugin system not available"})
 
         plugins_info = []
-        for plugin in plugin_manager.get_all_plugins():
+        for spec in plugin_manager.get_plugin_specs():
             plugins_info.append(
                 {
-                    "name": plugin.__class__.__name__,
-                    "type": plugin.__class__.__name__.replace("Plugin", ""),
-                    "description": plugin.__doc__ or "No description available",
+                    "name": spec.name,
+                    "type": spec.name.replace("Plugin", ""),
+                    "description": spec.description or "No description available",
                 }
             )
 
@@ -568,25 +1277,48 @@ def get_plugins():
         return jsonify({"error": str(e)}), 500
 
 
+def find_completed_job(gid):
+    """完了したジョブ（監視ループが取り込む前のプラグインのジョブも含む。無ければNone）"""
+    job = completed_jobs.get(gid)
+    if job is not None:
+        return job
+    entry = job_registry.get(gid)
+    if entry is None or entry.kind != "plugin":
+        return None
+    info = getattr(entry.owner, "completed_downloads", {}).get(entry.job_id)
+    if info is None:
+        return None
+    return {
+        "gid": gid,
+        "name": info.get("filename", "Unknown"),
+        "file_path": info.get("file_path", ""),
+    }
+
+
 @app.route("/api/completed/<gid>/delete", methods=["POST"])
 def delete_completed(gid):
     """完了したダウンロードを削除"""
     try:
-        if gid in completed_jobs:
-            # ファイルも削除するかどうかの確認
-            data = request.get_json() or {}
-            delete_file = data.get("delete_file", False)
-
-            if delete_file and "file_path" in completed_jobs[gid]:
-                file_path = completed_jobs[gid]["file_path"]
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-
-            del completed_jobs[gid]
-            return jsonify({"success": True, "message": "Completed job deleted"})
-        else:
+        job = find_completed_job(gid)
+        if job is None:
             return jsonify({"error": "Job not found"}), 404
 
+        # ファイルも削除するかどうかの確認
+        data = request.get_json(silent=True) or {}
+        delete_file = data.get("delete_file", False)
+
+        file_path = job.get("file_path")
+        if delete_file and file_path and os.path.exists(file_path):
+            os.remove(file_path)
+
+        # プラグイン側の記録も消して、監視ループが再び取り込まないようにする
+        entry = job_registry.discard(gid)
+        if entry is not None and entry.kind == "plugin":
+            getattr(entry.owner, "completed_downloads", {}).pop(entry.job_id, None)
+        if not remove_job(completed_jobs, gid):
+            notify_job_removed(gid)
+        return jsonify({"success": True, "message": "Completed job deleted"})
+
     except Exception as e:
         logging.error(f"Error deleting completed job: {e}")
         return jsonify({"error": str(e)}), 500
@@ -596,10 +1328,11 @@ def delete_completed(gid):
 def get_stats():
     """統計情報を取得"""
     try:
-        total_active = len(download_jobs)
-        total_completed = len(completed_jobs)
+        snapshot = job_state.snapshot()
+        total_active = len(snapshot.active)
+        total_completed = job_state.query("completed", snapshot, limit=0)[0]
         total_speed = sum(
-            job.get("download_speed", 0) for job in download_jobs.values()
+            job.get("download_speed", 0) for job in snapshot.active.values()
         )
 
         stats_data = {
@@ -608,51 +1341,73 @@ def get_stats():
             "total_download_speed": int(total_speed),
         }
 
-        return jsonify(make_json_serializable(stats_data))
+        return jsonify(stats_data)
 
     except Exception as e:
         logging.error(f"Error getting stats: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/bandwidth", methods=["GET"])
+def get_bandwidth():
+    """帯域制限の設定と、優先度ごとの現在の配分を取得"""
+    return jsonify(bandwidth_limiter.status())
+
+
+@app.route("/api/bandwidth", methods=["POST"])
+def set_bandwidth():
+    """帯域制限の設定を変更（limit / shares / schedule の指定した項目だけ）
+
+    プラグインの転送にはすぐに、aria2には次回の監視ループで反映する。
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "JSON object is required"}), 400
+    try:
+        bandwidth_limiter.configure(
+            rate=parse_rate(data["limit"]) if "limit" in data else None,
+            shares=parse_shares(data["shares"]) if "shares" in data else None,
+            schedule=(parse_schedule(data["schedule"]) if "schedule" in data else None),
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid bandwidth settings: {e}"}), 400
+    return jsonify(bandwidth_limiter.status())
+
+
+@app.route("/api/debug/monitor", methods=["GET"])
+def debug_monitor():
+    """監視ループの直近の所要時間（フェーズごと）を取得"""
+    limit = request.args.get("limit", type=int)
+    data = monitor_ticks.snapshot(limit)
+    data["profiling"] = stack_sampler is not None
+    return jsonify(data)
+
+
 @app.route("/api/file/<gid>", methods=["GET"])
 def download_file(gid):
-    """完了したファイルをダウンロード"""
+    """完了したファイルをダウンロード（Range・条件付きリクエスト対応）"""
     try:
-        if gid in completed_jobs:
-            completed_job = completed_jobs[gid]
-            file_path = completed_job.get("file_path")
-
-            if file_path and os.path.exists(file_path):
-                filename = completed_job.get("name", "download")
-                return send_file(file_path, as_attachment=True, download_name=filename)
-            else:
-                return jsonify({"error": "File not found"}), 404
-        else:
+        completed_job = find_completed_job(gid)
+        if completed_job is None:
             return jsonify({"error": "Job not found"}), 404
 
+        file_path = completed_job.get("file_path")
+        if not file_path or not os.path.isfile(file_path):
+            return jsonify({"error": "File not found"}), 404
+        filename = completed_job.get("name") or "download"
+
+        lock = app.config.get("OWNER_LOCK")
+        token = request.headers.get(OWNER_TOKEN_HEADER)
+        if lock is not None and token and secrets.compare_digest(token, lock.token):
+            # 転送元のワーカーが直接送信する（ファイルの本体はこのプロセスを経由しない）
+            return local_file_response(file_path, filename)
+        return file_server.send(file_path, filename)
+
     except Exception as e:
         logging.error(f"Error downloading file: {e}")
         return jsonify({"error": str(e)}), 500
 
 
-# ユーティリティ関数
-def make_json_serializable(obj):
-    """オブジェクトをJSON serializable に変換"""
-    if isinstance(obj, dict):
-        return {k: make_json_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [make_json_serializable(item) for item in obj]
-    elif hasattr(obj, "total_seconds"):  # timedelta
-        return int(obj.total_seconds())
-    elif hasattr(obj, "isoformat"):  # datetime
-        return obj.isoformat()
-    elif obj is None:
-        return None
-    else:
-        return obj
-
-
 def format_bytes(bytes_value):
     """バイト数を読みやすい形式に変換"""
     if bytes_value == 0:
@@ -682,6 +1437,66 @@ def format_time(seconds):
         return f"{hours}時間{minutes}分"
 
 
+def start_services():
+    """プラグイン・aria2・ダウンロード監視を起動（1つのプロセスでのみ実行する）"""
+    # ジョブストアは状態を持つプロセスでだけ開く（SQLiteの接続はforkをまたいで使えない）
+    open_job_store()
+    timer = PhaseTimer("Startup")
+
+    def timed(name, func):
+        with timer.phase(name):
+            return func()
+
+    # 重いプラグインの読み込み（yt_dlp）とaria2の起動を並行して行う
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        plugins_ready = executor.submit(timed, "plugins", initialize_plugins)
+        aria2_ready = executor.submit(timed, "aria2", start_aria2)
+        timed("restore_jobs", restore_interrupted_jobs)
+        plugins_ready.result()
+        timed("resume_downloads", resume_plugin_downloads)
+        aria2_started = aria2_ready.result()
+    timer.report()
+
+    if aria2_started:
+        logging.info("Aria2 server started successfully")
+    elif plugin_manager:
+        logging.warning("Failed to start Aria2 server. Plugin system only mode...")
+    else:
+        logging.error("Failed to start any download system")
+        return False
+
+    # バックグラウンドでダウンロード情報を更新
+    update_thread = threading.Thread(target=update_download_info, daemon=True)
+    update_thread.start()
+    logging.info("Download monitor started")
+    return True
+
+
+def create_app():
+    """本番サーバー（gunicorn）のワーカーごとに呼ばれるアプリケーションファクトリー
+
+    ロックを取れた1つのワーカーだけがジョブの状態を持って監視を実行し、
+    他のワーカーは /api/ へのリクエストをそのワーカーへ転送する。
+    """
+    lock = OwnerLock(OWNER_LOCK_PATH)
+    if lock.acquire():
+        if not start_services():
+            raise RuntimeError("Failed to start any download system")
+        # イベントの配信がgthreadのスレッドを使い切らないように同時接続数を抑える
+        requested = os.getenv("EVENTS_MAX_CLIENTS")
+        event_broker.max_clients = max_event_clients(
+            gunicorn_options()["threads"], int(requested) if requested else None
+        )
+        if int(os.getenv("WEB_WORKERS", "2")) > 1:
+            lock.publish(start_internal_server(app, gunicorn_options()))
+        app.config["OWNER_LOCK"] = lock
+        logging.info(f"Worker {os.getpid()} owns the download state")
+    else:
+        OwnerProxy(lock, file_server=file_server).init_app(app)
+        logging.info(f"Worker {os.getpid()} forwards API requests to the owner")
+    return app
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger("Arial")
@@ -689,40 +1504,20 @@ if __name__ == "__main__":
     print("Starting Arial...")
     load_dotenv()
 
-    # プラグインシステムを初期化
-    initialize_plugins()
-
-    # Aria2サーバーを起動
-    if start_aria2():
-        print("Aria2 server started successfully")
-
-        # バックグラウンドでダウンロード情報を更新
-        update_thread = threading.Thread(target=update_download_info, daemon=True)
-        update_thread.start()
-        print("Download monitor started")
-
-        # Flaskサーバーを起動
-        if os.getenv("MODE") == "dev":
-            print("Running in development mode")
-            app.run(debug=True, host="0.0.0.0", port=5000)
-        else:
-            print("Running in production mode")
-            app.run(host="0.0.0.0", port=80)
-    else:
-        print("Failed to start Aria2 server. Plugin system only mode...")
-        if plugin_manager:
-            print("Running with plugin system only")
-            # バックグラウンドでダウンロード情報を更新
-            update_thread = threading.Thread(target=update_download_info, daemon=True)
-            update_thread.start()
-            print("Download monitor started")
-
-            if os.getenv("MODE") == "dev":
-                print("Running in development mode")
-                app.run(debug=True, host="0.0.0.0", port=5000)
-            else:
-                print("Running in production mode")
-                app.run(host="0.0.0.0", port=80)
-        else:
+    if os.getenv("MODE") == "dev" and "--serve" not in sys.argv:
+        print("Running in development mode")
+        if not start_services():
             print("Failed to start any download system. Exiting...")
             exit(1)
+        app.run(debug=True, host="0.0.0.0", port=5000)
+    else:
+        print("Running in production mode")
+        try:
+            run_gunicorn(create_app, gunicorn_options())
+        except ImportError:
+            # gunicornが無い環境（Windowsなど）では単一プロセスで起動する
+            logging.warning("gunicorn not available, using the built-in server")
+            if not start_services():
+                print("Failed to start any download system. Exiting...")
+                exit(1)
+            app.run(host="0.0.0.0", port=80, threaded=True)
@@ -1,16 +1,36 @@
 # プラグインシステム
 
+import importlib.util
+
 from .base import DownloadPlugin, PluginManager
 from .http_plugin import HTTPDownloadPlugin
+from .manifest import PLUGIN_MANIFEST, LazyPlugin, PluginSpec
+from .ratelimit import BandwidthLimiter
+from .scheduler import DownloadScheduler
+from .session import SessionPool
 
-try:
-    from .youtube_plugin import YouTubeDLPlugin
-
-    YOUTUBE_PLUGIN_AVAILABLE = True
-except ImportError:
-    YOUTUBE_PLUGIN_AVAILABLE = False
+# yt_dlpは読み込みに時間がかかるため、YouTubeDLPlugin は参照されたときにインポートする
+YOUTUBE_PLUGIN_AVAILABLE = importlib.util.find_spec("yt_dlp") is not None
 
-__all__ = ["DownloadPlugin", "PluginManager", "HTTPDownloadPlugin"]
+__all__ = [
+    "DownloadPlugin",
+    "PluginManager",
+    "HTTPDownloadPlugin",
+    "DownloadScheduler",
+    "BandwidthLimiter",
+    "LazyPlugin",
+    "PLUGIN_MANIFEST",
+    "PluginSpec",
+    "SessionPool",
+]
 
 if YOUTUBE_PLUGIN_AVAILABLE:
     __all__.append("YouTubeDLPlugin")
+
+
+def __getattr__(name):
+    if name == "YouTubeDLPlugin" and YOUTUBE_PLUGIN_AVAILABLE:
+        from .youtube_plugin import YouTubeDLPlugin
+
+        return YouTubeDLPlugin
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
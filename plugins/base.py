@@ -2,13 +2,80 @@
 プラグインの基底クラスとインターフェース
 """
 
-from abc import ABC, abstractmethod
 import logging
+import os
+from abc import ABC, abstractmethod
+from urllib.parse import urlsplit
+
+from .manifest import PLUGIN_MANIFEST, LazyPlugin, requirements_met
+from .ratelimit import (
+    DEFAULT_PRIORITY,
+    PRIORITIES,
+    BandwidthLimiter,
+    get_default_limiter,
+)
+from .router import URLRouter
+from .scheduler import DownloadScheduler, ScheduledTask, get_default_scheduler
+from .session import SessionPool, get_default_pool
 
 
 class DownloadPlugin(ABC):
     """ダウンロードプラグインの基底クラス"""
 
+    # PluginManagerが共有の接続プール・スケジューラー・帯域制限を設定する
+    session_pool: SessionPool = None
+    scheduler: DownloadScheduler = None
+    limiter: BandwidthLimiter = None
+
+    @property
+    def session(self):
+        """共有HTTPセッション（キープアライブ・リトライ付き）"""
+        if self.session_pool is None:
+            self.session_pool = get_default_pool()
+        return self.session_pool.session
+
+    def _throttle(self, job_id: str):
+        """ジョブの優先度に応じた帯域の割り当て（転送の間だけ使う）"""
+        if self.limiter is None:
+            self.limiter = get_default_limiter()
+        return self.limiter.throttle(self.active_downloads[job_id].get("priority"))
+
+    def _schedule(
+        self, job_id: str, url: str, target, args: tuple, priority: int = None
+    ) -> ScheduledTask:
+        """ダウンロードをスケジューラーのキューに登録（開始までは queued 状態）
+
+        priority を省略するとジョブの優先度（"high" / "normal" / "low"）から決める。
+        """
+        if priority is None:
+            priority = PRIORITIES.get(
+                self.active_downloads[job_id].get("priority"),
+                PRIORITIES[DEFAULT_PRIORITY],
+            )
+        if self.scheduler is None:
+            self.scheduler = get_default_scheduler()
+
+        def run():
+            info = self.active_downloads.get(job_id)
+            if info is None or info.get("status") == "cancelled":
+                return
+            if info.get("status") == "queued":
+                info["status"] = "downloading"
+            target(*args)
+
+        self.active_downloads[job_id]["status"] = "queued"
+        return self.scheduler.submit(
+            job_id,
+            run,
+            plugin=self.__class__.__name__,
+            host=urlsplit(url).hostname,
+            priority=priority,
+        )
+
+    def _unschedule(self, job_id: str) -> bool:
+        """開始前のダウンロードをキューから取り除く"""
+        return self.scheduler is not None and self.scheduler.cancel(job_id)
+
     @abstractmethod
     def can_handle(self, url: str) -> bool:
         """このプラグインがURLを処理できるかチェック"""
@@ -20,8 +87,10 @@ class DownloadPlugin(ABC):
         pass
 
     @abstractmethod
-    def download(self, url: str, output_path: str = None) -> str:
-        """ダウンロードを実行し、ジョブIDを返す"""
+    def download(
+        self, url: str, output_path: str = None, priority: str = DEFAULT_PRIORITY
+    ) -> str:
+        """ダウンロードを実行し、ジョブIDを返す（priority は "high" / "normal" / "low"）"""
         pass
 
     @abstractmethod
@@ -48,46 +117,73 @@ class DownloadPlugin(ABC):
 class PluginManager:
     """プラグインマネージャー"""
 
-    def __init__(self):
-        self.plugins = []
+    def __init__(
+        self,
+        session_pool: SessionPool = None,
+        scheduler: DownloadScheduler = None,
+        limiter: BandwidthLimiter = None,
+    ):
+        self.specs = []
+        self.lazy_plugins = []
+        self.session_pool = session_pool or get_default_pool()
+        self.scheduler = scheduler or get_default_scheduler()
+        self.limiter = limiter or get_default_limiter()
+        self.router = None
         self.load_plugins()
 
     def load_plugins(self):
-        """利用可能なプラグインを読み込み"""
-        self.plugins = []
-
-        # HTTPダウンロードプラグインは常に追加
-        try:
-            from .http_plugin import HTTPDownloadPlugin
-
-            self.plugins.append(HTTPDownloadPlugin())
-            logging.info("HTTPDownloadPlugin loaded successfully")
-        except Exception as e:
-            logging.error(f"Failed to load HTTPDownloadPlugin: {e}")
-
-        # YouTube-DLプラグインは条件付きで追加
-        try:
-            import yt_dlp  # インポートテスト
-            from .youtube_plugin import YouTubeDLPlugin
-
-            self.plugins.append(YouTubeDLPlugin())
-            logging.info("YouTubeDLPlugin loaded successfully")
-        except ImportError:
-            logging.warning("yt-dlp not available, YouTubeDLPlugin disabled")
-        except Exception as e:
-            logging.error(f"Failed to load YouTubeDLPlugin: {e}")
+        """利用可能なプラグインを登録（遅延読み込みのものはURLが来るまでインポートしない）"""
+        self.specs = []
+        self.lazy_plugins = []
+        for spec in PLUGIN_MANIFEST:
+            if not requirements_met(spec):
+                logging.warning(
+                    f"{', '.join(spec.requires)} not available, {spec.name} disabled"
+                )
+                continue
+            plugin = LazyPlugin(spec, self.session_pool, self.scheduler, self.limiter)
+            if not spec.lazy and plugin.resolve() is None:
+                continue
+            self.lazy_plugins.append(plugin)
+            self.specs.append(spec)
+
+        if self.router is not None:
+            self.router.shutdown()
+        self.router = URLRouter(
+            self.lazy_plugins,
+            probe_timeout=float(os.getenv("ROUTER_PROBE_TIMEOUT", "0.25")),
+            cache_ttl=float(os.getenv("ROUTER_CACHE_TTL", "300")),
+        )
 
     def get_plugin_for_url(self, url: str) -> DownloadPlugin:
-        """URLに適したプラグインを取得"""
-        for plugin in self.plugins:
-            if plugin.can_handle(url):
-                return plugin
-        return None
+        """URLに適したプラグインを取得（遅いサーバーの応答は待たない）"""
+        return self.router.route(url)
+
+    def get_scheduler(self) -> DownloadScheduler:
+        """プラグイン共有のダウンロードスケジューラーを取得"""
+        return self.scheduler
+
+    def get_limiter(self) -> BandwidthLimiter:
+        """プラグイン共有の帯域制限を取得"""
+        return self.limiter
+
+    def get_session_pool(self) -> SessionPool:
+        """プラグイン共有のHTTP接続プールを取得"""
+        return self.session_pool
+
+    @property
+    def plugins(self) -> list:
+        """読み込み済みのプラグイン"""
+        return [plugin.instance for plugin in self.lazy_plugins if plugin.loaded]
 
     def get_all_plugins(self) -> list:
-        """全プラグインを取得"""
+        """読み込み済みの全プラグインを取得（ジョブを持つのは読み込まれたものだけ）"""
         return self.plugins
 
+    def get_plugin_specs(self) -> list:
+        """利用可能な全プラグインの登録情報を取得（読み込みは行わない）"""
+        return list(self.specs)
+
     def reload_plugins(self):
         """プラグインを再読み込み"""
         self.load_plugins()
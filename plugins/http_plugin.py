@@ -4,20 +4,52 @@ HTTPダウンロードプラグイン
 """
 
 import os
-import time
 import uuid
-import requests
-import threading
 from datetime import datetime
+
 from .base import DownloadPlugin
+from .journal import SegmentJournal, find_journals
+from .progress import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_PROGRESS_INTERVAL,
+    TransferMeter,
+    iter_chunks,
+)
+from .ratelimit import DEFAULT_PRIORITY
+from .segmented import RangeNotSupported, Segment, SegmentedDownloader
 
 
 class HTTPDownloadPlugin(DownloadPlugin):
     """標準的なHTTPダウンロード対応プラグイン"""
 
-    def __init__(self):
+    supported_schemes = ("http", "https")
+
+    def __init__(
+        self,
+        segments: int = None,
+        min_segment_size: int = None,
+        chunk_size: int = None,
+        progress_interval: float = None,
+    ):
         self.active_downloads = {}
         self.completed_downloads = {}
+        self._workers = {}
+        # 分割ダウンロードの接続数（1で無効）と1区間の最小サイズ
+        self.segments = segments or int(os.getenv("HTTP_SEGMENTS", "4"))
+        self.min_segment_size = min_segment_size or int(
+            os.getenv("HTTP_MIN_SEGMENT_SIZE", str(4 * 1024 * 1024))
+        )
+        # 1回の読み込みの最大サイズと、進捗を反映する最短間隔（秒）
+        self.chunk_size = chunk_size or int(
+            os.getenv("HTTP_CHUNK_SIZE", str(DEFAULT_CHUNK_SIZE))
+        )
+        self.progress_interval = (
+            progress_interval
+            if progress_interval is not None
+            else float(
+                os.getenv("HTTP_PROGRESS_INTERVAL", str(DEFAULT_PROGRESS_INTERVAL))
+            )
+        )
 
     def can_handle(self, url: str) -> bool:
         """HTTP/HTTPSのファイル直リンクをチェック"""
@@ -26,7 +58,7 @@ class HTTPDownloadPlugin(DownloadPlugin):
     def _is_webpage(self, url: str) -> bool:
         """Webページかどうかを簡易判定"""
         try:
-            response = requests.head(url, timeout=5)
+            response = self.session.head(url, timeout=5)
             content_type = response.headers.get("content-type", "").lower()
             return "text/html" in content_type
         except:
@@ -35,7 +67,7 @@ class HTTPDownloadPlugin(DownloadPlugin):
     def get_info(self, url: str) -> dict:
         """ファイル情報を取得"""
         try:
-            response = requests.head(url, timeout=10)
+            response = self.session.head(url, timeout=10)
             filename = self._get_filename_from_url(url, response)
             file_size = int(response.headers.get("content-length", 0))
 
@@ -61,7 +93,9 @@ class HTTPDownloadPlugin(DownloadPlugin):
         # URLから取得
         return os.path.basename(url.split("?")[0]) or "downloaded_file"
 
-    def download(self, url: str, output_path: str = None) -> str:
+    def download(
+        self, url: str, output_path: str = None, priority: str = DEFAULT_PRIORITY
+    ) -> str:
         """ダウンロードを開始"""
         job_id = str(uuid.uuid4())
 
@@ -78,66 +112,138 @@ class HTTPDownloadPlugin(DownloadPlugin):
             "speed": 0,
             "filename": "",
             "output_path": output_path,
+            "priority": priority,
             "created_at": datetime.now().isoformat(),
         }
 
         # 別スレッドでダウンロード実行
-        thread = threading.Thread(
-            target=self._download_worker, args=(url, output_path, job_id)
-        )
-        thread.daemon = True
-        thread.start()
+        self._start_worker(job_id, (url, output_path, job_id))
 
         return job_id
 
-    def _download_worker(self, url: str, output_path: str, job_id: str):
+    def _start_worker(self, job_id: str, args: tuple):
+        """ワーカーをスケジューラーのキューに登録"""
+        self._workers[job_id] = self._schedule(
+            job_id, args[0], self._download_worker, args
+        )
+
+    def resume_interrupted(self, directory: str) -> list:
+        """ジャーナルが残っている（前回中断された）ダウンロードを再開"""
+        job_ids = []
+        for file_path in find_journals(directory):
+            journal = SegmentJournal.load(file_path)
+            if journal is None:
+                continue
+            job_id = journal.job_id or str(uuid.uuid4())
+            if job_id in self.active_downloads:
+                continue
+
+            completed = journal.completed_bytes
+            self.active_downloads[job_id] = {
+                "url": journal.url,
+                "status": "downloading",
+                "progress": completed / max(journal.total_size, 1),
+                "downloaded_bytes": completed,
+                "total_bytes": journal.total_size,
+                "speed": 0,
+                "filename": os.path.basename(file_path),
+                "output_path": directory,
+                "file_path": file_path,
+                "resumable": True,
+                "created_at": datetime.now().isoformat(),
+            }
+            self._start_worker(job_id, (journal.url, directory, job_id, journal))
+            job_ids.append(job_id)
+        return job_ids
+
+    def _download_worker(self, url: str, output_path: str, job_id: str, journal=None):
         """ダウンロードワーカー"""
         try:
-            response = requests.get(url, stream=True, timeout=30)
-            response.raise_for_status()
+            if journal is not None:
+                # 一時停止・中断からの再開（本文は取得せず、ヘッダーだけで続きを取れるか確認）
+                full_path = journal.file_path
+                response = self.session.head(url, allow_redirects=True, timeout=30)
+                response.close()
+                response.raise_for_status()
+                if not journal.matches(
+                    response.headers.get("etag"),
+                    response.headers.get("last-modified"),
+                ) or not self._supports_ranges(response, journal.total_size):
+                    # サーバー上のファイルが変わっていたら最初から取り直す
+                    journal.delete()
+                    journal = None
+                    response = self.session.get(url, stream=True, timeout=30)
+                    response.raise_for_status()
+            else:
+                response = self.session.get(url, stream=True, timeout=30)
+                response.raise_for_status()
 
-            filename = self._get_filename_from_url(url, response)
-            full_path = os.path.join(output_path, filename)
+                filename = self._get_filename_from_url(url, response)
+                full_path = os.path.join(output_path, filename)
 
-            # ディレクトリ作成
-            os.makedirs(output_path, exist_ok=True)
+                # ディレクトリ作成
+                os.makedirs(output_path, exist_ok=True)
 
             total_size = int(response.headers.get("content-length", 0))
-            downloaded_size = 0
+            if journal is not None:
+                total_size = journal.total_size
 
             self.active_downloads[job_id].update(
-                {"filename": filename, "total_bytes": total_size}
+                {
+                    "filename": os.path.basename(full_path),
+                    "file_path": full_path,
+                    "total_bytes": total_size,
+                }
             )
 
-            with open(full_path, "wb") as f:
-                start_time = time.time()
-                for chunk in response.iter_content(chunk_size=8192):
-                    if self.active_downloads[job_id]["status"] == "cancelled":
-                        break
+            if journal is None and self._supports_ranges(response, total_size):
+                # 同じファイルのジャーナルが残っていれば続きから取得する
+                journal = SegmentJournal.load(full_path)
+                if journal is None or not (
+                    journal.url == url
+                    and journal.total_size == total_size
+                    and journal.matches(
+                        response.headers.get("etag"),
+                        response.headers.get("last-modified"),
+                    )
+                ):
+                    journal = SegmentJournal(
+                        full_path,
+                        url,
+                        total_size,
+                        etag=response.headers.get("etag"),
+                        last_modified=response.headers.get("last-modified"),
+                        job_id=job_id,
+                    )
+                    journal.save()
+
+            if journal is not None:
+                # Range対応サーバーは複数接続で分割ダウンロード（一時停止・再開可能）
+                response.close()
+                self.active_downloads[job_id]["resumable"] = True
+                try:
+                    self._segmented_download(url, job_id, journal)
+                except RangeNotSupported:
+                    journal.delete()
+                    journal = None
+                    self.active_downloads[job_id]["resumable"] = False
+                    response = self.session.get(url, stream=True, timeout=30)
+                    response.raise_for_status()
+                    self._stream_download(response, full_path, job_id, total_size)
+            else:
+                self._stream_download(response, full_path, job_id, total_size)
 
-                    if chunk:
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
-
-                        # 進捗更新
-                        elapsed_time = time.time() - start_time
-                        speed = downloaded_size / max(elapsed_time, 1)
-                        progress = (
-                            downloaded_size / max(total_size, 1)
-                            if total_size > 0
-                            else 0
-                        )
-
-                        self.active_downloads[job_id].update(
-                            {
-                                "downloaded_bytes": downloaded_size,
-                                "progress": progress,
-                                "speed": speed,
-                            }
-                        )
+            status = self.active_downloads[job_id]["status"]
+            if status == "paused":
+                # 取得済み範囲を保存して再開を待つ
+                journal.save()
+                self.active_downloads[job_id]["speed"] = 0
+                return
+            if journal is not None:
+                journal.delete()
 
             # 完了処理
-            if self.active_downloads[job_id]["status"] != "cancelled":
+            if status != "cancelled":
                 download_info = self.active_downloads[job_id]
                 self.completed_downloads[job_id] = {
                     **download_info,
@@ -149,10 +255,86 @@ class HTTPDownloadPlugin(DownloadPlugin):
                 del self.active_downloads[job_id]
 
         except Exception as e:
+            if journal is not None:
+                # 次回の起動時に続きから再開できるよう記録を残す
+                journal.save()
             if job_id in self.active_downloads:
                 self.active_downloads[job_id]["status"] = "error"
                 self.active_downloads[job_id]["error"] = str(e)
 
+    def _supports_ranges(self, response, total_size: int) -> bool:
+        """Rangeリクエストで分割・再開できるかチェック"""
+        return (
+            total_size > 0
+            and response.headers.get("accept-ranges", "").lower() == "bytes"
+            and not response.headers.get("content-encoding")
+        )
+
+    def _segmented_download(self, url: str, job_id: str, journal: SegmentJournal):
+        """ジャーナルの未取得範囲を複数接続で分割ダウンロード"""
+        total_size = journal.total_size
+        meter = TransferMeter(
+            self.active_downloads[job_id],
+            total_size,
+            downloaded=journal.completed_bytes,
+            interval=self.progress_interval,
+        )
+
+        headers = {}
+        if journal.validator:
+            # 途中でファイルが変わった場合は206ではなく200が返る
+            headers["If-Range"] = journal.validator
+
+        connections = self.segments if total_size >= self.min_segment_size * 2 else 1
+
+        def should_stop():
+            return self.active_downloads[job_id]["status"] in ("cancelled", "paused")
+
+        throttle = self._throttle(job_id)
+        downloader = SegmentedDownloader(
+            url,
+            journal.file_path,
+            total_size,
+            connections=connections,
+            min_segment_size=self.min_segment_size,
+            chunk_size=self.chunk_size,
+            session=self.session,
+            headers=headers,
+            on_progress=meter.update,
+            on_written=lambda offset, length: journal.add_range(
+                offset, offset + length
+            ),
+            should_stop=should_stop,
+            throttle=lambda length: throttle.consume(length, should_stop),
+        )
+        try:
+            downloader.run(
+                [Segment(start, end) for start, end in journal.missing_ranges()]
+            )
+        finally:
+            throttle.close()
+            meter.flush(final=True)
+        journal.save()
+
+    def _stream_download(self, response, full_path: str, job_id: str, total_size: int):
+        """1本の接続で順番にダウンロード"""
+        info = self.active_downloads[job_id]
+        meter = TransferMeter(info, total_size, interval=self.progress_interval)
+
+        def cancelled():
+            return info["status"] == "cancelled"
+
+        with response, open(full_path, "wb") as f, self._throttle(job_id) as throttle:
+            try:
+                for chunk in iter_chunks(response, self.chunk_size):
+                    if cancelled():
+                        break
+                    f.write(chunk)
+                    meter.add(len(chunk))
+                    throttle.consume(len(chunk), cancelled)
+            finally:
+                meter.flush(final=True)
+
     def get_progress(self, job_id: str) -> dict:
         """進捗情報を取得"""
         if job_id in self.active_downloads:
@@ -163,16 +345,44 @@ class HTTPDownloadPlugin(DownloadPlugin):
             return {"error": "Job not found"}
 
     def pause(self, job_id: str) -> bool:
-        """一時停止（簡易実装では対応しない）"""
-        return False
+        """一時停止（Range対応サーバーからのダウンロードのみ）"""
+        info = self.active_downloads.get(job_id)
+        if not info or not info.get("resumable") or info["status"] != "downloading":
+            return False
+        info["status"] = "paused"
+        return True
 
     def resume(self, job_id: str) -> bool:
-        """再開（簡易実装では対応しない）"""
-        return False
+        """一時停止したダウンロードをジャーナルから再開"""
+        info = self.active_downloads.get(job_id)
+        if not info or info["status"] != "paused":
+            return False
+
+        # 一時停止したワーカーの終了を待つ
+        worker = self._workers.get(job_id)
+        if worker is not None:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                return False
+
+        journal = SegmentJournal.load(info.get("file_path", ""))
+        if journal is None:
+            return False
+
+        info["status"] = "downloading"
+        self._start_worker(job_id, (info["url"], info["output_path"], job_id, journal))
+        return True
 
     def cancel(self, job_id: str) -> bool:
         """キャンセル"""
         if job_id in self.active_downloads:
-            self.active_downloads[job_id]["status"] = "cancelled"
+            info = self.active_downloads[job_id]
+            if info["status"] == "paused" and info.get("file_path"):
+                # 停止中はワーカーがいないのでここでジャーナルを消す
+                journal = SegmentJournal.load(info["file_path"])
+                if journal is not None:
+                    journal.delete()
+            info["status"] = "cancelled"
+            self._unschedule(job_id)
             return True
         return False
@@ -0,0 +1,149 @@
+"""
+ダウンロードジャーナル
+取得済みのバイト範囲をサイドカーファイルに記録し、中断したダウンロードを再開できるようにする
+"""
+
+import json
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+JOURNAL_SUFFIX = ".arial"
+
+
+class SegmentJournal:
+    """取得済み範囲を記録するジャーナル（<ファイル名>.arial）"""
+
+    def __init__(
+        self,
+        file_path: str,
+        url: str,
+        total_size: int,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        job_id: Optional[str] = None,
+        save_interval: float = 1.0,
+    ):
+        self.file_path = file_path
+        self.path = file_path + JOURNAL_SUFFIX
+        self.url = url
+        self.total_size = total_size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.job_id = job_id
+        self.save_interval = save_interval
+
+        self._lock = threading.Lock()
+        self._ranges: List[List[int]] = []
+        self._last_save = 0.0
+
+    @classmethod
+    def load(cls, file_path: str) -> Optional["SegmentJournal"]:
+        """ジャーナルを読み込む（無い・壊れている場合はNone）"""
+        try:
+            with open(file_path + JOURNAL_SUFFIX, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            journal = cls(
+                file_path,
+                data["url"],
+                int(data["total_size"]),
+                etag=data.get("etag"),
+                last_modified=data.get("last_modified"),
+                job_id=data.get("job_id"),
+            )
+            journal._ranges = [[int(s), int(e)] for s, e in data.get("completed", [])]
+            return journal
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def matches(self, etag: Optional[str], last_modified: Optional[str]) -> bool:
+        """サーバー上のファイルが記録時から変わっていないか"""
+        if self.etag or etag:
+            # 弱いETagは範囲の一致を保証しないため再開に使わない
+            return bool(self.etag) and self.etag == etag and not etag.startswith("W/")
+        if self.last_modified or last_modified:
+            return self.last_modified == last_modified
+        return False
+
+    @property
+    def validator(self) -> Optional[str]:
+        """If-Range ヘッダーに使う値"""
+        return self.etag or self.last_modified
+
+    @property
+    def completed_bytes(self) -> int:
+        with self._lock:
+            return sum(end - start for start, end in self._ranges)
+
+    def add_range(self, start: int, end: int):
+        """取得済み範囲 [start, end) を追加（隣接・重複する範囲は統合）"""
+        with self._lock:
+            merged = []
+            for s, e in sorted(self._ranges + [[start, end]]):
+                if merged and s <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], e)
+                else:
+                    merged.append([s, e])
+            self._ranges = merged
+
+            if time.monotonic() - self._last_save >= self.save_interval:
+                self._save_locked()
+
+    def missing_ranges(self) -> List[Tuple[int, int]]:
+        """未取得の範囲 [start, end) の一覧"""
+        with self._lock:
+            missing = []
+            position = 0
+            for start, end in self._ranges:
+                if start > position:
+                    missing.append((position, start))
+                position = max(position, end)
+            if position < self.total_size:
+                missing.append((position, self.total_size))
+            return missing
+
+    def reset(self):
+        """記録をすべて破棄"""
+        with self._lock:
+            self._ranges = []
+            self._save_locked()
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        data = {
+            "url": self.url,
+            "job_id": self.job_id,
+            "total_size": self.total_size,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "completed": self._ranges,
+        }
+        # 途中で落ちても壊れないよう一時ファイル経由で置き換える
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+        self._last_save = time.monotonic()
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def find_journals(directory: str) -> List[str]:
+    """ディレクトリ内のジャーナルに対応するファイルパスの一覧"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return [
+        os.path.join(directory, name[: -len(JOURNAL_SUFFIX)])
+        for name in names
+        if name.endswith(JOURNAL_SUFFIX)
+    ]
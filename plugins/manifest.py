@@ -0,0 +1,131 @@
+"""
+プラグインの登録情報
+プラグインは名前・モジュール・対応ドメインなどの軽い情報だけで登録し、
+重いモジュール（yt_dlp など）は最初に対応するURLが来たときに読み込む
+"""
+
+import importlib
+import importlib.util
+import logging
+import threading
+from typing import NamedTuple, Optional, Tuple
+
+
+class PluginSpec(NamedTuple):
+    """プラグインの登録情報"""
+
+    name: str
+    module: str
+    class_name: str
+    description: str = ""
+    supported_domains: Tuple[str, ...] = ()
+    supported_schemes: Tuple[str, ...] = ()
+    # 読み込みに必要なモジュール（find_specで存在だけ確認し、インポートはしない）
+    requires: Tuple[str, ...] = ()
+    # Falseなら起動時に読み込む（中断したダウンロードの再開など起動時の処理があるもの）
+    lazy: bool = True
+
+
+# yt-dlpで扱う動画サイト（サブドメインを含む）
+VIDEO_SITE_DOMAINS = (
+    "youtube.com",
+    "youtu.be",
+    "nicovideo.jp",
+    "twitter.com",
+    "x.com",
+    "instagram.com",
+    "tiktok.com",
+    "bilibili.com",
+    "vimeo.com",
+    "twitch.tv",
+    "dailymotion.com",
+    "soundcloud.com",
+)
+
+PLUGIN_MANIFEST = [
+    PluginSpec(
+        name="HTTPDownloadPlugin",
+        module=".http_plugin",
+        class_name="HTTPDownloadPlugin",
+        description="HTTP/HTTPSダウンロードプラグイン",
+        supported_schemes=("http", "https"),
+        lazy=False,
+    ),
+    PluginSpec(
+        name="YouTubeDLPlugin",
+        module=".youtube_plugin",
+        class_name="YouTubeDLPlugin",
+        description="YouTube、ニコニコ動画などの動画サイト対応プラグイン",
+        supported_domains=VIDEO_SITE_DOMAINS,
+        requires=("yt_dlp",),
+    ),
+]
+
+
+def requirements_met(spec: PluginSpec) -> bool:
+    """必要なモジュールがインストールされているか（インポートせずに確認）"""
+    for name in spec.requires:
+        try:
+            if importlib.util.find_spec(name) is None:
+                return False
+        except (ImportError, ValueError):
+            return False
+    return True
+
+
+class LazyPlugin:
+    """最初に使われるまでモジュールを読み込まないプラグインの代理
+
+    URLRouter は supported_domains / supported_schemes だけで振り分け、
+    選ばれたときに resolve() で実際のプラグインを作成する。
+    """
+
+    def __init__(
+        self, spec: PluginSpec, session_pool=None, scheduler=None, limiter=None
+    ):
+        self.spec = spec
+        self.session_pool = session_pool
+        self.scheduler = scheduler
+        self.limiter = limiter
+        self.instance = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.spec.name
+
+    @property
+    def supported_domains(self) -> Tuple[str, ...]:
+        return self.spec.supported_domains
+
+    @property
+    def supported_schemes(self) -> Tuple[str, ...]:
+        return self.spec.supported_schemes
+
+    @property
+    def loaded(self) -> bool:
+        return self.instance is not None
+
+    def resolve(self) -> Optional[object]:
+        """プラグインを読み込んで返す（読み込めなければNone、失敗は記録して再試行しない）"""
+        if self.instance is not None or self.error is not None:
+            return self.instance
+        with self._lock:
+            if self.instance is None and self.error is None:
+                try:
+                    module = importlib.import_module(self.spec.module, __package__)
+                    plugin = getattr(module, self.spec.class_name)()
+                    plugin.session_pool = self.session_pool
+                    plugin.scheduler = self.scheduler
+                    plugin.limiter = self.limiter
+                    self.instance = plugin
+                    logging.info(f"{self.spec.name} loaded successfully")
+                except Exception as e:
+                    self.error = e
+                    logging.error(f"Failed to load {self.spec.name}: {e}")
+        return self.instance
+
+    def can_handle(self, url: str) -> bool:
+        plugin = self.resolve()
+        return plugin is not None and plugin.can_handle(url)
@@ -0,0 +1,108 @@
+"""
+転送の進捗
+受信ごとの集計は加算だけにし、ジョブ情報（active_downloads）への反映は一定間隔に間引く
+
+速度は転送開始からの平均ではなく、直近の転送量の指数移動平均（EWMA）で求める。
+"""
+
+import math
+import threading
+import time
+from typing import Iterator, Optional
+
+# 1回の読み込みの最大サイズ（バイト）
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# 進捗を反映する最短間隔（秒）
+DEFAULT_PROGRESS_INTERVAL = 0.25
+# 速度の移動平均の時定数（秒）
+DEFAULT_SPEED_WINDOW = 3.0
+
+
+def iter_chunks(response, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """レスポンス本文を最大 chunk_size ずつ返す
+
+    urllib3 の read1() が使える場合は届いている分だけを返すため、高速な回線では
+    大きな単位でまとめて読み、遅い回線でも chunk_size が揃うまで待たされない
+    （キャンセル・一時停止の確認が遅れない）。
+    """
+    raw = getattr(response, "raw", None)
+    read1 = getattr(raw, "read1", None)
+    if read1 is None:
+        yield from response.iter_content(chunk_size=chunk_size)
+        return
+    while True:
+        chunk = read1(chunk_size, decode_content=True)
+        if not chunk:
+            return
+        yield chunk
+
+
+class TransferMeter:
+    """転送量を数え、interval 秒ごとにジョブ情報へ進捗と速度を書き込む
+
+    add() / update() は複数のスレッドから呼んでもよい（反映は1スレッドずつ行う）。
+    """
+
+    def __init__(
+        self,
+        info: dict,
+        total_size: int,
+        downloaded: int = 0,
+        interval: Optional[float] = None,
+        window: Optional[float] = None,
+    ):
+        self.info = info
+        self.total_size = total_size
+        self.downloaded = downloaded
+        self.interval = DEFAULT_PROGRESS_INTERVAL if interval is None else interval
+        self.window = DEFAULT_SPEED_WINDOW if window is None else window
+        self.speed = 0.0
+        self._lock = threading.Lock()
+        self._last_time = time.monotonic()
+        self._last_bytes = downloaded
+        self._next = self._last_time + self.interval
+        self._sampled = False
+
+    def add(self, length: int):
+        """length バイトの受信を記録"""
+        self.downloaded += length
+        if time.monotonic() >= self._next:
+            self.flush()
+
+    def update(self, downloaded: int):
+        """受信済みの合計を記録（分割ダウンロードの集計値など）"""
+        self.downloaded = downloaded
+        if time.monotonic() >= self._next:
+            self.flush()
+
+    def flush(self, final: bool = False):
+        """速度を更新してジョブ情報へ反映（final なら間隔に関係なく反映）"""
+        if not self._lock.acquire(blocking=final):
+            return  # 他のスレッドが反映中
+        try:
+            now = time.monotonic()
+            elapsed = now - self._last_time
+            downloaded = self.downloaded
+            if elapsed > 0 and (elapsed >= self.interval or not final):
+                rate = (downloaded - self._last_bytes) / elapsed
+                if self._sampled:
+                    alpha = 1 - math.exp(-elapsed / self.window)
+                    self.speed += alpha * (rate - self.speed)
+                else:
+                    self.speed = rate
+                    self._sampled = True
+                self._last_time = now
+                self._last_bytes = downloaded
+            self._next = now + self.interval
+
+            self.info.update(
+                {
+                    "downloaded_bytes": downloaded,
+                    "progress": (
+                        downloaded / self.total_size if self.total_size > 0 else 0
+                    ),
+                    "speed": self.speed,
+                }
+            )
+        finally:
+            self._lock.release()
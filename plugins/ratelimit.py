@@ -0,0 +1,349 @@
+"""
+帯域制限
+全体の帯域（バイト/秒）をトークンバケットで配分し、プラグインの受信ループと aria2 の
+ジョブごとの上限（max-download-limit）に割り当てる
+
+配分は転送中のジョブ（プラグインの受信中の転送・aria2のアクティブなジョブ）がある
+優先度の間で比率（shares）に応じて分け、同じ優先度のジョブ同士は均等に分ける。
+全体の上限は時間帯ごとのスケジュールで切り替えられる。
+"""
+
+import bisect
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 優先度の名前とスケジューラーの priority（小さいほど先に実行）
+PRIORITIES = {"high": -1, "normal": 0, "low": 1}
+DEFAULT_PRIORITY = "normal"
+# 優先度ごとの配分比率
+DEFAULT_SHARES = {"high": 4, "normal": 2, "low": 1}
+# バケットに貯められる量（秒数分）と、待機中にキャンセルを確認する間隔（秒）
+BURST_SECONDS = 1.0
+MAX_WAIT_STEP = 0.1
+
+_RATE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_rate(value) -> int:
+    """帯域の指定（整数、または aria2 と同じ "512K" / "10M" 形式）をバイト/秒に変換（0は無制限）"""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid rate: {value!r}")
+    if isinstance(value, (int, float)):
+        rate = int(value)
+    else:
+        match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*", str(value), re.I)
+        if match is None:
+            raise ValueError(f"Invalid rate: {value!r}")
+        rate = int(float(match.group(1)) * _RATE_UNITS[match.group(2).upper()])
+    if rate < 0:
+        raise ValueError(f"Invalid rate: {value!r}")
+    return rate
+
+
+def parse_shares(spec) -> Dict[str, int]:
+    """配分比率（"high=4,normal=2,low=1" または dict）を解析（省略した優先度は既定値）"""
+    items = (
+        spec.items()
+        if isinstance(spec, dict)
+        else (item.partition("=")[::2] for item in spec.split(",") if item.strip())
+    )
+    shares = dict(DEFAULT_SHARES)
+    for name, weight in items:
+        name = str(name).strip()
+        if name not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {name}")
+        shares[name] = int(weight)
+        if shares[name] <= 0:
+            raise ValueError(f"Share must be positive: {name}")
+    return shares
+
+
+def parse_schedule(spec) -> List[Tuple[int, int]]:
+    """時間帯ごとの上限を解析して (0時からの分, バイト/秒) の昇順リストを返す
+
+    "01:00=0,08:00=10M"、{"08:00": "10M"}、または status() と同じ
+    [{"from": "08:00", "limit": ...}] の形で、各時刻からの上限を指定する
+    （最後の時刻の上限は翌日の最初の時刻まで続く）。
+    """
+    if isinstance(spec, dict):
+        items = spec.items()
+    elif isinstance(spec, list):
+        items = ((entry["from"], entry["limit"]) for entry in spec)
+    else:
+        items = (item.partition("=")[::2] for item in spec.split(",") if item.strip())
+    schedule = {}
+    for start, rate in items:
+        match = re.fullmatch(r"\s*(\d{1,2}):(\d{2})\s*", str(start))
+        if match is None or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+            raise ValueError(f"Invalid schedule time: {start!r}")
+        schedule[int(match.group(1)) * 60 + int(match.group(2))] = parse_rate(rate)
+    return sorted(schedule.items())
+
+
+class TokenBucket:
+    """トークンバケット（rate が0なら制限しない）
+
+    消費は先に引いて不足分（負債）を待つ方式のため、1回の消費量がバケットより大きくても
+    平均の速度は rate に収まり、同時に待つ転送は順番に進む。
+    """
+
+    def __init__(self, rate: int = 0, burst: Optional[int] = None):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self._tokens = self._capacity()
+        self._updated = time.monotonic()
+
+    def _capacity(self) -> float:
+        return self.burst if self.burst is not None else self.rate * BURST_SECONDS
+
+    def _refill_locked(self, now: float):
+        self._tokens = min(
+            self._capacity(), self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def set_rate(self, rate: int):
+        """速度を変更（それまでの分は元の速度で貯める）"""
+        with self._lock:
+            self._refill_locked(time.monotonic())
+            unlimited = self.rate <= 0
+            self.rate = rate
+            # 制限なしから切り替えた場合は満杯から始める
+            self._tokens = (
+                self._capacity() if unlimited else min(self._tokens, self._capacity())
+            )
+
+    def consume(
+        self, amount: int, should_stop: Optional[Callable[[], bool]] = None
+    ) -> bool:
+        """amount バイト分を消費し、速度を超えていれば待つ（待機中に止められたらFalse）"""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            if self.rate <= 0:
+                return True
+            self._refill_locked(time.monotonic())
+            self._tokens -= amount
+            deficit = -self._tokens
+
+        # 待っている間に速度が変わっても、その時点の速度で残りを待つ
+        while deficit > 0:
+            if should_stop is not None and should_stop():
+                return False
+            rate = self.rate
+            if rate <= 0:
+                return True
+            step = min(deficit / rate, MAX_WAIT_STEP)
+            time.sleep(step)
+            deficit -= step * rate
+        return True
+
+
+class Throttle:
+    """1つの転送の帯域（BandwidthLimiter.throttle() で作成し、終了時に close する）"""
+
+    def __init__(self, limiter: "BandwidthLimiter", priority: str):
+        self.limiter = limiter
+        self.priority = priority
+        self.bucket = limiter._buckets[priority]
+        self.closed = False
+
+    def consume(
+        self, amount: int, should_stop: Optional[Callable[[], bool]] = None
+    ) -> bool:
+        """受信した amount バイトを記録し、割り当てを超えていれば待つ"""
+        return self.bucket.consume(amount, should_stop)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.limiter._release(self.priority)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BandwidthLimiter:
+    """全体の帯域を優先度ごとの比率で転送中のジョブに配分する
+
+    プラグインの転送は優先度ごとのトークンバケットで制限し、aria2 のジョブには
+    aria2_limits() が返すジョブごとの上限を設定する（監視ループが反映する）。
+    """
+
+    def __init__(
+        self,
+        rate: int = 0,
+        shares: Optional[Dict[str, int]] = None,
+        schedule: Optional[List[Tuple[int, int]]] = None,
+        clock: Callable[[], time.struct_time] = time.localtime,
+    ):
+        self.rate = rate
+        self.shares = dict(shares or DEFAULT_SHARES)
+        self.schedule = list(schedule or [])
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._buckets = {name: TokenBucket() for name in PRIORITIES}
+        self._transfers = dict.fromkeys(PRIORITIES, 0)
+        self._aria2: Dict[str, str] = {}
+        self._effective = self._scheduled_rate()
+        self._rebalance_locked()
+
+    @classmethod
+    def from_env(cls) -> "BandwidthLimiter":
+        """環境変数から設定を読み込んで作成"""
+        return cls(
+            rate=parse_rate(os.getenv("BANDWIDTH_LIMIT", "0")),
+            shares=parse_shares(os.getenv("BANDWIDTH_SHARES", "")),
+            schedule=parse_schedule(os.getenv("BANDWIDTH_SCHEDULE", "")),
+        )
+
+    @property
+    def effective_rate(self) -> int:
+        """現在の全体の上限（0は無制限）"""
+        return self._effective
+
+    def _scheduled_rate(self) -> int:
+        if not self.schedule:
+            return self.rate
+        now = self.clock()
+        minute = now.tm_hour * 60 + now.tm_min
+        index = bisect.bisect_right([start for start, _ in self.schedule], minute)
+        # 最初の時刻より前は前日の最後の時間帯
+        return self.schedule[index - 1][1]
+
+    def configure(
+        self,
+        rate: Optional[int] = None,
+        shares: Optional[Dict[str, int]] = None,
+        schedule: Optional[List[Tuple[int, int]]] = None,
+    ):
+        """設定を変更してすぐに配分し直す（None の項目は変更しない）"""
+        with self._lock:
+            if rate is not None:
+                self.rate = rate
+            if shares is not None:
+                self.shares = dict(shares)
+            if schedule is not None:
+                self.schedule = list(schedule)
+            self._effective = self._scheduled_rate()
+            self._rebalance_locked()
+
+    def refresh(self) -> bool:
+        """スケジュールの時間帯が変わっていれば配分し直す（変わればTrue）"""
+        rate = self._scheduled_rate()
+        if rate == self._effective:
+            return False
+        with self._lock:
+            self._effective = rate
+            self._rebalance_locked()
+        return True
+
+    def throttle(self, priority: Optional[str] = None) -> Throttle:
+        """転送の開始を登録し、その転送用の Throttle を返す"""
+        priority = priority if priority in PRIORITIES else DEFAULT_PRIORITY
+        with self._lock:
+            self._transfers[priority] += 1
+            self._rebalance_locked()
+        return Throttle(self, priority)
+
+    def _release(self, priority: str):
+        with self._lock:
+            self._transfers[priority] -= 1
+            self._rebalance_locked()
+
+    def set_aria2_jobs(self, jobs: Dict[str, str]):
+        """転送中の aria2 のジョブ（GID → 優先度）を登録して配分し直す"""
+        jobs = {
+            gid: priority if priority in PRIORITIES else DEFAULT_PRIORITY
+            for gid, priority in jobs.items()
+        }
+        with self._lock:
+            if jobs != self._aria2:
+                self._aria2 = jobs
+                self._rebalance_locked()
+
+    def _counts_locked(self) -> Dict[str, int]:
+        counts = dict(self._transfers)
+        for priority in self._aria2.values():
+            counts[priority] += 1
+        return counts
+
+    def _allocate(self, counts: Dict[str, int]) -> Dict[str, int]:
+        """優先度ごとの1ジョブあたりの上限（0は無制限）"""
+        if self._effective <= 0:
+            return dict.fromkeys(PRIORITIES, 0)
+        weight = sum(self.shares[name] for name, count in counts.items() if count)
+        return {
+            name: (
+                max(1, int(self._effective * self.shares[name] / weight / count))
+                if count
+                else 0
+            )
+            for name, count in counts.items()
+        }
+
+    def _rebalance_locked(self):
+        counts = self._counts_locked()
+        per_job = self._allocate(counts)
+        for name, bucket in self._buckets.items():
+            rate = per_job[name] * self._transfers[name]
+            if bucket.rate != rate:
+                bucket.set_rate(rate)
+
+    def new_job_rate(self, priority: str = DEFAULT_PRIORITY) -> int:
+        """priority のジョブが1つ増えた場合の、そのジョブの上限（0は無制限）"""
+        with self._lock:
+            counts = self._counts_locked()
+            counts[priority] += 1
+            return self._allocate(counts)[priority]
+
+    def aria2_limits(self) -> Dict[str, int]:
+        """登録された aria2 のジョブごとの上限（GID → バイト/秒、0は無制限）"""
+        with self._lock:
+            per_job = self._allocate(self._counts_locked())
+            return {gid: per_job[priority] for gid, priority in self._aria2.items()}
+
+    def status(self) -> dict:
+        """現在の設定と配分（/api/bandwidth）"""
+        with self._lock:
+            counts = self._counts_locked()
+            per_job = self._allocate(counts)
+            return {
+                "limit": self.rate,
+                "effective_limit": self._effective,
+                "shares": dict(self.shares),
+                "schedule": [
+                    {"from": f"{start // 60:02d}:{start % 60:02d}", "limit": rate}
+                    for start, rate in self.schedule
+                ],
+                "priorities": {
+                    name: {
+                        "plugin_transfers": self._transfers[name],
+                        "aria2_jobs": counts[name] - self._transfers[name],
+                        "per_job_limit": per_job[name],
+                    }
+                    for name in PRIORITIES
+                },
+            }
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def get_default_limiter() -> BandwidthLimiter:
+    """プロセス共通の帯域制限を取得"""
+    global _default_limiter
+    if _default_limiter is None:
+        with _default_limiter_lock:
+            if _default_limiter is None:
+                _default_limiter = BandwidthLimiter.from_env()
+    return _default_limiter
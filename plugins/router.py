@@ -0,0 +1,185 @@
+"""
+URLルーター
+ドメインの索引で安価にプラグインを選び、ネットワークを使う判定はバックグラウンドで行ってキャッシュする
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+from urllib.parse import urlsplit
+
+_MISSING = object()
+
+
+def _resolve(plugin):
+    """遅延読み込みのプラグイン（LazyPlugin）なら実体を返す"""
+    resolve = getattr(plugin, "resolve", None)
+    return resolve() if resolve is not None else plugin
+
+
+class TTLCache:
+    """有効期限付きのLRUキャッシュ"""
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def items(self) -> list:
+        """期限内のエントリ一覧"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value)
+                for key, (value, expires) in self._items.items()
+                if expires >= now
+            ]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class HostIndex:
+    """ドメイン名の索引（ラベルを逆順にしたトライ木）
+
+    "youtube.com" を登録すると "www.youtube.com" や "m.youtube.com" にも一致する。
+    """
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, domain: str, value):
+        node = self._root
+        for label in reversed(domain.lower().strip(".").split(".")):
+            node = node.setdefault(label, {})
+        node[None] = value
+
+    def lookup(self, host: str):
+        """最も長く一致したドメインの値を返す"""
+        node = self._root
+        found = None
+        for label in reversed(host.lower().strip(".").split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
+
+
+class URLRouter:
+    """URLに適したプラグインを選ぶ
+
+    supported_domains を持つプラグインはホスト名の索引だけで判定する。
+    LazyPlugin は選ばれたときに初めてモジュールを読み込む（読み込めなければ他のプラグインへ）。
+    それ以外のプラグインは can_handle（HEADリクエストなど）をバックグラウンドで実行し、
+    probe_timeout 以内に終わらなければ対応スキームの最初のプラグインを仮に選ぶ。
+    判定結果はURLごとにキャッシュする。
+    """
+
+    def __init__(
+        self,
+        plugins: list,
+        probe_timeout: float = 0.25,
+        cache_ttl: float = 300.0,
+        cache_size: int = 4096,
+        max_workers: int = 8,
+    ):
+        self.probe_timeout = probe_timeout
+        self.index = HostIndex()
+        self.generic_plugins = []
+        for plugin in plugins:
+            domains = getattr(plugin, "supported_domains", None)
+            if domains:
+                for domain in domains:
+                    self.index.add(domain, plugin)
+            else:
+                self.generic_plugins.append(plugin)
+
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="url-probe"
+        )
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def route(self, url: str):
+        """URLに適したプラグインを返す（無ければNone）"""
+        try:
+            parts = urlsplit(url)
+        except ValueError:
+            return None
+
+        if parts.hostname:
+            plugin = self.index.lookup(parts.hostname)
+            if plugin is not None:
+                plugin = _resolve(plugin)
+                if plugin is not None:
+                    return plugin
+
+        candidates = [
+            plugin
+            for plugin in self.generic_plugins
+            if parts.scheme in getattr(plugin, "supported_schemes", (parts.scheme,))
+        ]
+        if not candidates:
+            return None
+
+        cached = self.cache.get(url, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+        future = self._probe(url, candidates)
+        try:
+            return future.result(timeout=self.probe_timeout)
+        except FutureTimeoutError:
+            # 応答の遅いサーバーを待たずに仮の判定を返す（結果は後でキャッシュされる）
+            return _resolve(candidates[0])
+
+    def _probe(self, url: str, candidates: list):
+        """can_handle をバックグラウンドで実行（同じURLの判定は1回にまとめる）"""
+        with self._lock:
+            future = self._inflight.get(url)
+            if future is None:
+                future = self._executor.submit(self._run_probe, url, candidates)
+                self._inflight[url] = future
+            return future
+
+    def _run_probe(self, url: str, candidates: list) -> Optional[object]:
+        try:
+            result = None
+            for plugin in candidates:
+                plugin = _resolve(plugin)
+                if plugin is not None and plugin.can_handle(url):
+                    result = plugin
+                    break
+            self.cache.set(url, result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,239 @@
+"""
+ダウンロードスケジューラー
+プラグインのダウンロードを上限付きのワーカープールで実行する（優先度付きキュー・プラグイン/ホストごとの同時実行数制限）
+"""
+
+import bisect
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+class ScheduledTask:
+    """キューに登録されたダウンロード（スレッドと同じく join / is_alive で待てる）"""
+
+    def __init__(
+        self,
+        job_id: str,
+        target: Callable,
+        args: tuple,
+        plugin: Optional[str],
+        host: Optional[str],
+        priority: int,
+        seq: int,
+    ):
+        self.job_id = job_id
+        self.target = target
+        self.args = args
+        self.plugin = plugin
+        self.host = host
+        self.priority = priority
+        self.seq = seq
+        self.started = False
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self._done = threading.Event()
+
+    def __lt__(self, other: "ScheduledTask") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def join(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    def is_alive(self) -> bool:
+        return not self._done.is_set()
+
+    @property
+    def wait_time(self) -> Optional[float]:
+        """キューで待った秒数（開始前はNone）"""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+
+class DownloadScheduler:
+    """上限付きワーカープール
+
+    priority の小さい順、同じ優先度では登録順に実行する。
+    プラグイン・ホストごとの上限に達しているタスクは飛ばして次を実行する。
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        per_host: int = 4,
+        per_plugin: Dict[str, int] = None,
+    ):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.per_plugin = dict(per_plugin or {})
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._tasks = {}
+        self._running_hosts = {}
+        self._running_plugins = {}
+        self._running = 0
+        self._seq = itertools.count()
+        self._threads = []
+        self._closed = False
+        # タスクの開始時に呼ばれるフック（on_start(task)、メトリクスの記録など）
+        self.on_start: Optional[Callable[[ScheduledTask], None]] = None
+
+    @classmethod
+    def from_env(cls) -> "DownloadScheduler":
+        """環境変数から設定を読み込んで作成"""
+        per_plugin = {}
+        for item in os.getenv("DOWNLOAD_PER_PLUGIN", "").split(","):
+            name, _, limit = item.partition("=")
+            if name.strip() and limit.strip():
+                per_plugin[name.strip()] = int(limit)
+        return cls(
+            max_workers=int(os.getenv("DOWNLOAD_WORKERS", "8")),
+            per_host=int(os.getenv("DOWNLOAD_PER_HOST", "4")),
+            per_plugin=per_plugin,
+        )
+
+    def submit(
+        self,
+        job_id: str,
+        target: Callable,
+        args: tuple = (),
+        plugin: str = None,
+        host: str = None,
+        priority: int = 0,
+    ) -> ScheduledTask:
+        """タスクをキューに登録"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("scheduler is shut down")
+            task = ScheduledTask(
+                job_id, target, args, plugin, host, priority, next(self._seq)
+            )
+            bisect.insort(self._pending, task)
+            self._tasks[job_id] = task
+            if len(self._threads) < self.max_workers:
+                self._start_thread()
+            self._cond.notify()
+            return task
+
+    def cancel(self, job_id: str) -> bool:
+        """まだ開始していないタスクをキューから取り除く"""
+        with self._cond:
+            task = self._tasks.get(job_id)
+            if task is None or task.started:
+                return False
+            self._pending.remove(task)
+            del self._tasks[job_id]
+            task._done.set()
+            return True
+
+    def is_queued(self, job_id: str) -> bool:
+        with self._cond:
+            task = self._tasks.get(job_id)
+            return task is not None and not task.started
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": len(self._pending),
+                "running": self._running,
+                "workers": self.max_workers,
+            }
+
+    def shutdown(self):
+        """キューを破棄してワーカーを終了（実行中のタスクは最後まで走る）"""
+        with self._cond:
+            self._closed = True
+            for task in self._pending:
+                task._done.set()
+            self._pending.clear()
+            self._cond.notify_all()
+
+    def _start_thread(self):
+        thread = threading.Thread(
+            target=self._worker,
+            name=f"download-worker-{len(self._threads)}",
+            daemon=True,
+        )
+        self._threads.append(thread)
+        thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                task = self._take_locked()
+                while task is None:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    task = self._take_locked()
+
+            if self.on_start is not None:
+                try:
+                    self.on_start(task)
+                except Exception as e:
+                    logging.error(f"Scheduler start hook failed: {e}")
+            try:
+                task.target(*task.args)
+            except Exception as e:
+                logging.error(f"Download task {task.job_id} failed: {e}")
+            finally:
+                with self._cond:
+                    self._release_locked(task)
+                    self._cond.notify_all()
+                task._done.set()
+
+    def _take_locked(self) -> Optional[ScheduledTask]:
+        """上限に掛からない最初のタスクを取り出す"""
+        for index, task in enumerate(self._pending):
+            if task.host and self._running_hosts.get(task.host, 0) >= self.per_host:
+                continue
+            limit = self.per_plugin.get(task.plugin)
+            if limit is not None and self._running_plugins.get(task.plugin, 0) >= limit:
+                continue
+
+            del self._pending[index]
+            task.started = True
+            task.started_at = time.monotonic()
+            self._running += 1
+            if task.host:
+                self._running_hosts[task.host] = (
+                    self._running_hosts.get(task.host, 0) + 1
+                )
+            if task.plugin:
+                self._running_plugins[task.plugin] = (
+                    self._running_plugins.get(task.plugin, 0) + 1
+                )
+            return task
+        return None
+
+    def _release_locked(self, task: ScheduledTask):
+        self._running -= 1
+        for counts, key in (
+            (self._running_hosts, task.host),
+            (self._running_plugins, task.plugin),
+        ):
+            if key:
+                counts[key] -= 1
+                if not counts[key]:
+                    del counts[key]
+        if self._tasks.get(task.job_id) is task:
+            del self._tasks[task.job_id]
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_default_scheduler() -> DownloadScheduler:
+    """プロセス共通のスケジューラーを取得"""
+    global _default_scheduler
+    if _default_scheduler is None:
+        with _default_scheduler_lock:
+            if _default_scheduler is None:
+                _default_scheduler = DownloadScheduler.from_env()
+    return _default_scheduler
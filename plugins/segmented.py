@@ -0,0 +1,231 @@
+"""
+分割ダウンロードエンジン
+Rangeリクエストで複数接続から並列にダウンロードし、事前確保したファイルへ位置指定で書き込む
+"""
+
+import os
+import threading
+from typing import Callable, List, Optional
+
+import requests
+
+from .progress import DEFAULT_CHUNK_SIZE, iter_chunks
+
+
+class RangeNotSupported(Exception):
+    """サーバーがRangeリクエストに対応していない"""
+
+
+class Segment:
+    """ダウンロード範囲 [start, end) と現在位置"""
+
+    __slots__ = ("start", "end", "position")
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.position = start
+
+    @property
+    def remaining(self) -> int:
+        return max(self.end - self.position, 0)
+
+
+class PositionalWriter:
+    """ファイルの任意位置へ書き込む（pwriteが無い環境ではロックしてseek）"""
+
+    def __init__(self, path: str, size: int):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        self._lock = None if hasattr(os, "pwrite") else threading.Lock()
+        self._preallocate(size)
+
+    def _preallocate(self, size: int):
+        if os.fstat(self.fd).st_size >= size:
+            return
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self.fd, 0, size)
+                return
+            except OSError:
+                pass
+        os.ftruncate(self.fd, size)
+
+    def write(self, data, offset: int):
+        if self._lock is None:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            with self._lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                os.write(self.fd, data)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SegmentedDownloader:
+    """複数接続による分割ダウンロード
+
+    各ワーカーは担当範囲を取得し終えると、残りが最も大きい範囲の後半を
+    引き取る（ワークスティーリング）ため、遅い接続に処理が偏らない。
+    """
+
+    def __init__(
+        self,
+        url: str,
+        path: str,
+        total_size: int,
+        connections: int = 4,
+        min_segment_size: int = 1024 * 1024,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        session=None,
+        headers: Optional[dict] = None,
+        timeout: float = 30,
+        on_progress: Optional[Callable[[int], None]] = None,
+        on_written: Optional[Callable[[int, int], None]] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        throttle: Optional[Callable[[int], bool]] = None,
+    ):
+        self.url = url
+        self.path = path
+        self.total_size = total_size
+        self.connections = max(1, connections)
+        self.min_segment_size = max(1, min_segment_size)
+        self.chunk_size = chunk_size
+        self.session = session or requests
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.on_progress = on_progress
+        self.on_written = on_written
+        self.should_stop = should_stop or (lambda: False)
+        # 受信量を渡すと帯域の上限まで待つ関数（待機中に止められたらFalseを返す）
+        self.throttle = throttle
+
+        self._lock = threading.Lock()
+        self.segments: List[Segment] = []
+        self._unassigned: List[Segment] = []
+        self.downloaded = 0
+        self._error = None
+
+    def split(self) -> List[Segment]:
+        """ファイルを接続数に応じた範囲に分割"""
+        count = min(self.connections, max(1, self.total_size // self.min_segment_size))
+        size = -(-self.total_size // count)  # 切り上げ
+        return [
+            Segment(start, min(start + size, self.total_size))
+            for start in range(0, self.total_size, size)
+        ]
+
+    def run(self, segments: Optional[List[Segment]] = None) -> int:
+        """ダウンロードを実行し、取得済みのバイト数を返す
+
+        segments を渡すと、その範囲（再開時の未取得範囲など）だけを取得する。
+        """
+        self.segments = list(segments) if segments is not None else self.split()
+        self.downloaded = self.total_size - sum(s.remaining for s in self.segments)
+
+        writer = PositionalWriter(self.path, self.total_size)
+        try:
+            # 接続数を超える範囲は空いたワーカーが順に引き受ける
+            pending = [s for s in self.segments if s.remaining > 0]
+            initial = pending[: self.connections]
+            self._unassigned = pending[self.connections :]
+            initial += [None] * (self.connections - len(initial))
+            if not pending:
+                initial = []
+            threads = [
+                threading.Thread(
+                    target=self._worker, args=(writer, segment), daemon=True
+                )
+                for segment in initial
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            writer.close()
+
+        if self._error is not None:
+            raise self._error
+        return self.downloaded
+
+    def _worker(self, writer: PositionalWriter, segment: Optional[Segment]):
+        try:
+            if segment is None:
+                segment = self._next_segment()
+            while segment is not None and not self._error:
+                self._fetch(writer, segment)
+                if self.should_stop():
+                    return
+                segment = self._next_segment()
+        except Exception as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+
+    def _next_segment(self) -> Optional[Segment]:
+        """未割り当ての範囲、無ければ他のワーカーの範囲の一部を引き取る"""
+        with self._lock:
+            if self._unassigned:
+                return self._unassigned.pop(0)
+        return self._steal()
+
+    def _steal(self) -> Optional[Segment]:
+        """残りが最も大きい範囲の後半を新しい範囲として引き取る"""
+        with self._lock:
+            candidates = [s for s in self.segments if s.remaining > 0]
+            if not candidates:
+                return None
+            victim = max(candidates, key=lambda s: s.remaining)
+            if victim.remaining < self.min_segment_size * 2:
+                return None
+            middle = victim.position + victim.remaining // 2
+            stolen = Segment(middle, victim.end)
+            victim.end = middle
+            self.segments.append(stolen)
+            return stolen
+
+    def _fetch(self, writer: PositionalWriter, segment: Segment):
+        """1つの範囲をダウンロード"""
+        if segment.remaining <= 0:
+            return
+
+        headers = dict(self.headers)
+        headers["Range"] = f"bytes={segment.position}-{segment.end - 1}"
+        with self.session.get(
+            self.url, headers=headers, stream=True, timeout=self.timeout
+        ) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise RangeNotSupported(self.url)
+
+            for chunk in iter_chunks(response, self.chunk_size):
+                if self.should_stop() or self._error:
+                    return
+                if not chunk:
+                    continue
+
+                with self._lock:
+                    # 他のワーカーに後半を引き取られた場合は範囲内だけ書く
+                    offset = segment.position
+                    length = min(len(chunk), segment.end - offset)
+                    if length <= 0:
+                        return
+                    segment.position += length
+                    self.downloaded += length
+                    downloaded = self.downloaded
+
+                writer.write(chunk[:length] if length < len(chunk) else chunk, offset)
+                if self.on_written:
+                    self.on_written(offset, length)
+                if self.on_progress:
+                    self.on_progress(downloaded)
+                if self.throttle is not None and not self.throttle(length):
+                    return
+
+                if segment.remaining <= 0:
+                    return
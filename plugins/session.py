@@ -0,0 +1,169 @@
+"""
+HTTP接続プール
+全プラグインで共有するキープアライブ付きのセッション（リトライ・ホストごとの接続数制限付き）
+"""
+
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+
+class HTTP2Response:
+    """httpxのレスポンスをrequests互換で扱うためのラッパー"""
+
+    def __init__(self, response):
+        self._response = response
+        self.headers = response.headers
+        self.status_code = response.status_code
+        self.url = str(response.url)
+
+    def raise_for_status(self):
+        self._response.raise_for_status()
+
+    def iter_content(self, chunk_size: int = 8192):
+        return self._response.iter_bytes(chunk_size)
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class HTTP2Session:
+    """httpx（HTTP/2）を使うrequests互換の最小セッション"""
+
+    def __init__(self, max_connections: int, per_host: int, retries: int):
+        # HTTP/2では1接続で多重化するため、ホストあたりの接続数は少なくて済む
+        limits = httpx.Limits(
+            max_connections=max_connections * per_host,
+            max_keepalive_connections=max_connections,
+        )
+        self._client = httpx.Client(
+            transport=httpx.HTTPTransport(http2=True, retries=retries, limits=limits)
+        )
+
+    def request(self, method: str, url: str, **kwargs) -> HTTP2Response:
+        request = self._client.build_request(
+            method, url, headers=kwargs.get("headers"), timeout=kwargs.get("timeout")
+        )
+        response = self._client.send(
+            request,
+            stream=True,
+            follow_redirects=kwargs.get("allow_redirects", method != "HEAD"),
+        )
+        if not kwargs.get("stream"):
+            response.read()
+        return HTTP2Response(response)
+
+    def get(self, url: str, **kwargs) -> HTTP2Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> HTTP2Response:
+        return self.request("HEAD", url, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+
+class SessionPool:
+    """プラグイン共有のHTTPセッション
+
+    ホストごとのコネクションプールを持ち、接続数が上限に達した場合は
+    空くまで待つ（pool_block）。冪等なリクエストは指数バックオフでリトライする。
+    """
+
+    def __init__(
+        self,
+        max_hosts: int = 32,
+        per_host: int = 16,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        http2: bool = False,
+    ):
+        self.max_hosts = max_hosts
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.http2 = http2 and HTTPX_AVAILABLE
+        if http2 and not HTTPX_AVAILABLE:
+            logging.warning("httpx not available, HTTP/2 disabled")
+
+        self._lock = threading.Lock()
+        self._session = None
+
+    @classmethod
+    def from_env(cls) -> "SessionPool":
+        """環境変数から設定を読み込んで作成"""
+        return cls(
+            max_hosts=int(os.getenv("HTTP_POOL_HOSTS", "32")),
+            per_host=int(os.getenv("HTTP_POOL_PER_HOST", "16")),
+            retries=int(os.getenv("HTTP_RETRIES", "3")),
+            backoff_factor=float(os.getenv("HTTP_RETRY_BACKOFF", "0.5")),
+            http2=os.getenv("HTTP2_ENABLED", "false").lower() == "true",
+        )
+
+    @property
+    def session(self):
+        """共有セッション（初回アクセス時に作成）"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        if self.http2:
+            return HTTP2Session(self.max_hosts, self.per_host, self.retries)
+
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["HEAD", "GET", "OPTIONS"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.max_hosts,
+            pool_maxsize=self.per_host,
+            pool_block=True,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> SessionPool:
+    """プロセス共通の接続プールを取得"""
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = SessionPool.from_env()
+    return _default_pool
@@ -5,9 +5,11 @@ YouTube、ニコニコ動画、SNSなどの動画サイト対応
 
 import os
 import uuid
-import threading
 from datetime import datetime
+
 from .base import DownloadPlugin
+from .manifest import VIDEO_SITE_DOMAINS
+from .ratelimit import DEFAULT_PRIORITY
 
 try:
     import yt_dlp
@@ -20,33 +22,24 @@ except ImportError:
 class YouTubeDLPlugin(DownloadPlugin):
     """YouTube、ニコニコ動画などの動画サイト対応プラグイン"""
 
+    # URLルーターはこのドメイン一覧（サブドメインを含む）で振り分ける
+    supported_domains = VIDEO_SITE_DOMAINS
+
     def __init__(self):
         if not YT_DLP_AVAILABLE:
             raise ImportError("yt-dlp is required for YouTubeDLPlugin")
 
         self.active_downloads = {}
         self.completed_downloads = {}
+        # 実行中のジョブの帯域の割り当て（進捗フックで受信量を渡して速度を抑える）
+        self._throttles = {}
 
     def can_handle(self, url: str) -> bool:
         """YouTube、ニコニコ動画、Twitter、Instagramなどの対応サイトをチェック"""
         if not YT_DLP_AVAILABLE:
             return False
 
-        supported_sites = [
-            "youtube.com",
-            "youtu.be",
-            "nicovideo.jp",
-            "twitter.com",
-            "x.com",
-            "instagram.com",
-            "tiktok.com",
-            "bilibili.com",
-            "vimeo.com",
-            "twitch.tv",
-            "dailymotion.com",
-            "soundcloud.com",
-        ]
-        return any(site in url.lower() for site in supported_sites)
+        return any(site in url.lower() for site in self.supported_domains)
 
     def get_info(self, url: str) -> dict:
         """動画情報を取得"""
@@ -71,7 +64,9 @@ class YouTubeDLPlugin(DownloadPlugin):
         except Exception as e:
             return {"error": str(e)}
 
-    def download(self, url: str, output_path: str = None) -> str:
+    def download(
+        self, url: str, output_path: str = None, priority: str = DEFAULT_PRIORITY
+    ) -> str:
         """ダウンロードを開始"""
         if not YT_DLP_AVAILABLE:
             raise Exception("yt-dlp not available")
@@ -99,23 +94,24 @@ class YouTubeDLPlugin(DownloadPlugin):
             "speed": 0,
             "eta": 0,
             "filename": "",
+            "priority": priority,
             "created_at": datetime.now().isoformat(),
         }
 
-        # 別スレッドでダウンロード実行
-        thread = threading.Thread(
-            target=self._download_worker, args=(url, ydl_opts, job_id)
-        )
-        thread.daemon = True
-        thread.start()
+        # スケジューラーの空きを待ってダウンロード実行
+        self._schedule(job_id, url, self._download_worker, (url, ydl_opts, job_id))
 
         return job_id
 
     def _download_worker(self, url: str, ydl_opts: dict, job_id: str):
         """ダウンロードワーカー"""
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
+            with self._throttle(job_id) as throttle, yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                self._throttles[job_id] = throttle
+                try:
+                    ydl.download([url])
+                finally:
+                    self._throttles.pop(job_id, None)
 
             # 完了処理
             if job_id in self.active_downloads:
@@ -141,6 +137,15 @@ class YouTubeDLPlugin(DownloadPlugin):
         download_info = self.active_downloads[job_id]
 
         if d["status"] == "downloading":
+            throttle = self._throttles.get(job_id)
+            if throttle is not None:
+                # downloaded_bytes はファイル（映像・音声）ごとに0から数え直される
+                downloaded = d.get("downloaded_bytes") or 0
+                received = downloaded - (download_info.get("downloaded_bytes") or 0)
+                throttle.consume(
+                    received if received >= 0 else downloaded,
+                    lambda: download_info["status"] == "cancelled",
+                )
             download_info.update(
                 {
                     "downloaded_bytes": d.get("downloaded_bytes", 0),
@@ -182,5 +187,6 @@ class YouTubeDLPlugin(DownloadPlugin):
         """キャンセル"""
         if job_id in self.active_downloads:
             self.active_downloads[job_id]["status"] = "cancelled"
+            self._unschedule(job_id)
             return True
         return False
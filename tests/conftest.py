@@ -2,14 +2,29 @@
 pytest 設定とフィクスチャ
 """
 
-import pytest
-import tempfile
 import os
+import tempfile
 from unittest.mock import Mock, patch
 
+import pytest
+
+# main をインポートする前に、ジョブストアとダウンロード先をリポジトリの外に向ける
+os.environ["JOB_STORE"] = "memory"
+os.environ.setdefault("DOWNLOAD_DIR", tempfile.mkdtemp())
+
 
 @pytest.fixture
-def app():
+def job_store():
+    """メモリ上のジョブストアを開いた main モジュール"""
+    import main
+
+    if main.job_store is None:
+        main.open_job_store()
+    return main
+
+
+@pytest.fixture
+def app(job_store):
     """Flaskアプリケーションのテスト用フィクスチャ"""
     # テスト用の環境変数設定
     os.environ["FLASK_ENV"] = "testing"
@@ -34,12 +49,17 @@ def temp_download_dir():
 
 
 @pytest.fixture
-def mock_aria2():
-    """aria2 API のモック"""
-    with patch("main.aria2_api") as mock_api:
-        mock_api.add_uris.return_value = Mock(gid="test_gid_123")
-        mock_api.get_downloads.return_value = []
-        yield mock_api
+def mock_aria2(job_store):
+    """aria2 バックエンドのモック"""
+    from core import BackendPool
+
+    backend = Mock()
+    backend.name = "aria0"
+    backend.monitor = None
+    backend.call.return_value = "test_gid_123"
+    backend.api.get_downloads.return_value = []
+    with patch("main.aria2_backends", BackendPool([backend])):
+        yield backend
 
 
 @pytest.fixture
@@ -67,3 +87,68 @@ def sample_urls():
         "youtube": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
         "invalid": "not_a_url",
     }
+
+
+@pytest.fixture
+def range_server():
+    """Range リクエストに対応したローカルHTTPサーバー
+
+    yield する関数にバイト列を渡すとURLを返す。
+    """
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    files = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, head_only):
+            data, ranges, delay = files.get(self.path, (None, True, 0))
+            if data is None:
+                self.send_error(404)
+                return
+
+            start, end = 0, len(data) - 1
+            header = self.headers.get("Range")
+            if ranges and header and header.startswith("bytes="):
+                first, _, last = header[6:].partition("-")
+                start = int(first)
+                end = int(last) if last else end
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            else:
+                self.send_response(200)
+            if ranges:
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", f'"{len(data)}-{hash(data)}"')
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Content-Type", "application/octet-stream")
+            self.end_headers()
+            if head_only:
+                return
+            try:
+                for offset in range(start, end + 1, 16 * 1024):
+                    self.wfile.write(data[offset : min(offset + 16 * 1024, end + 1)])
+                    time.sleep(delay)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_GET(self):
+            self._send(head_only=False)
+
+        def do_HEAD(self):
+            self._send(head_only=True)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def serve(data: bytes, name="/file.bin", ranges=True, delay=0.0) -> str:
+        files[name] = (data, ranges, delay)
+        return f"http://127.0.0.1:{server.server_port}{name}"
+
+    yield serve
+    server.shutdown()
@@ -0,0 +1,978 @@
+"""
+コアシステムのテスト
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import Mock
+
+import aria2p
+import pytest
+from flask import Flask, jsonify, request
+
+from core import (
+    Aria2Backend,
+    Aria2Monitor,
+    Aria2RPC,
+    Aria2RPCError,
+    AsyncAria2Client,
+    BackendPool,
+    EventBroker,
+    JobRecord,
+    JobState,
+    MemoryJobStore,
+    OwnerLock,
+    OwnerProxy,
+    PhaseTimer,
+    RevisionTracker,
+    SQLiteJobStore,
+    StackSampler,
+    TickHistory,
+    encode_response,
+    encoding,
+    max_event_clients,
+    start_internal_server,
+)
+from core.aio import WS_GUID, Aria2NotSent, encode_frame, read_frame
+from core.backends import parse_backends
+from core.files import OWNER_TOKEN_HEADER
+from core.metrics import MetricsRegistry
+
+
+def make_api(listening=True):
+    """aria2p.API のモック"""
+    api = Mock()
+    api.listener = Mock()
+    api.listener.is_alive.return_value = listening
+    api.get_downloads.return_value = [Mock(gid="a"), Mock(gid="b")]
+    api.client.tell_active.return_value = [{"gid": "a"}]
+    return api
+
+
+class TestAria2Monitor:
+    """aria2モニターのテスト"""
+
+    def test_polling_fallback_without_websocket(self):
+        """WebSocketが使えない場合は全件ポーリングになる"""
+        api = make_api(listening=False)
+        monitor = Aria2Monitor(api)
+
+        changes = monitor.fetch()
+        assert changes.full is True
+        assert [d.gid for d in changes.downloads] == ["a", "b"]
+        assert monitor.mode == "polling"
+
+    def test_event_mode_fetches_active_and_dirty_only(self):
+        """通知モードではアクティブと通知のあったGIDだけを取得する"""
+        api = make_api(listening=True)
+
+        def tell_status(gid):
+            if gid == "gone":
+                raise aria2p.ClientException(1, "GID gone is not found")
+            return {"gid": gid, "status": "complete"}
+
+        api.client.tell_status.side_effect = tell_status
+        monitor = Aria2Monitor(api)
+
+        # 初回は全件同期
+        assert monitor.fetch().full is True
+
+        monitor.mark_dirty("c")
+        monitor.mark_dirty("gone")
+        changes = monitor.fetch()
+
+        assert changes.full is False
+        assert sorted(d.gid for d in changes.downloads) == ["a", "c"]
+        assert changes.removed == {"gone"}
+        api.get_downloads.assert_called_once()
+
+
+class TestEventBroker:
+    """イベント配信のテスト"""
+
+    def test_updates_are_coalesced_per_job(self):
+        """同じジョブへの更新は1件にまとめられる"""
+        broker = EventBroker()
+        subscription = broker.subscribe()
+
+        broker.publish("a", "job", {"gid": "a", "progress": 0.1})
+        broker.publish("a", "job", {"gid": "a", "progress": 0.2, "status": "active"})
+        broker.publish("b", "removed", {"gid": "b"})
+
+        events, resync = subscription.wait(timeout=0)
+        assert resync is False
+        assert events == [
+            ("job", {"gid": "a", "progress": 0.2, "status": "active"}),
+            ("removed", {"gid": "b"}),
+        ]
+
+    def test_slow_client_gets_resync(self):
+        """未送信が上限を超えるとresyncを要求する"""
+        broker = EventBroker(max_pending=2)
+        subscription = broker.subscribe()
+
+        for gid in ["a", "b", "c"]:
+            broker.publish(gid, "job", {"gid": gid})
+
+        events, resync = subscription.wait(timeout=0)
+        assert events == []
+        assert resync is True
+
+    def test_client_limit_leaves_threads_for_api(self):
+        """本番サーバーでの同時接続数はワーカーのスレッド数の半分まで"""
+        assert max_event_clients(16) == 8
+        assert max_event_clients(16, requested=100) == 8
+        assert max_event_clients(16, requested=3) == 3
+        assert max_event_clients(1) == 1
+
+        broker = EventBroker(max_clients=max_event_clients(4))
+        assert broker.subscribe() and broker.subscribe()
+        assert broker.subscribe() is None
+
+
+class TestSQLiteJobStore:
+    """SQLiteジョブストアのテスト"""
+
+    def test_history_survives_restart(self, tmp_path):
+        """再起動後も履歴が残り、絞り込み・ページングできる"""
+        path = str(tmp_path / "jobs.db")
+        store = SQLiteJobStore(path)
+        completed = store.table("completed", default_status="complete")
+
+        with store.batch():
+            for i in range(5):
+                completed[f"g{i}"] = {"gid": f"g{i}", "name": f"file{i}"}
+            completed["p0"] = {"gid": "p0", "plugin_type": "HTTPDownloadPlugin"}
+            del completed["g0"]
+        store.close()
+
+        store = SQLiteJobStore(path)
+        completed = store.table("completed", default_status="complete")
+        assert len(completed) == 5
+        assert completed["g1"] == {"gid": "g1", "name": "file1"}
+        assert list(completed) == ["g1", "g2", "g3", "g4", "p0"]
+
+        total, page = completed.query(plugins={"aria2"}, limit=2, offset=1)
+        assert total == 4
+        assert [job["gid"] for job in page] == ["g2", "g3"]
+
+        total, _ = completed.query(statuses={"complete"})
+        assert total == 5
+
+    def test_migrates_old_rows(self, tmp_path):
+        """以前の形式で保存された行を読み込める形式に書き直す"""
+        import sqlite3
+
+        path = str(tmp_path / "jobs.db")
+        SQLiteJobStore(path).close()
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "INSERT INTO jobs (tbl, gid, seq, data) VALUES (?, ?, 1, ?)",
+            ("completed", "old", json.dumps({"name": "x", "gid": "old"})),
+        )
+        conn.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+
+        completed = SQLiteJobStore(path).table("completed")
+        _, jobs = completed.query()
+        assert jobs[0].to_json() == '{"gid":"old","name":"x"}'
+
+    def test_finds_urls_by_index(self, tmp_path):
+        """以前の形式のデータベースにも url 列を追加し、指定したURLだけを探す"""
+        import sqlite3
+
+        path = str(tmp_path / "jobs.db")
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE jobs (tbl TEXT NOT NULL, gid TEXT NOT NULL, "
+            "seq INTEGER NOT NULL, status TEXT, plugin_type TEXT, "
+            "completed_at TEXT, data TEXT NOT NULL, PRIMARY KEY (tbl, gid))"
+        )
+        conn.execute(
+            "INSERT INTO jobs (tbl, gid, seq, data) VALUES (?, ?, 1, ?)",
+            ("completed", "old", '{"gid":"old","url":"https://e.com/old"}'),
+        )
+        conn.execute("PRAGMA user_version = 1")
+        conn.commit()
+        conn.close()
+
+        store = SQLiteJobStore(path)
+        completed = store.table("completed")
+        completed["new"] = {"gid": "new", "url": "https://e.com/new"}
+        urls = ["https://e.com/old", "https://e.com/new", "https://e.com/other"]
+        assert completed.find_urls(urls) == {
+            "https://e.com/old": "old",
+            "https://e.com/new": "new",
+        }
+        assert completed.find_urls(urls, version=1) == {"https://e.com/old": "old"}
+        plan = store._fetchall(
+            "EXPLAIN QUERY PLAN SELECT gid FROM jobs WHERE tbl = ? AND url IN (?)",
+            ("completed", "x"),
+        )
+        assert any("idx_jobs_url" in row[-1] for row in plan)
+
+    def test_batches_are_per_thread(self, tmp_path):
+        """他のスレッドの batch() の間も、batch() の外での書き込みはすぐコミットする"""
+        import sqlite3
+
+        path = str(tmp_path / "jobs.db")
+        store = SQLiteJobStore(path)
+        completed = store.table("completed")
+        completed["g1"] = {"gid": "g1"}
+
+        def committed():
+            conn = sqlite3.connect(path)
+            try:
+                return [gid for (gid,) in conn.execute("SELECT gid FROM jobs")]
+            finally:
+                conn.close()
+
+        def api_write():
+            del completed["g1"]
+            completed["g3"] = {"gid": "g3", "name": "api"}
+
+        with store.batch():
+            completed["g2"] = {"gid": "g2"}
+            completed["g3"] = {"gid": "g3", "name": "monitor"}
+            thread = threading.Thread(target=api_write)
+            thread.start()
+            thread.join()
+            # APIの書き込みは監視ループのまとめた書き込みを待たずにコミットされる
+            assert committed() == ["g3"]
+            assert completed["g2"] == {"gid": "g2"}
+
+        assert sorted(committed()) == ["g2", "g3"]
+        assert completed["g3"] == {"gid": "g3", "name": "api"}
+
+    def test_updates_keep_order(self, tmp_path):
+        """既存ジョブの更新で並び順が変わらない"""
+        store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+        active = store.table("active", cached=True)
+        active["a"] = {"gid": "a", "progress": 0.1}
+        active["b"] = {"gid": "b", "progress": 0.1}
+        active["a"] = {"gid": "a", "progress": 0.5}
+
+        reopened = store.table("active", cached=True)
+        assert list(reopened.values()) == [
+            {"gid": "a", "progress": 0.5},
+            {"gid": "b", "progress": 0.1},
+        ]
+
+    def test_failed_commit_keeps_pending(self, tmp_path):
+        """コミットに失敗した書き込みは捨てずに次の flush で書き込む"""
+        import sqlite3
+
+        store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+        completed = store.table("completed")
+        conn = store._conn
+
+        class FailingCommit:
+            def execute(self, sql, *args):
+                if sql == "COMMIT":
+                    raise sqlite3.OperationalError("disk I/O error")
+                return conn.execute(sql, *args)
+
+            def __getattr__(self, name):
+                return getattr(conn, name)
+
+        store._conn = FailingCommit()
+        with pytest.raises(sqlite3.OperationalError):
+            completed["a"] = {"gid": "a"}
+        store._conn = conn
+        assert completed["a"] == {"gid": "a"}
+
+        store.flush()
+        store.close()
+        reopened = SQLiteJobStore(str(tmp_path / "jobs.db")).table("completed")
+        assert list(reopened) == ["a"]
+
+
+class TestJobRecord:
+    """ジョブレコードのテスト"""
+
+    def test_dict_compatible_with_cached_json(self):
+        """dictと同じように使え、JSONは変更時だけ作り直す"""
+        record = JobRecord(
+            {"gid": "a", "status": "active", "created_at": "2024-03-01T12:00:00.5"}
+        )
+        assert not hasattr(record, "__dict__")
+        assert record == {
+            "gid": "a",
+            "status": "active",
+            "created_at": "2024-03-01T12:00:00.5",
+        }
+        assert isinstance(record.timestamp("created_at"), float)
+        assert "progress" not in record and record.get("progress") is None
+
+        encoded = record.to_json()
+        assert record.to_json() is encoded
+        record.update(progress=0.5, custom="x")
+        assert json.loads(record.to_json())["progress"] == 0.5
+        assert record["custom"] == "x"
+
+        lazy = JobRecord.from_json(record.to_json())
+        assert lazy.to_json() == record.to_json()
+        assert lazy["status"] == "active"
+        del lazy["custom"]
+        assert "custom" not in json.loads(lazy.to_json())
+
+    @pytest.fixture
+    def berlin(self, monkeypatch):
+        """ローカル時刻を夏時間のあるタイムゾーンにする"""
+        if not hasattr(time, "tzset"):
+            pytest.skip("time.tzset is not available")
+        monkeypatch.setenv("TZ", "Europe/Berlin")
+        time.tzset()
+        yield
+        monkeypatch.undo()
+        time.tzset()
+
+    def test_timestamps_round_trip_exactly(self, berlin):
+        """日時の値はタイムゾーンや夏時間に関係なく設定したまま読み出せる"""
+        values = {
+            "created_at": "2026-10-18T09:00:00+00:00",
+            # 夏時間の開始で存在しないローカル時刻
+            "updated_at": "2026-03-29T02:30:00",
+            "completed_at": 1792317626,
+        }
+        record = JobRecord(gid="a", **values)
+        assert dict(record) == {"gid": "a", **values}
+        assert JobRecord.from_json(record.to_json()) == {"gid": "a", **values}
+        assert record.to_json() == json.dumps(
+            {"gid": "a", **values}, separators=(",", ":"), sort_keys=True
+        )
+
+        assert record.timestamp("created_at") == 1792314000.0
+        assert record.timestamp("completed_at") == 1792317626.0
+        record["created_at"] = "2026-10-18T11:00:00+02:00"
+        assert record["created_at"] == "2026-10-18T11:00:00+02:00"
+        assert record.timestamp("created_at") == 1792314000.0
+        record["created_at"] = "unknown"
+        assert record.timestamp("created_at") is None
+
+    @pytest.fixture(params=["json", "orjson"])
+    def backend(self, request):
+        """両方のエンコーダーで実行（orjson が無ければ json になる）"""
+        previous = encoding.get_backend()
+        yield encoding.set_backend(request.param)
+        encoding.set_backend(previous)
+
+    def test_encoder_handles_rich_types(self, backend):
+        """datetime・timedelta・Path・ジョブレコードを事前変換なしでエンコードする"""
+        value = {
+            "b": timedelta(minutes=2),
+            "a": datetime(2024, 3, 1, 12, 0, 0, 500000),
+            "path": Path("downloads") / "x.bin",
+            "job": JobRecord(gid="a", status="active"),
+            "tags": {"x"},
+        }
+        assert encoding.dumps(value) == (
+            '{"a":"2024-03-01T12:00:00.500000","b":120,'
+            '"job":{"gid":"a","status":"active"},'
+            f'"path":{json.dumps(str(value["path"]))},"tags":["x"]}}'
+        )
+        assert encoding.loads(encoding.dumps({"n": "動画"})) == {"n": "動画"}
+        with pytest.raises(ValueError):
+            encoding.set_backend("ujson")
+
+    def test_response_matches_jsonify(self, backend):
+        """キャッシュをつなげたレスポンスが jsonify と同じ内容になる"""
+        app = Flask(__name__)
+        app.json = encoding.FastJSONProvider(app)
+        jobs = [
+            JobRecord(gid="a", name='動画 "1"', eta=None, progress=0.25),
+            {"gid": "b", "total_length": 10},
+        ]
+        payload = {"completed": [], "active": jobs, "total": {"active": 2}}
+        with app.app_context():
+            expected = jsonify(
+                {
+                    "completed": [],
+                    "active": [dict(job) for job in jobs],
+                    "total": {"active": 2},
+                }
+            ).get_data(as_text=True)
+        assert encode_response(payload) == expected
+
+
+class TestJobState:
+    """ジョブのスナップショットのテスト"""
+
+    def test_snapshot_is_isolated_from_writes(self):
+        """公開するまで書き込みは見えず、公開後も書き込み側の変更の影響を受けない"""
+        store = MemoryJobStore()
+        state = JobState(store.table("active"), store.table("completed"))
+        state.active["a"] = {"gid": "a", "status": "active"}
+        assert len(state.snapshot().active) == 0
+
+        snapshot = state.publish(revision=5)
+        assert snapshot.revision == 5 and list(snapshot.active) == ["a"]
+        state.active["a"]["status"] = "paused"
+        del state.active["a"]
+        assert snapshot.active["a"]["status"] == "active"
+        assert len(state.publish().active) == 0
+        with pytest.raises(TypeError):
+            snapshot.active["b"] = {}
+
+    def test_concurrent_readers_and_writers(self):
+        """書き込み・削除・公開と同時に読み取っても例外や途中の状態が見えない"""
+        store = MemoryJobStore()
+        state = JobState(store.table("active"), store.table("completed"))
+        stop = threading.Event()
+        errors = []
+        reads = [0]
+
+        def writer(offset):
+            n = 0
+            while not stop.is_set():
+                n += 1
+                gid = f"{offset}-{n % 500}"
+                with state.lock:
+                    job = state.active.get(gid)
+                    if job is None or n % 7 == 0:
+                        state.active[gid] = {"gid": gid, "a": n, "b": n}
+                    else:
+                        # 2つのフィールドをその場で更新（途中の状態は公開されない）
+                        job["a"] = n
+                        job["b"] = n
+                        state.active[gid] = job
+                    if n % 3 == 0 and gid in state.active:
+                        del state.active[gid]
+                if n % 50 == 0:
+                    state.publish(n)
+
+        def reader():
+            while not stop.is_set():
+                try:
+                    snapshot = state.snapshot()
+                    for job in snapshot.active.values():
+                        assert job["a"] == job["b"]
+                    total, jobs = state.query("active", snapshot, limit=10)
+                    assert total == len(snapshot.active) and len(jobs) <= 10
+                    reads[0] += 1
+                except Exception as e:
+                    errors.append(e)
+                    return
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+        threads += [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(1.0)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert reads[0] > 0
+        final = state.publish()
+        assert dict(final.active) == {gid: state.active[gid] for gid in state.active}
+
+    def test_sql_history_reads_published_rows(self, tmp_path):
+        """SQLの履歴は公開時点でコミット済みの行だけを読み、読み取りでコミットしない"""
+        store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+        state = JobState(
+            store.table("active", cached=True),
+            store.table("completed", default_status="complete"),
+        )
+        state.active["a"] = {"gid": "a", "status": "active"}
+        state.completed["old"] = {"gid": "old"}
+        state.publish()
+
+        with store.batch():
+            del state.active["a"]
+            state.completed["a"] = {"gid": "a"}
+            snapshot = state.snapshot()
+            assert state.query("completed", snapshot) == (1, [{"gid": "old"}])
+            assert state.query("completed", snapshot, gids=["a", "old"])[0] == 1
+            assert store._pending[threading.get_ident()]
+
+            # コミット後も公開するまでは前のスナップショットのまま
+            store.flush()
+            assert list(snapshot.active) == ["a"]
+            assert state.query("completed", snapshot)[0] == 1
+
+        snapshot = state.publish()
+        assert list(snapshot.active) == []
+        total, jobs = state.query("completed", snapshot)
+        assert total == 2 and [job["gid"] for job in jobs] == ["old", "a"]
+
+        # 既存の行の更新は版を変えない
+        state.completed["old"] = {"gid": "old", "name": "x"}
+        assert state.query("completed", snapshot, gids=["old"])[1] == [
+            {"gid": "old", "name": "x"}
+        ]
+
+
+class TestRevisionTracker:
+    """差分取得用のリビジョンのテスト"""
+
+    def test_history_is_pruned(self):
+        """記録は上限までに切り詰め、切り詰めた分より古い差分は返さない"""
+        revisions = RevisionTracker(max_tombstones=2, max_changes=3)
+        for gid in "abcde":
+            revisions.touch(gid)
+        assert len(revisions._changed) == 3
+        assert revisions.changed_since(1) is None
+        assert revisions.changed_since(2) == ({"c", "d", "e"}, [])
+        assert revisions.changed_since(4) == ({"e"}, [])
+
+        # 同じジョブの更新は記録を増やさない
+        for _ in range(10):
+            revisions.touch("e")
+        assert revisions.changed_since(2) == ({"c", "d", "e"}, [])
+
+        for gid in "cde":
+            revisions.remove(gid)
+        since = revisions.revision - 2
+        assert revisions.changed_since(since) == (set(), ["e", "d"])
+        assert revisions.changed_since(since - 1) is None
+
+
+class TestOwnerProxy:
+    """本番サーバーのオーナープロセスへの転送のテスト"""
+
+    def test_single_owner_and_forwarding(self, tmp_path):
+        """ロックを取れるのは1つだけで、他はAPIをオーナーへ転送する"""
+        owner_app = Flask("owner")
+
+        @owner_app.route("/api/echo", methods=["POST"])
+        def echo():
+            return jsonify({"body": request.get_json(), "q": request.args["q"]}), 201
+
+        path = str(tmp_path / "owner.lock")
+        owner = OwnerLock(path)
+        assert owner.acquire()
+        owner.publish(start_internal_server(owner_app))
+        assert not OwnerLock(path).acquire()
+
+        replica_app = Flask("replica")
+        replica_app.add_url_rule("/", "index", lambda: "local")
+        OwnerProxy(OwnerLock(path)).init_app(replica_app)
+        client = replica_app.test_client()
+
+        response = client.post("/api/echo?q=1", json={"url": "x"})
+        assert response.status_code == 201
+        assert response.json == {"body": {"url": "x"}, "q": "1"}
+        assert client.get("/").data == b"local"
+
+        # オーナーのアドレスが分からなければ503
+        owner.release()
+        with open(path, "w") as f:
+            f.write("{}")
+        orphan_app = Flask("orphan")
+        OwnerProxy(OwnerLock(path)).init_app(orphan_app)
+        assert orphan_app.test_client().get("/api/echo").status_code == 503
+
+    def test_file_handoff(self, tmp_path):
+        """完了したファイルはオーナーがパスだけを返し、転送元のワーカーが送信する"""
+        from core.files import FileServer, local_file_response
+
+        data = tmp_path / "f.bin"
+        data.write_bytes(b"0123456789")
+        path = str(tmp_path / "owner.lock")
+        owner = OwnerLock(path)
+        assert owner.acquire()
+        owner_app = Flask("owner")
+        owner_headers = []
+
+        @owner_app.route("/api/file")
+        def file():
+            token = request.headers.get(OWNER_TOKEN_HEADER)
+            owner_headers.append(token)
+            if token == owner.token:
+                return local_file_response(str(data), "f.bin")
+            return "proxied"
+
+        owner.publish(start_internal_server(owner_app))
+        replica_app = Flask("replica")
+        OwnerProxy(OwnerLock(path), file_server=FileServer()).init_app(replica_app)
+        client = replica_app.test_client()
+
+        # クライアントが送った値は捨て、オーナーの値に置き換える
+        response = client.get(
+            "/api/file", headers={"Range": "bytes=2-4", OWNER_TOKEN_HEADER: "x"}
+        )
+        assert response.status_code == 206 and response.data == b"234"
+        assert owner_headers == [owner.token]
+
+        # file_server が無ければ値を付けずにそのまま転送する
+        plain_app = Flask("plain")
+        OwnerProxy(OwnerLock(path)).init_app(plain_app)
+        assert plain_app.test_client().get("/api/file").data == b"proxied"
+        assert owner_headers[-1] is None
+        owner.release()
+
+
+async def fake_aria2(reader, writer, batch=3):
+    """要求を batch 件まとめて受けてから逆順に応答する aria2 のWebSocketサーバー"""
+    request = (await reader.readuntil(b"\r\n\r\n")).decode()
+    key = next(
+        line.split(":", 1)[1].strip()
+        for line in request.split("\r\n")
+        if line.lower().startswith("sec-websocket-key")
+    )
+    accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest())
+    writer.write(
+        b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+        b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+    )
+
+    messages = []
+    while len(messages) < batch:
+        _, _, payload = await read_frame(reader)
+        messages.append(json.loads(payload))
+
+    notification = {"method": "aria2.onDownloadStart", "params": [{"gid": "n1"}]}
+    writer.write(encode_frame(json.dumps(notification).encode(), mask=False))
+    for message in reversed(messages):
+        if message["method"] == "aria2.tellStatus":
+            reply = {"id": message["id"], "error": {"code": 1, "message": "not found"}}
+        else:
+            reply = {"id": message["id"], "result": message["params"]}
+        writer.write(encode_frame(json.dumps(reply).encode(), mask=False))
+    await writer.drain()
+
+
+class TestMetrics:
+    """メトリクスのテスト"""
+
+    def test_prometheus_text_format(self):
+        """カウンター・ヒストグラムをPrometheusのテキスト形式で書き出す"""
+        registry = MetricsRegistry()
+        counter = registry.counter("bytes", "Bytes", ("plugin",))
+        histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+        counter.labels("http").inc(10)
+        counter.labels("http").inc(5)
+        counter.labels('we"ird').inc()
+        for value in (0.05, 0.5, 2):
+            histogram.observe(value)
+
+        text = registry.render()
+        assert "# TYPE bytes counter" in text
+        assert 'bytes_total{plugin="http"} 15' in text
+        assert 'bytes_total{plugin="we\\"ird"} 1' in text
+        assert 'latency_seconds_bucket{le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{le="1"} 2' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+        assert "latency_seconds_sum 2.55" in text
+        assert "latency_seconds_count 3" in text
+        with pytest.raises(ValueError):
+            counter.labels()
+
+    def test_family_names_match_samples(self):
+        """サンプル名はすべて HELP/TYPE のファミリー名に接尾辞を付けたものになる"""
+        registry = MetricsRegistry()
+        registry.counter("jobs_total", "Jobs", ("plugin",)).labels("http").inc()
+        registry.gauge("active", "Active").set(2)
+        registry.histogram("latency_seconds", "Latency", buckets=(0.1,)).observe(1)
+
+        text = registry.render()
+        assert text.endswith("# EOF\n")
+        suffixes = {
+            "counter": ("_total", "_created"),
+            "gauge": ("",),
+            "histogram": ("_bucket", "_sum", "_count", "_created"),
+        }
+        families = {}
+        for line in text.splitlines()[:-1]:
+            if line.startswith("# TYPE "):
+                _, _, name, kind = line.split(" ")
+                families[name] = kind
+            elif not line.startswith("#"):
+                sample = line.split("{")[0].split(" ")[0]
+                assert any(
+                    sample == family + suffix
+                    for family, kind in families.items()
+                    for suffix in suffixes[kind]
+                ), sample
+        assert families == {
+            "active": "gauge",
+            "jobs": "counter",
+            "latency_seconds": "histogram",
+        }
+
+        parser = pytest.importorskip("prometheus_client.openmetrics.parser")
+        parsed = {
+            family.name: family
+            for family in parser.text_string_to_metric_families(text)
+        }
+        assert parsed["jobs"].type == "counter"
+        assert [sample.name for sample in parsed["jobs"].samples] == [
+            "jobs_total",
+            "jobs_created",
+        ]
+
+    def test_endpoint_and_request_latency(self):
+        """/metrics を公開し、APIの処理時間をルールごとに記録する"""
+        registry = MetricsRegistry()
+        app = Flask(__name__)
+        registry.init_app(app)
+        app.add_url_rule("/api/job/<gid>", "job", lambda gid: gid)
+
+        client = app.test_client()
+        client.get("/api/job/1")
+        client.get("/api/job/2")
+        response = client.get("/metrics")
+
+        assert response.content_type.startswith("application/openmetrics-text")
+        assert (
+            "arial_http_request_duration_seconds_count"
+            '{method="GET",route="/api/job/<gid>",status="200"} 2'
+        ) in response.get_data(as_text=True)
+
+
+class TestMonitorTicks:
+    """監視ループの計測のテスト"""
+
+    def test_interval_adapts_to_tick_duration(self):
+        """処理が長い間は間隔を広げ、直近の記録を新しい順に返す"""
+        history = TickHistory(size=2, interval=1.0, max_interval=5.0, slow_threshold=2)
+
+        fast = PhaseTimer("tick")
+        with fast.phase("fetch"):
+            pass
+        tick = history.record(fast)
+        assert tick["interval"] == 1.0 and 0.9 < tick["sleep"] <= 1.0
+        assert not tick["slow"] and "fetch" in tick["phases"]
+
+        assert history.next_interval(1.5) == 3.0
+        assert history.next_interval(10) == 5.0
+
+        slow = PhaseTimer("tick")
+        slow._started -= 3
+        tick = history.record(slow, ["aria0: timeout"])
+        assert tick["slow"] and tick["interval"] == 5.0
+        assert tick["sleep"] == pytest.approx(2.0, abs=0.1)
+
+        history.record(fast)
+        snapshot = history.snapshot(limit=5)
+        assert len(snapshot["ticks"]) == 2
+        assert snapshot["ticks"][1]["errors"] == ["aria0: timeout"]
+
+    def test_stack_sampler_dumps_folded_stacks(self, tmp_path):
+        """対象スレッドのスタックを採取して折り畳み形式で保存する"""
+        sampler = StackSampler(interval=0.001)
+
+        def busy_wait_for_sampler():
+            deadline = time.monotonic() + 0.1
+            while time.monotonic() < deadline:
+                pass
+
+        sampler.start(threading.get_ident())
+        busy_wait_for_sampler()
+        samples = sampler.stop()
+
+        assert sum(samples.values()) > 5
+        path = sampler.dump(samples, str(tmp_path))
+        with open(path) as f:
+            lines = f.read().splitlines()
+        assert any("busy_wait_for_sampler" in line for line in lines)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+class TestAsyncAria2Client:
+    """非同期aria2クライアントのテスト"""
+
+    def test_pipelined_calls_and_notifications(self):
+        """応答を待たずに送信し、順不同の応答をIDで対応付ける"""
+        rpc = Aria2RPC(AsyncAria2Client(secret="s3cret"))
+        server = rpc.loop.run(
+            asyncio.start_server(fake_aria2, "127.0.0.1", 0), timeout=5
+        )
+        rpc.client.port = server.sockets[0].getsockname()[1]
+
+        notified = threading.Event()
+        rpc.add_listener(lambda method, gid: gid == "n1" and notified.set())
+
+        results = rpc.gather(
+            [
+                ("aria2.tellActive", []),
+                ("aria2.tellStatus", ["gone"]),
+                ("system.listMethods", []),
+            ]
+        )
+        assert results[0] == ["token:s3cret"]
+        assert isinstance(results[1], Aria2RPCError)
+        assert results[2] == []
+        assert notified.wait(2)
+
+        rpc.close()
+        server.close()
+        rpc.loop.stop()
+
+    def test_timeout_releases_pending(self):
+        """応答が来ずにタイムアウトした呼び出しは応答待ちから取り除く"""
+        rpc = Aria2RPC(AsyncAria2Client(timeout=0.2))
+        # fake_aria2 は3件揃うまで応答しない
+        server = rpc.loop.run(
+            asyncio.start_server(fake_aria2, "127.0.0.1", 0), timeout=5
+        )
+        rpc.client.port = server.sockets[0].getsockname()[1]
+
+        with pytest.raises(asyncio.TimeoutError):
+            rpc.call("aria2.tellActive")
+        assert rpc.client._pending == {}
+
+        rpc.close()
+        server.close()
+        rpc.loop.stop()
+
+    def test_fallback_only_when_safe(self):
+        """送信済みかもしれない追加はHTTPで送り直さず、未送信・読み取りは送り直す"""
+        backend = Aria2Backend("a")
+        backend.api = Mock()
+        backend.api.client.call.return_value = "http"
+        backend.rpc = Mock()
+
+        backend.rpc.call.side_effect = asyncio.TimeoutError()
+        with pytest.raises(asyncio.TimeoutError):
+            backend.call("aria2.addUri", ["https://e.com/f"])
+        assert backend.call("aria2.tellStatus", "g1") == "http"
+
+        backend.rpc.call.side_effect = ConnectionError("lost")
+        with pytest.raises(ConnectionError):
+            backend.call("aria2.addUri", ["https://e.com/f"])
+
+        backend.rpc.call.side_effect = Aria2NotSent("refused")
+        assert backend.call("aria2.addUri", ["https://e.com/f"]) == "http"
+        backend.api.client.call.assert_called_with(
+            "aria2.addUri", [["https://e.com/f"]]
+        )
+
+
+class StubBackend(Aria2Backend):
+    """getGlobalStat に固定値を返すバックエンド"""
+
+    def __init__(self, name, active, speed=0):
+        super().__init__(name)
+        self.api = Mock()
+        self.stat = {
+            "numActive": str(active),
+            "numWaiting": "0",
+            "downloadSpeed": str(speed),
+        }
+
+    def call(self, method, *params):
+        assert method == "aria2.getGlobalStat"
+        return self.stat
+
+
+class TestBackendPool:
+    """複数aria2バックエンドのテスト"""
+
+    def test_least_load_placement_and_namespacing(self):
+        """空いているバックエンドから順に割り当て、GIDに名前を付ける"""
+        busy = StubBackend("busy", 5)
+        idle = StubBackend("idle", 1)
+        slow = StubBackend("slow", 1, speed=10**6)
+        pool = BackendPool([busy, idle, slow])
+
+        placement = [backend.name for backend in pool.assign(6)]
+        assert placement == ["idle", "slow", "idle", "slow", "idle", "slow"]
+
+        gid = pool.qualify(idle, "abc")
+        assert gid == "idle:abc"
+        assert pool.resolve(gid) == (idle, "abc")
+        assert pool.owns(idle, gid) and not pool.owns(busy, gid)
+        assert not pool.owns(idle, "plugin_x")
+
+        # 1つだけなら従来通りのGID
+        single = BackendPool([idle])
+        assert single.qualify(idle, "abc") == "abc"
+        assert single.resolve("abc") == (idle, "abc")
+
+    def test_parse_backends(self, tmp_path):
+        """ARIA2_BACKENDS の書式"""
+        backends = parse_backends(
+            "local:6801, nas=http://s3cret@10.0.0.2:6900", str(tmp_path)
+        )
+        assert [(b.name, b.host, b.port, b.spawn) for b in backends] == [
+            ("aria0", "localhost", 6801, True),
+            ("nas", "10.0.0.2", 6900, False),
+        ]
+        assert backends[1].secret == "s3cret"
+
+    def test_download_limits_sent_on_change(self):
+        """帯域の上限は変わった値だけaria2へ送る"""
+        backend = Aria2Backend("a")
+        backend.call = Mock()
+        backend.set_download_limits(300, {"g1": 100, "g2": 200})
+        backend.set_download_limits(300, {"g1": 100, "g2": 200})
+        assert backend.call.call_count == 3
+
+        backend.call.reset_mock()
+        backend.set_download_limits(0, {"g1": 0})
+        assert [c.args for c in backend.call.call_args_list] == [
+            ("aria2.changeOption", "g1", {"max-download-limit": "0"}),
+            ("aria2.changeGlobalOption", {"max-overall-download-limit": "0"}),
+        ]
+
+    def test_unknown_download_limits_are_reset(self):
+        """登録時に上限を付けたジョブや不明なジョブは、無制限に戻すときも送る"""
+        backend = Aria2Backend("a")
+        backend.call = Mock()
+        backend.note_download_limit("g1", 500)
+        backend.note_download_limit("g2", 0)
+        backend.set_download_limits(0, {"g1": 0, "g2": 0, "g3": 0})
+        assert [c.args for c in backend.call.call_args_list] == [
+            ("aria2.changeOption", "g1", {"max-download-limit": "0"}),
+            ("aria2.changeOption", "g3", {"max-download-limit": "0"}),
+            ("aria2.changeGlobalOption", {"max-overall-download-limit": "0"}),
+        ]
+
+
+class TestBackendStartup:
+    """aria2の起動待ちのテスト"""
+
+    def test_reuses_running_aria2(self):
+        """ポートで既にaria2が応答していれば起動しない"""
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                request = json.loads(
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                )
+                body = json.dumps(
+                    {
+                        "id": request["id"],
+                        "jsonrpc": "2.0",
+                        "result": {"version": "1.37.0"},
+                    }
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        backend = Aria2Backend("aria0", host="127.0.0.1", port=server.server_port)
+        backend.spawn = True
+        backend._command = lambda: pytest.fail("aria2c should not be spawned")
+        assert backend.start()
+        assert backend.process is None
+        server.shutdown()
+
+    def test_fails_fast_when_process_exits(self, tmp_path):
+        """aria2cがすぐに終了した場合は待たずに失敗する"""
+        backend = Aria2Backend("aria0", host="127.0.0.1", port=1, spawn=True)
+        backend._command = lambda: [sys.executable, "-c", "raise SystemExit(3)"]
+
+        started = time.monotonic()
+        assert not backend.start(timeout=10)
+        assert time.monotonic() - started < 5
+        assert not backend.available
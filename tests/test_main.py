@@ -2,9 +2,10 @@
 メインアプリケーションのテスト
 """
 
-import pytest
 import json
-from unittest.mock import patch, Mock
+from unittest.mock import Mock, patch
+
+import pytest
 
 
 class TestApp:
@@ -76,10 +77,11 @@ class TestUtilityFunctions:
 
     def test_make_json_serializable(self):
         """JSON シリアライズ関数のテスト"""
-        from main import make_json_serializable
         from datetime import datetime
         from pathlib import Path
 
+        from main import make_json_serializable
+
         # 基本的なデータ型
         assert make_json_serializable(42) == 42
         assert make_json_serializable("test") == "test"
@@ -103,3 +105,475 @@ class TestUtilityFunctions:
         path = Path("/test/path")
         result = make_json_serializable(path)
         assert isinstance(result, str)
+
+
+class TestDownloadsQuery:
+    """ダウンロード一覧のページング・差分取得のテスト"""
+
+    def test_pagination_and_filters(self, app):
+        """limit/offset とステータス絞り込み"""
+        import main
+
+        with patch.dict(
+            main.download_jobs,
+            {
+                "a": {"gid": "a", "status": "active"},
+                "b": {"gid": "b", "status": "paused"},
+                "c": {"gid": "c", "status": "active", "plugin_type": "Foo"},
+            },
+            clear=True,
+        ):
+            # 読み取りは監視ループが公開したスナップショットを使う
+            main.publish_jobs()
+            data = app.get("/api/downloads?state=active&status=active&limit=1").json
+            assert data["total"] == {"active": 2}
+            assert [job["gid"] for job in data["active"]] == ["a"]
+
+            data = app.get("/api/downloads?state=active&plugin=aria2").json
+            assert [job["gid"] for job in data["active"]] == ["a", "b"]
+
+        assert app.get("/api/downloads?limit=abc").status_code == 400
+
+    def test_since_and_etag(self, app):
+        """since で差分のみ取得し、未変更なら304を返す"""
+        import main
+
+        with patch.dict(main.download_jobs, {}, clear=True):
+            main.publish_jobs()
+            data = app.get("/api/downloads?state=active").json
+            assert "revision" not in data
+            cursor = data["cursor"]
+            main.download_jobs["x"] = {"gid": "x", "status": "active"}
+            main.notify_job_changed("x", None, main.download_jobs["x"])
+            main.publish_jobs()
+
+            response = app.get(f"/api/downloads?since={cursor}")
+            data = response.json
+            assert [job["gid"] for job in data["active"]] == ["x"]
+            assert data["full"] is False
+
+            # 再起動前（別のプロセス）のカーソルや数値だけのリビジョンは全件を返す
+            for since in ("0123abcd-r0", "0"):
+                data = app.get(f"/api/downloads?since={since}").json
+                assert data["full"] is True and data["removed"] == []
+
+            etag = response.headers["ETag"]
+            response = app.get("/api/downloads", headers={"If-None-Match": etag})
+            assert response.status_code == 304
+
+
+class TestBatchAPI:
+    """一括追加APIのテスト"""
+
+    @patch("main.plugin_manager")
+    def test_batch_routes_and_dedupes(self, mock_manager, mock_aria2, app):
+        """プラグイン・aria2への振り分け、multicall、重複の除外"""
+        import main
+
+        mock_plugin = Mock()
+        mock_plugin.download.return_value = "job1"
+        mock_manager.get_plugin_for_url.side_effect = lambda url: (
+            mock_plugin if "video" in url else None
+        )
+        mock_aria2.api.client.ADD_URI = "aria2.addUri"
+        mock_aria2.api.client.multicall.return_value = [
+            ["gid1"],
+            {"code": 1, "message": "bad uri"},
+        ]
+
+        with patch.dict(
+            main.download_jobs,
+            {"old": {"gid": "old", "url": "https://example.com/old"}},
+            clear=True,
+        ):
+            main.publish_jobs()
+            response = app.post(
+                "/api/downloads/batch",
+                data="https://example.com/a\n# comment\nhttps://example.com/video\n"
+                "https://example.com/b\nhttps://example.com/old\n"
+                "https://example.com/a\n",
+                content_type="text/plain",
+            )
+
+        data = response.json
+        assert response.status_code == 200
+        assert [r.get("gid") for r in data["results"]] == [
+            "gid1",
+            "plugin_job1",
+            None,
+            "old",
+            "gid1",
+        ]
+        assert data["results"][2]["error"] == "bad uri"
+        assert (data["added"], data["duplicates"], data["failed"]) == (2, 2, 1)
+
+        # aria2行きの2件は1回のmulticallで登録される
+        methods = mock_aria2.api.client.multicall.call_args[0][0]
+        assert [m["params"][0] for m in methods] == [
+            ["https://example.com/a"],
+            ["https://example.com/b"],
+        ]
+
+    def test_batch_requires_urls(self, app):
+        """空のリストは400"""
+        response = app.post("/api/downloads/batch", json=[])
+        assert response.status_code == 400
+
+
+class TestMultipleBackends:
+    """複数aria2バックエンドへの振り分けのテスト"""
+
+    def test_routes_to_owning_backend(self, app):
+        """追加は空いている方へ、操作はGIDの持ち主へ送る"""
+        from core import BackendPool
+
+        backends = []
+        for name, active in (("a", 3), ("b", 0)):
+            backend = Mock()
+            backend.name = name
+            backend.monitor = None
+            backend.load.return_value = (active, 0, 0)
+            backend.call.return_value = "0123"
+            backends.append(backend)
+
+        with patch("main.aria2_backends", BackendPool(backends)), patch(
+            "main.plugin_manager", None
+        ):
+            response = app.post("/api/download", json={"url": "https://e.com/f"})
+            assert response.json["gid"] == "b:0123"
+
+            app.post("/api/download/a:0456/pause")
+            backends[0].call.assert_called_with("aria2.pause", "0456")
+
+
+class TestJobRegistry:
+    """ジョブレジストリを使った操作のテスト"""
+
+    def test_controls_dispatch_without_monitor(self, app, tmp_path):
+        """登録直後のプラグインジョブを、監視ループの反映を待たずに操作できる"""
+        import main
+
+        plugin = Mock()
+        plugin.download.return_value = "j1"
+        plugin.active_downloads = {"j1": {"status": "downloading"}}
+        plugin.completed_downloads = {}
+        manager = Mock()
+        manager.get_plugin_for_url.return_value = plugin
+
+        with patch("main.plugin_manager", manager), patch(
+            "main.job_registry", main.JobRegistry()
+        ):
+            gid = app.post("/api/download", json={"url": "https://e.com/f"}).json["gid"]
+            assert app.post(f"/api/download/{gid}/pause").status_code == 200
+            plugin.pause.assert_called_once_with("j1")
+            assert main.job_registry.get(gid).state == "paused"
+            manager.get_all_plugins.assert_not_called()
+
+            # 完了直後（監視ループが取り込む前）でもファイルを取得・削除できる
+            path = tmp_path / "f.bin"
+            path.write_bytes(b"data")
+            plugin.completed_downloads["j1"] = plugin.active_downloads.pop("j1")
+            plugin.completed_downloads["j1"].update(
+                filename="f.bin", file_path=str(path)
+            )
+            assert app.get(f"/api/file/{gid}").data == b"data"
+            assert app.post(f"/api/download/{gid}/pause").status_code == 404
+            response = app.post(
+                f"/api/completed/{gid}/delete", json={"delete_file": True}
+            )
+            assert response.status_code == 200
+            assert not path.exists() and plugin.completed_downloads == {}
+            assert gid not in main.job_registry
+
+
+class TestFileDownload:
+    """/api/file のテスト"""
+
+    @pytest.fixture
+    def completed_file(self, tmp_path):
+        path = tmp_path / "f.bin"
+        path.write_bytes(bytes(range(256)) * 4)
+        job = {"status": "complete", "name": "f.bin", "file_path": str(path)}
+        with patch("main.completed_jobs", {"g1": job}):
+            yield path
+
+    def test_range_and_conditional(self, app, completed_file):
+        """Range には206、ETagが一致すれば304を返す"""
+        response = app.get("/api/file/g1", headers={"Range": "bytes=10-19"})
+        assert response.status_code == 206
+        assert response.data == bytes(range(10, 20))
+        assert response.headers["Content-Range"] == "bytes 10-19/1024"
+
+        etag = app.get("/api/file/g1").headers["ETag"]
+        response = app.get("/api/file/g1", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+        # ファイルが変わればIf-Rangeは一致せず全体を返す
+        completed_file.write_bytes(b"changed")
+        response = app.get(
+            "/api/file/g1", headers={"Range": "bytes=0-1", "If-Range": etag}
+        )
+        assert response.status_code == 200 and response.data == b"changed"
+
+    def test_accel_redirect(self, app, completed_file):
+        """x-accel ではnginxの内部URIだけを返す"""
+        from core.files import FileServer
+
+        server = FileServer("x-accel", "/protected", str(completed_file.parent))
+        with patch("main.file_server", server):
+            response = app.get("/api/file/g1")
+        assert response.headers["X-Accel-Redirect"] == "/protected/f.bin"
+        assert "X-Sendfile" not in response.headers
+        assert response.data == b""
+
+
+class TestBandwidth:
+    """帯域制限のテスト"""
+
+    def test_settings_api(self, app):
+        """設定の変更と取得（不正な値は400）"""
+        from plugins.ratelimit import BandwidthLimiter
+
+        with patch("main.bandwidth_limiter", BandwidthLimiter()):
+            response = app.post(
+                "/api/bandwidth",
+                json={"limit": "1M", "schedule": {"08:00": "2M", "01:00": 0}},
+            )
+            assert response.status_code == 200
+            data = app.get("/api/bandwidth").json
+            assert data["limit"] == 1024 * 1024
+            assert data["schedule"] == [
+                {"from": "01:00", "limit": 0},
+                {"from": "08:00", "limit": 2 * 1024 * 1024},
+            ]
+
+            # 取得した形のままスケジュールを戻せる
+            response = app.post(
+                "/api/bandwidth", json={"schedule": data["schedule"][1:]}
+            )
+            assert response.json["effective_limit"] == 2 * 1024 * 1024
+
+            for body in ({"limit": "fast"}, {"shares": {"urgent": 1}}, ["1M"]):
+                assert app.post("/api/bandwidth", json=body).status_code == 400
+            response = app.post(
+                "/api/download", json={"url": "https://e.com/f", "priority": "asap"}
+            )
+            assert response.status_code == 400
+
+    def test_applies_limits_to_aria2(self, app, mock_aria2):
+        """転送中のaria2のジョブに優先度に応じた上限を設定する"""
+        import main
+        from plugins.ratelimit import BandwidthLimiter
+
+        with patch("main.bandwidth_limiter", BandwidthLimiter(rate=300)), patch(
+            "main.plugin_manager", None
+        ), patch("main.job_registry", main.JobRegistry()), patch.dict(
+            main.download_jobs, {}, clear=True
+        ):
+            app.post("/api/download", json={"url": "https://e.com/a"})
+            mock_aria2.call.assert_called_with(
+                "aria2.addUri",
+                ["https://e.com/a"],
+                {"dir": main.DEFAULT_DOWNLOAD_DIR, "max-download-limit": "300"},
+            )
+            main.job_registry.add_aria2_job("g2", mock_aria2, "g2", priority="high")
+            main.download_jobs.update(
+                {
+                    "test_gid_123": {"gid": "test_gid_123", "status": "active"},
+                    "g2": {"gid": "g2", "status": "active"},
+                    "g3": {"gid": "g3", "status": "waiting"},
+                }
+            )
+            main.publish_jobs()
+            main.apply_bandwidth_limits()
+            mock_aria2.set_download_limits.assert_called_with(
+                300, {"test_gid_123": 100, "g2": 200}
+            )
+
+
+class TestMetricsEndpoint:
+    """/metrics のテスト"""
+
+    def test_monitor_updates_counters(self, app):
+        """監視ループで記録した取得バイト数・完了件数を公開する"""
+        import main
+
+        main.record_job_progress("TestPlugin", "", {"completed_length": 100}, 350)
+        main.record_job_progress("TestPlugin", "", {"completed_length": 350}, 350)
+        main.record_job_completed(
+            "TestPlugin", {"created_at": "2000-01-01T00:00:00"}, 350
+        )
+
+        text = app.get("/metrics").get_data(as_text=True)
+        assert (
+            'arial_downloaded_bytes_total{plugin="TestPlugin",backend=""} 250' in text
+        )
+        assert 'arial_jobs_completed_total{plugin="TestPlugin"} 1' in text
+        assert 'arial_job_duration_seconds_count{plugin="TestPlugin"} 1' in text
+
+
+class TestMonitorDebug:
+    """/api/debug/monitor のテスト"""
+
+    def test_recent_ticks(self, app):
+        """監視ループの直近の所要時間を返す"""
+        import main
+        from core import PhaseTimer
+
+        timer = PhaseTimer("Monitor tick")
+        with timer.phase("plugins"):
+            pass
+        main.monitor_ticks.record(timer)
+
+        data = app.get("/api/debug/monitor?limit=1").json
+        assert len(data["ticks"]) == 1
+        assert "plugins" in data["ticks"][0]["phases"]
+        assert data["profiling"] is False
+
+    def test_failed_commit_does_not_stop_monitor(self, job_store):
+        """コミットに失敗した回はエラーとして記録し、監視ループは続ける"""
+        import contextlib
+
+        main = job_store
+        commits = []
+
+        @contextlib.contextmanager
+        def batch():
+            yield
+            commits.append(1)
+            if len(commits) == 1:
+                raise RuntimeError("disk I/O error")
+
+        class Stop(BaseException):
+            pass
+
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 2:
+                raise Stop
+
+        with patch.object(main.job_store, "batch", batch), patch(
+            "main.aria2_backends", None
+        ), patch("main.plugin_manager", None), patch("main.time.sleep", sleep):
+            with pytest.raises(Stop):
+                main.update_download_info()
+
+        assert len(commits) == 2
+        ticks = main.monitor_ticks.snapshot(limit=2)["ticks"]
+        assert ticks[1]["errors"] == ["tick: disk I/O error"]
+        assert ticks[0]["errors"] == []
+
+
+class TestMonitorDiff:
+    """監視ループの差分反映のテスト"""
+
+    @staticmethod
+    def download(gid, completed, speed=1024, status="active", total=4096):
+        import aria2p
+
+        return aria2p.Download(
+            None,
+            {
+                "gid": gid,
+                "status": status,
+                "totalLength": str(total),
+                "completedLength": str(completed),
+                "downloadSpeed": str(speed),
+                "dir": "/downloads",
+                "files": [{"index": "1", "path": f"/downloads/{gid}", "uris": []}],
+            },
+        )
+
+    def test_only_changed_jobs_are_updated(self, mock_aria2):
+        """変化したジョブだけリビジョンを進め、完了・消えたジョブを移動・削除する"""
+        import main
+        from core import Aria2Changes, JobSnapshots
+        from core.diff import ARIA2_FIELDS
+
+        backend = main.aria2_backends.backends[0]
+        jobs, completed = {}, {}
+        with patch("main.download_jobs", jobs), patch(
+            "main.completed_jobs", completed
+        ), patch("main.aria2_snapshots", JobSnapshots(ARIA2_FIELDS)):
+            main.apply_aria2_changes(
+                backend,
+                Aria2Changes(
+                    [
+                        self.download("a", 0),
+                        self.download("b", 0),
+                        self.download("c", 0),
+                    ],
+                    set(),
+                    True,
+                ),
+            )
+            assert set(jobs) == {"a", "b", "c"}
+            assert jobs["a"]["progress"] == 0.0 and jobs["a"]["eta"] == 4
+            since = main.job_revisions.revision
+
+            main.apply_aria2_changes(
+                backend,
+                Aria2Changes(
+                    [
+                        self.download("a", 1024),
+                        self.download("b", 0),
+                        self.download("c", 4096, status="complete"),
+                    ],
+                    set(),
+                    True,
+                ),
+            )
+            assert jobs["a"]["progress"] == 0.25
+            changed, _ = main.job_revisions.changed_since(since)
+            assert changed == {"a", "c"}
+            assert "c" not in jobs and completed["c"]["total_length"] == 4096
+
+            main.apply_aria2_changes(
+                backend, Aria2Changes([self.download("a", 1024)], set(), True)
+            )
+            assert set(jobs) == {"a"}
+
+    def test_completed_plugin_jobs_leave_memory(self, job_store):
+        """完了したプラグインのジョブはストアへ移し、プラグイン側の記録を消す"""
+        main = job_store
+        plugin = Mock()
+        plugin.active_downloads = {}
+        plugin.completed_downloads = {
+            "j1": {"filename": "f.bin", "url": "https://e.com/f", "total_bytes": 4}
+        }
+        manager = Mock()
+        manager.get_all_plugins.return_value = [plugin]
+
+        with patch("main.plugin_manager", manager), patch.dict(
+            main.completed_jobs, {}, clear=True
+        ):
+            main.sync_plugin_jobs()
+            assert plugin.completed_downloads == {}
+            assert main.completed_jobs["plugin_j1"]["name"] == "f.bin"
+
+    def test_completed_jobs_leave_registry(self, mock_aria2):
+        """完了したジョブはストアに保存したらレジストリから取り除く"""
+        import main
+        from core import Aria2Changes, JobSnapshots
+        from core.diff import ARIA2_FIELDS
+
+        backend = main.aria2_backends.backends[0]
+        with patch("main.job_registry", main.JobRegistry()), patch.dict(
+            main.download_jobs, {}, clear=True
+        ), patch.dict(main.completed_jobs, {}, clear=True), patch(
+            "main.aria2_snapshots", JobSnapshots(ARIA2_FIELDS)
+        ):
+            main.apply_aria2_changes(
+                backend, Aria2Changes([self.download("a", 0)], set(), True)
+            )
+            assert "a" in main.job_registry
+            main.apply_aria2_changes(
+                backend,
+                Aria2Changes(
+                    [self.download("a", 4096, status="complete")], set(), True
+                ),
+            )
+            assert "a" in main.completed_jobs
+            assert len(main.job_registry) == 0
@@ -0,0 +1,389 @@
+"""
+プラグインシステムのテスト
+"""
+
+import os
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from plugins.base import PluginManager
+from plugins.http_plugin import HTTPDownloadPlugin
+from plugins.journal import SegmentJournal
+from plugins.manifest import PluginSpec
+from plugins.progress import TransferMeter, iter_chunks
+from plugins.ratelimit import BandwidthLimiter, TokenBucket, parse_rate, parse_schedule
+from plugins.router import URLRouter
+from plugins.scheduler import DownloadScheduler
+from plugins.segmented import RangeNotSupported, SegmentedDownloader
+from plugins.session import SessionPool
+
+
+class TestSegmentedDownloader:
+    """分割ダウンロードエンジンのテスト"""
+
+    def test_segments_reassemble_file(self, range_server, temp_download_dir):
+        """分割して取得したファイルが元のデータと一致する"""
+        data = os.urandom(300 * 1024 + 123)
+        url = range_server(data)
+        path = os.path.join(temp_download_dir, "file.bin")
+
+        downloader = SegmentedDownloader(
+            url, path, len(data), connections=4, min_segment_size=16 * 1024
+        )
+        assert downloader.run() == len(data)
+
+        with open(path, "rb") as f:
+            assert f.read() == data
+
+    def test_server_without_ranges(self, range_server, temp_download_dir):
+        """Range非対応のサーバーでは RangeNotSupported を送出する"""
+        url = range_server(b"x" * 4096, ranges=False)
+        path = os.path.join(temp_download_dir, "file.bin")
+
+        downloader = SegmentedDownloader(
+            url, path, 4096, connections=2, min_segment_size=1024
+        )
+        with pytest.raises(RangeNotSupported):
+            downloader.run()
+
+
+class TestHTTPDownloadPlugin:
+    """HTTPダウンロードプラグインのテスト"""
+
+    def wait_for(self, plugin, job_id, timeout=10):
+        deadline = time.time() + timeout
+        while job_id in plugin.active_downloads and time.time() < deadline:
+            time.sleep(0.05)
+        return plugin.get_progress(job_id)
+
+    @pytest.mark.parametrize("ranges", [True, False])
+    def test_download(self, range_server, temp_download_dir, ranges):
+        """Range対応の有無に関わらずダウンロードが完了する"""
+        data = os.urandom(256 * 1024)
+        url = range_server(data, ranges=ranges)
+        plugin = HTTPDownloadPlugin(segments=4, min_segment_size=16 * 1024)
+
+        job_id = plugin.download(url, temp_download_dir)
+        info = self.wait_for(plugin, job_id)
+
+        assert info["status"] == "completed"
+        with open(info["file_path"], "rb") as f:
+            assert f.read() == data
+
+    def test_pause_and_resume(self, range_server, temp_download_dir):
+        """一時停止してもジャーナルから続きを取得できる"""
+        data = os.urandom(256 * 1024)
+        url = range_server(data, delay=0.03)
+        plugin = HTTPDownloadPlugin(segments=2, min_segment_size=16 * 1024)
+
+        job_id = plugin.download(url, temp_download_dir)
+        while not plugin.active_downloads[job_id].get("resumable"):
+            time.sleep(0.01)
+        time.sleep(0.05)
+
+        assert plugin.pause(job_id) is True
+        plugin._workers[job_id].join(timeout=5)
+        info = plugin.active_downloads[job_id]
+        assert info["status"] == "paused"
+        assert os.path.exists(info["file_path"] + ".arial")
+
+        assert plugin.resume(job_id) is True
+        info = self.wait_for(plugin, job_id)
+        assert info["status"] == "completed"
+        assert not os.path.exists(info["file_path"] + ".arial")
+        with open(info["file_path"], "rb") as f:
+            assert f.read() == data
+
+    def test_resume_interrupted(self, range_server, temp_download_dir):
+        """起動時にジャーナルの残っているダウンロードを再開する"""
+        data = os.urandom(64 * 1024)
+        url = range_server(data)
+        path = os.path.join(temp_download_dir, "file.bin")
+        etag = requests.head(url).headers["etag"]
+
+        # 前半だけ取得済みの状態を作る
+        with open(path, "wb") as f:
+            f.write(data[: 32 * 1024])
+        journal = SegmentJournal(path, url, len(data), etag=etag, job_id="job1")
+        journal.add_range(0, 32 * 1024)
+        journal.save()
+
+        plugin = HTTPDownloadPlugin(segments=2, min_segment_size=16 * 1024)
+        with patch.object(plugin.session, "get", wraps=plugin.session.get) as get:
+            assert plugin.resume_interrupted(temp_download_dir) == ["job1"]
+            info = self.wait_for(plugin, "job1")
+
+        assert info["status"] == "completed"
+        with open(path, "rb") as f:
+            assert f.read() == data
+        # 再開時はファイル全体を要求せず、未取得の範囲だけを取得する
+        assert all(
+            "Range" in call.kwargs.get("headers", {}) for call in get.call_args_list
+        )
+
+
+class TestTransferMeter:
+    """転送の進捗のテスト"""
+
+    def test_updates_are_throttled(self):
+        """受信ごとではなく間隔ごと（と最後）にだけジョブ情報へ反映する"""
+        info = {}
+        meter = TransferMeter(info, total_size=1000, interval=60)
+        for _ in range(100):
+            meter.add(10)
+        assert info == {}
+        meter.flush(final=True)
+        assert info["downloaded_bytes"] == 1000 and info["progress"] == 1.0
+
+    def test_speed_follows_recent_rate(self, monkeypatch):
+        """速度は全体の平均ではなく直近の転送量に追従する"""
+        clock = [0.0]
+        monkeypatch.setattr("plugins.progress.time.monotonic", lambda: clock[0])
+        info = {}
+        meter = TransferMeter(info, total_size=0, interval=1, window=2)
+        for second in range(60):
+            clock[0] += 1
+            meter.add(100 if second < 30 else 1000)
+        assert info["speed"] > 950
+        assert meter.downloaded / clock[0] == 550
+
+    def test_iter_chunks_uses_available_data(self, range_server):
+        """read1 で届いた分だけを返し、全体はそのまま復元できる"""
+        data = os.urandom(300 * 1024)
+        url = range_server(data, ranges=False, delay=0.01)
+        with requests.get(url, stream=True) as response:
+            chunks = list(iter_chunks(response, chunk_size=1024 * 1024))
+        assert b"".join(chunks) == data
+        assert len(chunks) > 1
+
+
+class TestSessionPool:
+    """共有HTTP接続プールのテスト"""
+
+    def test_plugins_share_manager_pool(self):
+        """PluginManagerの接続プールが全プラグインに設定される"""
+        pool = SessionPool(per_host=2, retries=1)
+        manager = PluginManager(session_pool=pool)
+
+        assert manager.get_session_pool() is pool
+        for plugin in manager.get_all_plugins():
+            assert plugin.session is pool.session
+
+        adapter = pool.session.get_adapter("https://example.com/")
+        assert adapter._pool_maxsize == 2
+        assert adapter.max_retries.total == 1
+
+
+class TestURLRouter:
+    """URLルーターのテスト"""
+
+    class SlowPlugin:
+        supported_schemes = ("http", "https")
+
+        def __init__(self, delay):
+            self.delay = delay
+            self.calls = 0
+
+        def can_handle(self, url):
+            self.calls += 1
+            time.sleep(self.delay)
+            return True
+
+    class SitePlugin:
+        supported_domains = ["youtube.com", "youtu.be"]
+
+    def test_domain_index_skips_probe(self):
+        """対応ドメインのURLはネットワーク確認をせずに振り分ける"""
+        slow, site = self.SlowPlugin(1.0), self.SitePlugin()
+        router = URLRouter([slow, site])
+
+        assert router.route("https://m.youtube.com/watch?v=x") is site
+        assert router.route("https://youtu.be/x") is site
+        assert router.route("https://notyoutube.com/x") is not site
+        assert router.route("ftp://example.com/file") is None
+        router.shutdown()
+
+    def test_slow_probe_does_not_block(self):
+        """遅いサーバーは待たずに仮判定を返し、結果はキャッシュされる"""
+        slow = self.SlowPlugin(0.3)
+        router = URLRouter([slow], probe_timeout=0.05)
+
+        started = time.monotonic()
+        assert router.route("http://slow.example/file") is slow
+        assert time.monotonic() - started < 0.2
+
+        time.sleep(0.4)
+        assert router.route("http://slow.example/file") is slow
+        assert slow.calls == 1
+        router.shutdown()
+
+
+class TestLazyPlugins:
+    """プラグインの遅延読み込みのテスト"""
+
+    def test_module_imported_on_first_matching_url(self, tmp_path, monkeypatch):
+        """対応ドメインのURLが来るまでプラグインのモジュールを読み込まない"""
+        (tmp_path / "lazy_site_plugin.py").write_text(
+            "class SitePlugin:\n"
+            "    def can_handle(self, url):\n"
+            "        return True\n"
+        )
+        monkeypatch.syspath_prepend(str(tmp_path))
+        monkeypatch.setattr(
+            "plugins.base.PLUGIN_MANIFEST",
+            [
+                PluginSpec(
+                    "SitePlugin",
+                    "lazy_site_plugin",
+                    "SitePlugin",
+                    supported_domains=("video.example",),
+                ),
+                PluginSpec("MissingPlugin", "missing", "X", requires=("no_such_mod",)),
+            ],
+        )
+        manager = PluginManager()
+
+        assert [spec.name for spec in manager.get_plugin_specs()] == ["SitePlugin"]
+        assert manager.get_all_plugins() == []
+        assert manager.get_plugin_for_url("https://other.example/a") is None
+        assert "lazy_site_plugin" not in sys.modules
+
+        plugin = manager.get_plugin_for_url("https://www.video.example/watch")
+        assert plugin.__class__.__name__ == "SitePlugin"
+        assert plugin.scheduler is manager.get_scheduler()
+        assert manager.get_all_plugins() == [plugin]
+        manager.router.shutdown()
+        sys.modules.pop("lazy_site_plugin", None)
+
+
+class TestDownloadScheduler:
+    """ダウンロードスケジューラーのテスト"""
+
+    def test_limits_and_priority(self):
+        """同時実行数の上限を守り、優先度の高いタスクから実行する"""
+        scheduler = DownloadScheduler(max_workers=2, per_host=1)
+        gate = threading.Event()
+        running, peak, started = [0], [0], []
+        lock = threading.Lock()
+
+        def task(name):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                started.append(name)
+            gate.wait(5)
+            with lock:
+                running[0] -= 1
+
+        tasks = [
+            scheduler.submit("a0", task, ("a0",), host="a.example"),
+            scheduler.submit("a1", task, ("a1",), host="a.example"),
+        ]
+        time.sleep(0.1)
+        # ホストごとの上限で a.example は1本まで
+        assert scheduler.stats() == {"queued": 1, "running": 1, "workers": 2}
+
+        tasks.append(scheduler.submit("b", task, ("b",), host="b.example"))
+        time.sleep(0.1)
+        tasks.append(scheduler.submit("low", task, ("low",)))
+        tasks.append(scheduler.submit("urgent", task, ("urgent",), priority=-1))
+        assert scheduler.is_queued("urgent")
+        assert scheduler.cancel("a1")
+
+        gate.set()
+        for queued in tasks:
+            assert queued.join(5)
+        assert peak[0] == 2
+        assert started == ["a0", "b", "urgent", "low"]
+        scheduler.shutdown()
+
+    def test_plugin_jobs_are_queued(self, range_server, temp_download_dir):
+        """ワーカーが埋まっている間、プラグインのジョブは queued になる"""
+        url = range_server(os.urandom(64 * 1024), delay=0.01)
+        plugin = HTTPDownloadPlugin(segments=1)
+        plugin.scheduler = DownloadScheduler(max_workers=1)
+
+        first = plugin.download(url, temp_download_dir)
+        second = plugin.download(
+            url.replace("file.bin", "other.bin"), temp_download_dir
+        )
+        assert plugin.active_downloads[second]["status"] == "queued"
+
+        assert plugin.cancel(second)
+        assert not plugin.scheduler.is_queued(second)
+        assert plugin._workers[first].join(10)
+        assert first in plugin.completed_downloads
+        plugin.scheduler.shutdown()
+
+
+class TestBandwidthLimiter:
+    """帯域制限のテスト"""
+
+    def test_shares_between_priorities(self):
+        """転送中のジョブがある優先度の間で比率に応じて分け、同じ優先度では均等に分ける"""
+        limiter = BandwidthLimiter(rate=700)
+        high = limiter.throttle("high")
+        low = limiter.throttle("low")
+        limiter.set_aria2_jobs({"g1": "normal"})
+        assert limiter.aria2_limits() == {"g1": 200}
+        assert high.bucket.rate == 400 and low.bucket.rate == 100
+
+        # 転送が終われば残りのジョブで分け直す
+        high.close()
+        limiter.set_aria2_jobs({"g1": "normal", "g2": "normal"})
+        assert limiter.aria2_limits() == {"g1": 233, "g2": 233}
+        assert low.bucket.rate == 233
+        assert limiter.status()["priorities"]["normal"]["aria2_jobs"] == 2
+
+        # 無制限にすれば待たない
+        limiter.configure(rate=0)
+        assert limiter.aria2_limits() == {"g1": 0, "g2": 0}
+        assert low.bucket.rate == 0 and low.consume(10**9)
+        low.close()
+
+    def test_schedule(self):
+        """時間帯ごとに全体の上限を切り替える（最初の時刻より前は前日の最後の時間帯）"""
+        now = [time.struct_time((2024, 1, 1, 0, 30, 0, 0, 1, -1))]
+        limiter = BandwidthLimiter(
+            schedule=parse_schedule("01:00=100,08:00=0,20:00=1M"),
+            clock=lambda: now[0],
+        )
+        assert limiter.effective_rate == 1024 * 1024
+        now[0] = time.struct_time((2024, 1, 1, 9, 0, 0, 0, 1, -1))
+        assert limiter.refresh() and limiter.effective_rate == 0
+        assert not limiter.refresh()
+        assert parse_rate("512K") == 512 * 1024 and parse_rate(0) == 0
+        with pytest.raises(ValueError):
+            parse_rate("fast")
+
+    def test_token_bucket_waits(self):
+        """バケットを超えた分は速度に応じて待ち、止められたら待機をやめる"""
+        bucket = TokenBucket(rate=0)
+        bucket.set_rate(1024 * 1024)
+        start = time.monotonic()
+        assert bucket.consume(1024 * 1024 + 512 * 1024)
+        elapsed = time.monotonic() - start
+        assert 0.4 < elapsed < 1.5
+        assert not bucket.consume(10 * 1024 * 1024, should_stop=lambda: True)
+
+    def test_limits_plugin_download(self, range_server, temp_download_dir):
+        """HTTPプラグインの分割ダウンロードも全体の上限に収まる"""
+        data = os.urandom(512 * 1024)
+        url = range_server(data)
+        plugin = HTTPDownloadPlugin(segments=2, min_segment_size=64 * 1024)
+        plugin.limiter = BandwidthLimiter(rate=256 * 1024)
+        plugin.scheduler = DownloadScheduler(max_workers=1)
+
+        start = time.monotonic()
+        job_id = plugin.download(url, temp_download_dir, priority="low")
+        assert plugin._workers[job_id].join(10)
+        assert time.monotonic() - start > 0.7
+        with open(plugin.completed_downloads[job_id]["file_path"], "rb") as f:
+            assert f.read() == data
+        assert plugin.limiter.status()["priorities"]["low"]["plugin_transfers"] == 0
+        plugin.scheduler.shutdown()